@@ -2,12 +2,16 @@
 Endpoints da API de alertas
 """
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from typing import List, Dict
 from uuid import UUID
+import asyncio
 
+from app.config import settings
 from app.models.alert import Alert, AlertCreate, AlertUpdate, AlertCheckResult
 from app.services.alert_service import alert_service
-from app.services.analytics_service import analytics_service
+from app.services.alert_scheduler import alert_scheduler
 
 router = APIRouter(prefix="/api/v1/alerts", tags=["alerts"])
 
@@ -32,7 +36,7 @@ async def create_alert(alert_data: AlertCreate):
     }
     ```
     """
-    alert = alert_service.create_alert(alert_data)
+    alert = await alert_service.create_alert(alert_data)
     return alert
 
 
@@ -44,14 +48,50 @@ async def list_alerts(enabled_only: bool = False):
     Query params:
     - enabled_only: Se true, retorna apenas alertas ativos
     """
-    alerts = alert_service.list_alerts(enabled_only=enabled_only)
+    alerts = await alert_service.list_alerts(enabled_only=enabled_only)
     return alerts
 
 
+@router.get("/stream")
+async def stream_alert_results():
+    """
+    Server-Sent Events com o resultado de cada avaliação do agendador
+    
+    Cada evento `alerts` traz `checked_at` e a lista `results` (todos os
+    alertas avaliados; `triggered` indica os disparados). Sem eventos, um
+    comentário keepalive é enviado a cada ALERT_STREAM_KEEPALIVE segundos.
+    """
+    queue = alert_scheduler.subscribe()
+    
+    async def events():
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=settings.ALERT_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"event: alerts\ndata: " + payload + b"\n\n"
+        finally:
+            alert_scheduler.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/scheduler")
+async def get_scheduler_stats():
+    """Estado do agendador de alertas (execuções, queries, assinantes do stream)"""
+    return alert_scheduler.stats()
+
+
 @router.get("/{alert_id}", response_model=Alert)
 async def get_alert(alert_id: UUID):
     """Obtém um alerta específico por ID"""
-    alert = alert_service.get_alert(alert_id)
+    alert = await alert_service.get_alert(alert_id)
     if not alert:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -67,7 +107,11 @@ async def update_alert(alert_id: UUID, alert_data: AlertUpdate):
     
     Você pode atualizar apenas os campos desejados.
     """
-    alert = alert_service.update_alert(alert_id, alert_data)
+    try:
+        alert = await alert_service.update_alert(alert_id, alert_data)
+    except ValidationError as e:
+        # Alerta resultante inválido (ex.: filtros antigos que não são mais aceitos)
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
     if not alert:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -79,7 +123,7 @@ async def update_alert(alert_id: UUID, alert_data: AlertUpdate):
 @router.delete("/{alert_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_alert(alert_id: UUID):
     """Deleta um alerta"""
-    success = alert_service.delete_alert(alert_id)
+    success = await alert_service.delete_alert(alert_id)
     if not success:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -104,45 +148,21 @@ async def check_alerts(current_metrics: Dict[str, float]):
     
     Retorna lista de alertas que foram disparados.
     """
-    results = alert_service.check_all_alerts(current_metrics)
+    results = await alert_service.check_all_alerts(current_metrics)
     return results
 
 
 @router.post("/check-current", response_model=List[AlertCheckResult])
 async def check_alerts_with_current_data():
     """
-    Verifica todos os alertas usando as métricas atuais do sistema
+    Avalia agora todos os alertas ativos com os dados atuais
     
-    Busca as métricas principais (faturamento, ticket médio, qtd vendas)
-    e verifica todos os alertas ativos.
+    Mesma avaliação do agendador (uma query por conjunto de filtros); o
+    resultado também é enviado aos clientes de /alerts/stream.
+    Retorna apenas os alertas disparados.
     """
     try:
-        # Buscar métricas atuais do sistema
-        from app.models.schemas import AnalyticsQueryRequest
-        
-        query_request = AnalyticsQueryRequest(
-            metrics=["faturamento", "ticket_medio", "qtd_vendas", "tempo_medio_entrega"],
-            dimensions=[]
-        )
-        
-        result = await analytics_service.query(query_request)
-        
-        if not result.data or len(result.data) == 0:
-            # Sem dados, retornar lista vazia
-            return []
-        
-        # Extrair métricas da primeira linha
-        current_metrics = {
-            "faturamento": float(result.data[0].get("faturamento", 0)),
-            "ticket_medio": float(result.data[0].get("ticket_medio", 0)),
-            "qtd_vendas": float(result.data[0].get("qtd_vendas", 0)),
-            "tempo_medio_entrega": float(result.data[0].get("tempo_medio_entrega", 0))
-        }
-        
-        # Verificar alertas
-        results = alert_service.check_all_alerts(current_metrics)
-        
-        # Retornar apenas alertas disparados
+        results = await alert_scheduler.evaluate()
         return [r for r in results if r.triggered]
         
     except Exception as e:
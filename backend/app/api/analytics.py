@@ -1,30 +1,62 @@
 """
 Analytics API Routes
 """
-from fastapi import APIRouter, Query, HTTPException
-from typing import Optional, List
+from fastapi import APIRouter, Query, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional, List, Literal
 from datetime import date
+from psycopg.errors import QueryCanceled
+import asyncio
 import logging
+import time
 
 from app.models.schemas import (
     AnalyticsQueryRequest,
     AnalyticsQueryResponse,
+    AnalyticsExportRequest,
+    AnalyticsBatchRequest,
+    AnalyticsBatchResponse,
+    LiveSubscribeRequest,
+    QueryMetadata,
     KPIDashboard,
     DimensionValuesResponse,
-    DimensionValue,
     PeriodComparisonResponse
 )
 from app.services.analytics_service import analytics_service
 from app.services.churn_service import churn_service
-from app.cache.redis_client import redis_cache
-from app.db.database import db
+from app.services.live_updates import live_hub
+from app.services.rolling_aggregates import rolling_aggregates
+from app.services import columnar
+from app.services.pagination import InvalidCursor
+from app.cache.redis_client import redis_cache, store_invalidation_tags
+from app.cache.serializers import json_dumps
+from app.cache.single_flight import single_flight
+from app.cache.refresh import cache_refresher
+from app.config import settings
+from app.db.database import db, statement_timeout
+from app.db.customer_state import CustomerStateNotReady
+from app.db.summaries import summary_refresher
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/v1/analytics", tags=["Analytics"])
 
 
+def _error_status(e: Exception) -> int:
+    """504 when Postgres cancelled the query (statement_timeout), 503 while customer_state catches up, 400 for a bad cursor, 500 otherwise"""
+    if isinstance(e, QueryCanceled):
+        return 504
+    if isinstance(e, CustomerStateNotReady):
+        return 503
+    if isinstance(e, InvalidCursor):
+        return 400
+    return 500
+
+
 @router.post("/query", response_model=AnalyticsQueryResponse)
-async def execute_analytics_query(request: AnalyticsQueryRequest):
+async def execute_analytics_query(
+    request: AnalyticsQueryRequest,
+    accept: Optional[str] = Header(None)
+):
     """
     Execute custom analytics query with security validation
     
@@ -33,6 +65,13 @@ async def execute_analytics_query(request: AnalyticsQueryRequest):
     - Validates all inputs against whitelists
     - Prevents SQL injection through parameterized queries
     
+    Response formats (Accept header):
+    - application/json (default)
+    - application/vnd.apache.arrow.stream: Arrow IPC stream, one column per field
+    - application/vnd.apache.parquet: Parquet file
+    
+    Columnar formats require pyarrow on the server (406 otherwise).
+    
     Example request:
     ```json
     {
@@ -51,35 +90,151 @@ async def execute_analytics_query(request: AnalyticsQueryRequest):
     ```
     """
     try:
-        # Security validation: Check if metrics are in whitelist
-        allowed_metrics = set(analytics_service.METRICS_MAP.keys())
-        for metric in request.metrics:
-            # Allow custom SQL metrics only if they match pattern "FUNCTION(column) as alias"
-            if metric not in allowed_metrics and not _is_safe_custom_metric(metric):
-                logger.error(f"❌ Invalid metric rejected: '{metric}'")
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Invalid metric '{metric}'. Use only predefined metrics or safe aggregations."
-                )
+        _validate_query_request(request)
         
-        # Security validation: Check if dimensions are in whitelist
-        allowed_dimensions = set(analytics_service.DIMENSIONS_MAP.keys())
-        for dimension in request.dimensions:
-            if dimension not in allowed_dimensions:
+        columnar_format = columnar.negotiate(accept)
+        if columnar_format:
+            if not columnar.available():
                 raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid dimension '{dimension}'. Use only predefined dimensions."
+                    status_code=406,
+                    detail="Respostas Arrow/Parquet exigem pyarrow no servidor; use application/json"
                 )
+            with statement_timeout(settings.DB_TIMEOUT_QUERY_MS):
+                payload = await analytics_service.execute_columnar(request, columnar_format)
+            return Response(content=payload, media_type=columnar.MEDIA_TYPES[columnar_format])
+        
+        # Fast path: payload já serializado no cache local/Redis, sem Pydantic
+        cache_key_data = request.model_dump(exclude_none=True)
+        entry = await redis_cache.get_entry("analytics:query", cache_key_data)
+        if entry is not None:
+            # Misses são contados uma vez em execute_query
+            cache_refresher.record("analytics:query", cache_key_data)
+            payload, stale = entry
+            if stale:
+                cache_refresher.trigger("analytics:query", cache_key_data)
+            return Response(content=payload, media_type="application/json")
         
         logger.debug(f"📥 Query Request: metrics={request.metrics}, dimensions={request.dimensions}, filters={request.filters}, order_by={request.order_by}")
-        result = await analytics_service.execute_query(request)
+        with statement_timeout(settings.DB_TIMEOUT_QUERY_MS):
+            result = await analytics_service.execute_query(request)
         logger.debug(f"✅ Query Success: {len(result.data)} rows in {result.metadata.query_time_ms}ms")
         return result
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"❌ Query Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Query execution error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"Query execution error: {str(e)}")
+
+
+@router.post("/query/batch", response_model=AnalyticsBatchResponse)
+async def execute_analytics_batch(request: AnalyticsBatchRequest):
+    """
+    Execute several analytics queries in one round trip
+    
+    Queries with the same filters and join graph are merged into a single
+    GROUPING SETS statement (one scan of sales); the others run concurrently.
+    Results come back in the same order as `queries`.
+    
+    Example request:
+    ```json
+    {
+        "queries": [
+            {"metrics": ["faturamento", "qtd_vendas"], "dimensions": ["canal_venda"], "limit": 10},
+            {"metrics": ["qtd_vendas"], "dimensions": ["hora", "dia_semana"], "limit": 200}
+        ]
+    }
+    ```
+    """
+    try:
+        start_time = time.time()
+        for query in request.queries:
+            _validate_query_request(query)
+        
+        logger.debug(f"📥 Batch Request: {len(request.queries)} queries")
+        with statement_timeout(settings.DB_TIMEOUT_QUERY_MS):
+            results = await analytics_service.execute_batch(request.queries)
+        query_time_ms = (time.time() - start_time) * 1000
+        logger.debug(f"✅ Batch Success: {len(results)} results in {query_time_ms:.2f}ms")
+        
+        return AnalyticsBatchResponse(
+            results=results,
+            metadata=QueryMetadata(
+                total_rows=sum(result.metadata.total_rows for result in results),
+                query_time_ms=round(query_time_ms, 2),
+                cached=all(result.metadata.cached for result in results)
+            )
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Batch Error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"Batch execution error: {str(e)}")
+
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+@router.post("/query/export")
+async def export_analytics_query(
+    request: AnalyticsExportRequest,
+    format: Literal["csv", "ndjson"] = Query("csv", description="Export format")
+):
+    """
+    Stream a custom analytics query as CSV or NDJSON
+    
+    Same request body as /query, but `limit` is optional and uncapped: rows are
+    read with a server-side cursor and sent in chunks, so exports of any size
+    use constant memory on the API. SQL errors before the first rows answer
+    with an error status; an error mid-stream aborts the download.
+    
+    Example:
+    ```
+    POST /api/v1/analytics/query/export?format=csv
+    {"metrics": ["faturamento"], "dimensions": ["data", "nome_loja"]}
+    ```
+    """
+    _validate_query_request(request)
+    logger.debug(f"📤 Export Request ({format}): metrics={request.metrics}, dimensions={request.dimensions}")
+    
+    try:
+        # A query roda (e o primeiro lote chega) antes dos cabeçalhos: erro de SQL vira 4xx/5xx
+        body = await analytics_service.stream_query(request, format)
+    except Exception as e:
+        logger.error(f"❌ Export Error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"Export error: {str(e)}")
+    
+    filename = f"analytics-export.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+def _validate_query_request(request: AnalyticsQueryRequest):
+    """Security validation: only whitelisted metrics/dimensions or safe aggregations"""
+    # Security validation: Check if metrics are in whitelist
+    allowed_metrics = set(analytics_service.METRICS_MAP.keys())
+    for metric in request.metrics:
+        # Allow custom SQL metrics only if they match pattern "FUNCTION(column) as alias"
+        if metric not in allowed_metrics and not _is_safe_custom_metric(metric):
+            logger.error(f"❌ Invalid metric rejected: '{metric}'")
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Invalid metric '{metric}'. Use only predefined metrics or safe aggregations."
+            )
+    
+    # Security validation: Check if dimensions are in whitelist
+    allowed_dimensions = set(analytics_service.DIMENSIONS_MAP.keys())
+    for dimension in request.dimensions:
+        if dimension not in allowed_dimensions:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid dimension '{dimension}'. Use only predefined dimensions."
+            )
 
 
 def _is_safe_custom_metric(metric: str) -> bool:
@@ -112,10 +267,15 @@ async def get_kpi_dashboard(
     end_date: Optional[date] = Query(None, description="End date filter"),
     canal_venda: Optional[List[str]] = Query(None, description="Filter by sales channel"),
     nome_loja: Optional[List[str]] = Query(None, description="Filter by store name"),
-    nome_produto: Optional[List[str]] = Query(None, description="Filter by product name")
+    nome_produto: Optional[List[str]] = Query(None, description="Filter by product name"),
+    hours: Optional[int] = Query(None, ge=1, description="Only the last N hours (instead of a date range)")
 ):
     """
     Get main KPI dashboard with key metrics and optional filters
+    
+    Today and the last `hours` hours are served from the rolling in-memory
+    aggregates (metadata.source = 'rolling_aggregates'), unless filtered by
+    product.
     """
     try:
         logger.debug(f"📊 KPI Dashboard Request:")
@@ -123,6 +283,7 @@ async def get_kpi_dashboard(
         logger.debug(f"  Canal: {canal_venda}")
         logger.debug(f"  Loja: {nome_loja}")
         logger.debug(f"  Produto: {nome_produto}")
+        logger.debug(f"  Horas: {hours}")
         
         # Build filters dict
         filters = {}
@@ -135,12 +296,13 @@ async def get_kpi_dashboard(
         
         logger.debug(f"  Filters dict: {filters}")
         
-        result = await analytics_service.get_kpi_dashboard(start_date, end_date, filters)
+        with statement_timeout(settings.DB_TIMEOUT_KPIS_MS):
+            result = await analytics_service.get_kpi_dashboard(start_date, end_date, filters, hours)
         logger.debug(f"✅ KPI Result: {result.kpis[0].value if result.kpis else 'no data'}")
         return result
     except Exception as e:
         logger.error(f"❌ KPI Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"KPI calculation error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"KPI calculation error: {str(e)}")
 
 
 @router.get("/compare", response_model=PeriodComparisonResponse)
@@ -172,47 +334,22 @@ async def compare_periods(
         
         logger.debug(f"🔍 Applied filters: {filters}")
         
-        result = await analytics_service.compare_periods(
-            base_start, base_end, compare_start, compare_end, filters
-        )
+        with statement_timeout(settings.DB_TIMEOUT_KPIS_MS):
+            result = await analytics_service.compare_periods(
+                base_start, base_end, compare_start, compare_end, filters
+            )
         logger.debug(f"✅ Comparison Success: {len(result.comparisons)} metrics compared")
         return result
     except Exception as e:
         logger.error(f"❌ Comparison Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Period comparison error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"Period comparison error: {str(e)}")
 
 
 @router.get("/dimensions/stores", response_model=DimensionValuesResponse)
 async def get_stores():
     """Get list of available stores"""
     try:
-        query = """
-        SELECT 
-            s.id,
-            s.name as label,
-            COUNT(DISTINCT sa.id) as count
-        FROM stores s
-        LEFT JOIN sales sa ON s.id = sa.store_id
-        WHERE s.is_active = true
-        GROUP BY s.id, s.name
-        ORDER BY s.name
-        """
-        rows = await db.fetch_all(query)
-        
-        values = [
-            DimensionValue(
-                id=row['id'],
-                label=row['label'],
-                count=row['count']
-            )
-            for row in rows
-        ]
-        
-        return DimensionValuesResponse(
-            dimension="stores",
-            values=values,
-            total=len(values)
-        )
+        return await analytics_service.get_stores()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -221,32 +358,7 @@ async def get_stores():
 async def get_channels():
     """Get list of available channels"""
     try:
-        query = """
-        SELECT 
-            c.id,
-            c.name as label,
-            COUNT(DISTINCT s.id) as count
-        FROM channels c
-        LEFT JOIN sales s ON c.id = s.channel_id
-        GROUP BY c.id, c.name
-        ORDER BY c.name
-        """
-        rows = await db.fetch_all(query)
-        
-        values = [
-            DimensionValue(
-                id=row['id'],
-                label=row['label'],
-                count=row['count']
-            )
-            for row in rows
-        ]
-        
-        return DimensionValuesResponse(
-            dimension="channels",
-            values=values,
-            total=len(values)
-        )
+        return await analytics_service.get_channels()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -255,33 +367,7 @@ async def get_channels():
 async def get_products(limit: int = Query(100, le=500)):
     """Get list of top products by sales volume"""
     try:
-        query = f"""
-        SELECT 
-            p.id,
-            p.name as label,
-            COUNT(DISTINCT ps.id) as count
-        FROM products p
-        LEFT JOIN product_sales ps ON p.id = ps.product_id
-        GROUP BY p.id, p.name
-        ORDER BY count DESC
-        LIMIT {limit}
-        """
-        rows = await db.fetch_all(query)
-        
-        values = [
-            DimensionValue(
-                id=row['id'],
-                label=row['label'],
-                count=row['count']
-            )
-            for row in rows
-        ]
-        
-        return DimensionValuesResponse(
-            dimension="products",
-            values=values,
-            total=len(values)
-        )
+        return await analytics_service.get_products(limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -290,34 +376,7 @@ async def get_products(limit: int = Query(100, le=500)):
 async def get_regions():
     """Get list of delivery regions (neighborhoods)"""
     try:
-        query = """
-        SELECT 
-            da.neighborhood as id,
-            CONCAT(da.neighborhood, ' - ', da.city) as label,
-            COUNT(DISTINCT s.id) as count
-        FROM delivery_addresses da
-        JOIN sales s ON da.sale_id = s.id
-        WHERE da.neighborhood IS NOT NULL
-        GROUP BY da.neighborhood, da.city
-        ORDER BY count DESC
-        LIMIT 100
-        """
-        rows = await db.fetch_all(query)
-        
-        values = [
-            DimensionValue(
-                id=row['id'],
-                label=row['label'],
-                count=row['count']
-            )
-            for row in rows
-        ]
-        
-        return DimensionValuesResponse(
-            dimension="regions",
-            values=values,
-            total=len(values)
-        )
+        return await analytics_service.get_regions()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -328,6 +387,106 @@ async def health_check():
     return {"status": "healthy", "service": "analytics-api"}
 
 
+@router.get("/db/stats")
+async def get_database_stats():
+    """
+    Connection pool metrics per lane
+    
+    - interactive: dashboard queries (/query, /kpis, /compare, dimensions)
+    - heavy: churn/RFM analyses and exports
+    
+    Each lane reports size, connections in use, queued requests, wait time and
+    rejections (queue full or timed out waiting for a connection).
+    """
+    return db.get_stats()
+
+
+@router.get("/db/freshness")
+async def get_data_freshness():
+    """
+    Freshness of the summary tables behind the dashboard
+    
+    Per table: last refresh, its duration, days rewritten, and how many
+    sales (and for how long) are not reflected yet.
+    """
+    try:
+        return await summary_refresher.get_freshness()
+    except Exception as e:
+        logger.error(f"❌ Freshness Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get data freshness: {str(e)}")
+
+
+@router.get("/rolling/stats")
+async def get_rolling_stats():
+    """Rolling KPI aggregates: watermark, buckets per granularity, polls and requests answered"""
+    return rolling_aggregates.stats()
+
+
+@router.post("/live")
+async def live_updates(request: LiveSubscribeRequest):
+    """
+    Server-Sent Events with the data of a set of dashboard widgets
+    
+    Each subscription carries a widget `id` and either a /query body (`query`)
+    or the /kpis parameters (`kpis`). The stream starts with one `update` event
+    per widget (`{"id": ..., "result": ...}`, result shaped like the matching
+    endpoint) and then sends an event only when a widget's data changes, checked
+    every LIVE_REFRESH_INTERVAL seconds. Widgets showing the same query share a
+    single computation across every open stream. A widget whose query fails
+    gets an `error` event (`{"id": ..., "detail": ...}`) and keeps its last
+    data; the other widgets keep updating.
+    
+    Example:
+    ```
+    POST /api/v1/analytics/live
+    {"subscriptions": [{"id": "kpis", "kpis": {"start_date": "2025-01-01"}}]}
+    ```
+    """
+    for subscription in request.subscriptions:
+        if (subscription.query is None) == (subscription.kpis is None):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Subscription '{subscription.id}' must have exactly one of 'query' or 'kpis'"
+            )
+        if subscription.query is not None:
+            _validate_query_request(subscription.query)
+    
+    async def events():
+        # Registrado só quando o stream começa: se o cliente sair antes, nada fica assinado
+        queue, keys = live_hub.subscribe(request.subscriptions)
+        try:
+            try:
+                await live_hub.snapshot(queue, keys)
+            except Exception as e:
+                logger.error(f"❌ Live snapshot Error: {str(e)}")
+                yield b"event: error\ndata: " + json_dumps({"detail": str(e)}) + b"\n\n"
+                return
+            while True:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), timeout=settings.ALERT_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if frame is None:
+                    # Cliente lento: encerrar para ele reconectar com um snapshot
+                    return
+                yield frame
+        finally:
+            live_hub.unsubscribe(queue, keys)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/live/stats")
+async def get_live_stats():
+    """Live updates: distinct queries, open streams, refresh ticks and events sent"""
+    return live_hub.stats()
+
+
 # ============================================================================
 # CHURN ANALYSIS ENDPOINTS
 # ============================================================================
@@ -343,37 +502,51 @@ async def get_churn_metrics(
     """
     try:
         logger.debug(f"📊 Churn Metrics Request: days_inactive={days_inactive}")
-        result = await churn_service.get_churn_metrics(days_inactive=days_inactive)
+        with statement_timeout(settings.DB_TIMEOUT_CHURN_MS):
+            result = await churn_service.get_churn_metrics(days_inactive=days_inactive)
         logger.debug(f"✅ Churn Metrics Success: {result['churn_rate']}% churn rate")
         return result
     except Exception as e:
         logger.error(f"❌ Churn Metrics Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Churn metrics error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"Churn metrics error: {str(e)}")
 
 
 @router.get("/churn/at-risk")
 async def get_at_risk_customers(
     min_purchases: int = Query(2, description="Minimum purchases to consider"),
     days_inactive: int = Query(30, description="Days since last purchase"),
-    limit: int = Query(100, description="Maximum results")
+    limit: int = Query(100, ge=1, le=1000, description="Maximum results"),
+    offset: int = Query(0, ge=0, description="Results to skip (pagination)"),
+    sort_by: str = Query('days_since_last_purchase', description="days_since_last_purchase, risk_score, lifetime_value or total_purchases"),
+    order: str = Query('desc', pattern="^(asc|desc)$", description="Sort direction: asc or desc"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (keyset pagination)")
 ):
     """
     Get list of customers at risk of churning
     
     Returns customers who haven't purchased recently but have good purchase history
+    (one page, the total number of matching customers and next_cursor for the
+    following page; with a cursor, offset is ignored)
     """
     try:
-        logger.debug(f"📊 At-Risk Customers Request: min_purchases={min_purchases}, days_inactive={days_inactive}")
-        result = await churn_service.get_at_risk_customers(
-            min_purchases=min_purchases,
-            days_inactive=days_inactive,
-            limit=limit
-        )
-        logger.debug(f"✅ At-Risk Customers Success: {len(result)} customers found")
-        return {"customers": result, "total": len(result)}
+        logger.debug(f"📊 At-Risk Customers Request: min_purchases={min_purchases}, days_inactive={days_inactive}, sort_by={sort_by} {order}, offset={offset}")
+        with statement_timeout(settings.DB_TIMEOUT_CHURN_MS):
+            result = await churn_service.get_at_risk_customers(
+                min_purchases=min_purchases,
+                days_inactive=days_inactive,
+                limit=limit,
+                offset=offset,
+                sort_by=sort_by,
+                descending=order == 'desc',
+                cursor=cursor
+            )
+        logger.debug(f"✅ At-Risk Customers Success: {len(result['customers'])} of {result['total']} customers")
+        return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"❌ At-Risk Customers Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"At-risk customers error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"At-risk customers error: {str(e)}")
 
 
 @router.get("/churn/rfm-segments")
@@ -385,12 +558,13 @@ async def get_rfm_segmentation():
     """
     try:
         logger.debug("📊 RFM Segmentation Request")
-        result = await churn_service.get_rfm_segmentation()
+        with statement_timeout(settings.DB_TIMEOUT_CHURN_MS):
+            result = await churn_service.get_rfm_segmentation()
         logger.debug(f"✅ RFM Segmentation Success: {len(result)} segments found")
         return {"segments": result, "total": len(result)}
     except Exception as e:
         logger.error(f"❌ RFM Segmentation Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"RFM segmentation error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"RFM segmentation error: {str(e)}")
 
 
 @router.get("/churn/trend")
@@ -406,16 +580,17 @@ async def get_churn_trend(
     """
     try:
         logger.debug(f"📊 Churn Trend Request: start={start_date}, end={end_date}, granularity={granularity}")
-        result = await churn_service.get_churn_trend(
-            start_date=start_date,
-            end_date=end_date,
-            granularity=granularity
-        )
+        with statement_timeout(settings.DB_TIMEOUT_CHURN_MS):
+            result = await churn_service.get_churn_trend(
+                start_date=start_date,
+                end_date=end_date,
+                granularity=granularity
+            )
         logger.debug(f"✅ Churn Trend Success: {len(result)} periods analyzed")
         return {"data": result, "total": len(result)}
     except Exception as e:
         logger.error(f"❌ Churn Trend Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Churn trend error: {str(e)}")
+        raise HTTPException(status_code=_error_status(e), detail=f"Churn trend error: {str(e)}")
 
 
 # ============================================================================
@@ -447,6 +622,8 @@ async def get_cache_stats():
     """
     try:
         stats = await redis_cache.get_stats()
+        stats["single_flight"] = single_flight.stats()
+        stats["refresh"] = cache_refresher.stats()
         logger.info(f"📊 Cache Stats: {stats.get('total_keys', 0)} keys, {stats.get('memory_used_mb', 0):.2f} MB")
         return stats
     except Exception as e:
@@ -467,23 +644,38 @@ async def clear_cache(
     Common patterns:
     - "analytics:*" - Clear all analytics cache
     - "analytics:query:*" - Clear only query cache
-    - "*" - Clear entire cache (use with caution!)
+    - "*" - Clear every cached result
+    
+    Prefix patterns like these are O(1): they bump a generation counter and the
+    old entries expire on their own. Any other glob falls back to SCAN + UNLINK.
     
     Example response:
     ```json
     {
-        "deleted": 42,
+        "deleted": null,
         "pattern": "analytics:query:*",
-        "message": "Successfully deleted 42 keys"
+        "mode": "generation",
+        "message": "Invalidated every key matching analytics:query:*"
     }
     ```
     """
     try:
+        if redis_cache.scope_for_pattern(pattern) is not None:
+            await redis_cache.clear_pattern(pattern)
+            logger.info(f"🗑️ Cache Cleared: generation bumped (pattern: {pattern})")
+            return {
+                "deleted": None,
+                "pattern": pattern,
+                "mode": "generation",
+                "message": f"Invalidated every key matching {pattern}"
+            }
+        
         deleted = await redis_cache.clear_pattern(pattern)
         logger.info(f"🗑️ Cache Cleared: {deleted} keys deleted (pattern: {pattern})")
         return {
             "deleted": deleted,
             "pattern": pattern,
+            "mode": "scan",
             "message": f"Successfully deleted {deleted} keys"
         }
     except Exception as e:
@@ -491,6 +683,47 @@ async def clear_cache(
         raise HTTPException(status_code=500, detail=f"Failed to clear cache: {str(e)}")
 
 
+@router.post("/cache/invalidate")
+async def invalidate_cache_tables(
+    table: List[str] = Query(..., description="Tables whose cached results must be dropped (e.g., 'sales', 'stores')"),
+    store_id: Optional[int] = Query(None, description="Only invalidate sales of this store")
+):
+    """
+    Invalidate every cached result that depends on the given tables
+    
+    One INCR per tag, independent of the cache size. With `store_id`, `sales`
+    is invalidated only for results filtered by that store (by id or name) and
+    for unfiltered results; other stores keep their cache. Other tables are
+    always invalidated entirely.
+    
+    Example:
+    ```
+    POST /api/v1/analytics/cache/invalidate?table=sales&store_id=12
+    POST /api/v1/analytics/cache/invalidate?table=stores&table=channels
+    ```
+    """
+    try:
+        tags = []
+        for name in table:
+            if name == "sales" and store_id is not None:
+                store = await db.fetch_one("SELECT name FROM stores WHERE id = %s", store_id)
+                stores = [store_id] + ([store["name"]] if store else [])
+                tags.extend(store_invalidation_tags("sales", stores))
+            else:
+                tags.append(name)
+        
+        generations = await redis_cache.invalidate_tags(tags)
+        logger.info(f"🗑️ Cache Invalidated: {tags}")
+        return {
+            "tags": tags,
+            "generations": generations,
+            "message": f"Invalidated {len(tags)} tags"
+        }
+    except Exception as e:
+        logger.error(f"❌ Cache Invalidate Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to invalidate cache: {str(e)}")
+
+
 @router.delete("/cache/key")
 async def delete_cache_key(
     prefix: str = Query(..., description="Cache key prefix (e.g., 'analytics:query')"),
@@ -0,0 +1,56 @@
+"""
+ASGI middleware
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    Cancel the request handler as soon as the HTTP client disconnects
+
+    Handlers only notice a closed connection when they write the response, so
+    an abandoned /query or /churn/trend would keep its SQL running and hold a
+    pooled connection. Cancelling the handler task propagates into psycopg,
+    which cancels the query on the server (shared single-flight executions are
+    cancelled when their last waiter goes away).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Todas as mensagens passam por esta fila: o listener precisa ler
+        # receive() para perceber o disconnect sem roubar o body do handler
+        messages: asyncio.Queue = asyncio.Queue()
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send))
+        disconnected = False
+
+        async def listen():
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not handler.done():
+                        disconnected = True
+                        logger.info(f"🔌 Client disconnected, cancelling {scope['method']} {scope['path']}")
+                        handler.cancel()
+                    return
+
+        listener = asyncio.ensure_future(listen())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected:
+                # Cancelamento vindo de fora (ex.: shutdown)
+                handler.cancel()
+                raise
+        finally:
+            listener.cancel()
@@ -0,0 +1,134 @@
+"""
+Cache decorator for service methods
+Aplica o cache (local + Redis, stale-while-revalidate, single-flight) a
+qualquer método async de serviço, com TTL e tags por endpoint
+"""
+import functools
+import inspect
+import json
+import typing
+from datetime import date, datetime
+from typing import Any, Callable, Iterable, List, Optional, Type, Union
+
+from pydantic import BaseModel, TypeAdapter
+
+from app.cache.redis_client import redis_cache
+from app.cache.refresh import cache_refresher
+from app.cache.single_flight import single_flight
+from app.models.schemas import QueryMetadata
+
+
+def normalize_cache_data(value: Any) -> Any:
+    """
+    Normalize call arguments so equivalent calls share a key
+
+    Dates become ISO strings and lists of scalars are sorted (filter value
+    order doesn't change the result); dict key order is handled by the
+    key hash (sort_keys).
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: normalize_cache_data(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [normalize_cache_data(item) for item in value]
+        if all(isinstance(item, (str, int, float)) for item in items):
+            try:
+                return sorted(items)
+            except TypeError:
+                return items
+        return items
+    return value
+
+
+def _mark_cached(result: Any) -> Any:
+    """Copy of a response model with metadata.cached = True."""
+    metadata = getattr(result, "metadata", None)
+    if isinstance(result, BaseModel) and isinstance(metadata, QueryMetadata):
+        return result.model_copy(update={"metadata": metadata.model_copy(update={"cached": True})})
+    return result
+
+
+def cached(
+    prefix: str,
+    ttl: Callable[[], int],
+    tags: Union[Iterable[str], Callable[[dict], List[str]]],
+    model: Optional[Type[BaseModel]] = None
+):
+    """
+    Cache the result of an async service method
+
+    Args:
+        prefix: Cache key prefix (e.g. 'analytics:kpis')
+        ttl: Callable returning the soft TTL in seconds (read at call time so
+            settings can be overridden)
+        tags: Tables the result depends on (see RedisCache.invalidate_tags), or a
+            callable building them from the normalized arguments (e.g. to scope
+            a result to the stores it filters on)
+        model: Pydantic model of the result; payloads are validated straight
+            from JSON on a hit. Without it, the result must be JSON-serializable.
+    """
+    tags_for = tags if callable(tags) else (lambda data, tags=list(tags): tags)
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        hints = typing.get_type_hints(fn)
+        # Reidrata os argumentos a partir do JSON (ex.: datas) no refresh em background
+        adapters = {
+            name: TypeAdapter(hints[name])
+            for name in signature.parameters
+            if name != "self" and name in hints
+        }
+
+        def serialize(result: Any) -> str:
+            result = _mark_cached(result)
+            if isinstance(result, BaseModel):
+                return result.model_dump_json()
+            return json.dumps(result, default=str)
+
+        def deserialize(payload: bytes) -> Any:
+            if model is not None:
+                return model.model_validate_json(payload)
+            return json.loads(payload)
+
+        async def compute(instance, data: dict) -> Any:
+            # Gerações lidas antes da consulta: uma invalidação concorrente
+            # faz o resultado já nascer inválido
+            generations = await redis_cache.generations(prefix, tags_for(data))
+            kwargs = {
+                name: adapters[name].validate_python(value) if name in adapters else value
+                for name, value in data.items()
+            }
+            result = await fn(instance, **kwargs)
+            await redis_cache.set(prefix, data, serialize(result), ttl=ttl(), generations=generations)
+            return result
+
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            data = normalize_cache_data({
+                name: value for name, value in bound.arguments.items() if name != "self"
+            })
+
+            cache_refresher.register(prefix, lambda refresh_data: compute(self, refresh_data))
+            cache_refresher.record(prefix, data)
+
+            entry = await redis_cache.get_entry(prefix, data)
+            if entry is not None:
+                payload, stale = entry
+                if stale:
+                    cache_refresher.trigger(prefix, data)
+                try:
+                    return deserialize(payload)
+                except Exception as e:
+                    print(f"⚠️ Payload de cache inválido ({prefix}), recalculando: {e}")
+
+            return await single_flight.do(
+                redis_cache.key_for(prefix, data),
+                lambda: compute(self, data)
+            )
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,94 @@
+"""
+In-process LRU/TTL cache
+Primeiro nível de cache (por worker) na frente do Redis, guardando os
+payloads já serializados para evitar round trips e re-serialização
+"""
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import Optional, Tuple
+
+
+class LocalCache:
+    """Size-bounded LRU cache of serialized payloads with per-entry TTL."""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024, default_ttl: int = 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        # key -> (expires_at, payload)
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the payload for key if present and not expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, payload = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def set(self, key: str, payload: bytes, ttl: Optional[float] = None):
+        """Store a payload, evicting least recently used entries if needed."""
+        if len(payload) > self.max_bytes:
+            return
+
+        ttl = self.default_ttl if ttl is None else min(ttl, self.default_ttl)
+        if ttl <= 0:
+            return
+
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, payload)
+        self._size += len(payload)
+
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        """Remove a single key."""
+        self._remove(key)
+
+    def delete_pattern(self, pattern: str) -> int:
+        """Remove keys matching a Redis-style glob pattern."""
+        keys = [key for key in self._entries if fnmatchcase(key, pattern)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        """Remove every entry."""
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self) -> dict:
+        """Hit/miss counters and occupancy."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) * 100 if lookups else 0.0
+        }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
@@ -2,18 +2,72 @@
 Redis Cache Client
 Gerencia cache de queries do analytics para melhorar performance
 """
+import asyncio
 import json
 import hashlib
-from typing import Any, Optional
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, unquote
 from redis import asyncio as aioredis
 from app.config import settings
+from app.cache.local_cache import LocalCache
+from app.cache import serializers
+
+# Canal pub/sub usado para invalidar o cache local de todos os workers
+INVALIDATION_CHANNEL = "analytics:cache:invalidate"
+
+# Contador de geração por tag: invalidar uma tag é um INCR (O(1), sem SCAN).
+# Cada entrada grava as gerações das suas tags e deixa de valer quando
+# qualquer uma delas muda; as chaves antigas expiram sozinhas pelo TTL.
+GENERATION_PREFIX = "cache:gen:"
+# Tag presente em todas as entradas (limpeza total)
+GLOBAL_TAG = "*"
+
+# Cabeçalho com o instante do soft TTL (stale-while-revalidate)
+SWR_HEADER = b"swr:"
+# Início do carimbo de gerações dentro do cabeçalho: swr:<soft>:@<tag>#<gen>,...|<payload>
+STAMP_MARKER = b"@"
+STAMP_END = b"|"
+
+
+def store_tags(table: str, stores: Optional[Iterable[Any]] = None) -> List[str]:
+    """
+    Tags de um resultado que lê `table`, opcionalmente restrito a algumas lojas.
+    
+    Resultados filtrados por loja dependem de '<table>@store=<loja>'; os demais
+    dependem de '<table>@store=*'. Assim invalidar as vendas de uma loja não
+    derruba o cache das outras lojas.
+    """
+    if stores:
+        return [table] + [f"{table}@store={store}" for store in stores]
+    return [table, f"{table}@store=*"]
+
+
+def store_invalidation_tags(table: str, stores: Iterable[Any]) -> List[str]:
+    """Tags a incrementar quando `table` muda só para as lojas informadas."""
+    return [f"{table}@store=*"] + [f"{table}@store={store}" for store in stores]
+
 
 class RedisCache:
     """Cliente Redis para cache de queries."""
     
     def __init__(self):
         self.redis: Optional[aioredis.Redis] = None
+        # Cliente sem decode_responses para os valores do cache (formato binário)
+        self.binary: Optional[aioredis.Redis] = None
         self.default_ttl = 300  # 5 minutos
+        self.local: Optional[LocalCache] = None
+        if settings.LOCAL_CACHE_ENABLED:
+            self.local = LocalCache(
+                max_entries=settings.LOCAL_CACHE_MAX_ENTRIES,
+                max_bytes=settings.LOCAL_CACHE_MAX_BYTES,
+                default_ttl=settings.LOCAL_CACHE_TTL
+            )
+        self._invalidation_task: Optional[asyncio.Task] = None
+        # TTL local para valores sem cabeçalho de soft TTL
+        self.local_ttl_fallback = settings.LOCAL_CACHE_TTL
+        # tag -> (lido em, geração); atualizado via pub/sub e relido após CACHE_GENERATION_TTL
+        self._generations: Dict[str, Tuple[float, int]] = {}
     
     async def connect(self):
         """Conectar ao Redis."""
@@ -25,14 +79,26 @@ class RedisCache:
                 socket_connect_timeout=5
             )
             await self.redis.ping()
+            self.binary = await aioredis.from_url(
+                settings.REDIS_URL,
+                decode_responses=False,
+                socket_connect_timeout=5
+            )
             print("✅ Redis conectado com sucesso!")
+            self._invalidation_task = asyncio.create_task(self._listen_invalidations())
         except Exception as e:
             print(f"⚠️ Redis não disponível: {e}")
             print("   Sistema continuará sem cache")
             self.redis = None
+            self.binary = None
     
     async def disconnect(self):
         """Desconectar do Redis."""
+        if self._invalidation_task:
+            self._invalidation_task.cancel()
+            self._invalidation_task = None
+        if self.binary:
+            await self.binary.aclose()
         if self.redis:
             await self.redis.aclose()
             print("✅ Redis desconectado")
@@ -48,32 +114,112 @@ class RedisCache:
         Returns:
             Chave única
         """
-        # Serializar e gerar hash
-        data_str = json.dumps(data, sort_keys=True)
+        # Serializar e gerar hash (default=str para datas do date_range)
+        data_str = json.dumps(data, sort_keys=True, default=str)
         data_hash = hashlib.md5(data_str.encode()).hexdigest()
         return f"{prefix}:{data_hash}"
     
-    async def get(self, prefix: str, data: dict) -> Optional[Any]:
+    def key_for(self, prefix: str, data: dict) -> str:
+        """Chave Redis usada para (prefix, data)."""
+        return self._generate_key(prefix, data)
+    
+    async def get(self, prefix: str, data: dict, allow_stale: bool = True) -> Optional[Any]:
         """
         Buscar valor do cache.
         
         Args:
             prefix: Prefixo da chave
             data: Dados para gerar chave
+            allow_stale: Se False, valores além do soft TTL contam como MISS
         
         Returns:
-            Valor cacheado ou None
+            Valor cacheado (com os tipos originais) ou None
         """
-        if not self.redis:
+        entry = await self._get_blob(prefix, data)
+        if entry is None or (entry[1] and not allow_stale):
             return None
         
+        try:
+            return serializers.loads(entry[0])
+        except Exception as e:
+            print(f"⚠️ Erro ao decodificar valor do cache: {e}")
+            return None
+    
+    async def get_serialized(self, prefix: str, data: dict) -> Optional[bytes]:
+        """
+        Buscar o payload serializado (JSON) sem decodificar.
+        
+        Args:
+            prefix: Prefixo da chave
+            data: Dados para gerar chave
+        
+        Returns:
+            Payload em bytes ou None (valores stale também são retornados)
+        """
+        entry = await self.get_entry(prefix, data)
+        return entry[0] if entry else None
+    
+    async def get_entry(self, prefix: str, data: dict) -> Optional[Tuple[bytes, bool]]:
+        """
+        Buscar payload serializado e se ele já passou do soft TTL.
+        
+        Consulta primeiro o cache local do worker; o Redis só é acessado
+        quando o nível local não tem a chave. Depois do soft TTL o valor
+        continua disponível (stale) até o hard TTL, para ser servido
+        enquanto um refresh roda em background. Entradas cujas tags foram
+        invalidadas depois da gravação são tratadas como MISS.
+        
+        Args:
+            prefix: Prefixo da chave
+            data: Dados para gerar chave
+        
+        Returns:
+            (payload JSON, stale) ou None
+        """
+        entry = await self._get_blob(prefix, data)
+        if entry is None:
+            return None
+        
+        blob, stale = entry
+        try:
+            return serializers.to_json(blob), stale
+        except Exception as e:
+            print(f"⚠️ Erro ao decodificar valor do cache: {e}")
+            return None
+    
+    async def _get_blob(self, prefix: str, data: dict) -> Optional[Tuple[bytes, bool]]:
+        """Valor codificado (sem compressão) e se está stale; ver get_entry."""
         try:
             key = self._generate_key(prefix, data)
-            value = await self.redis.get(key)
+        except Exception as e:
+            print(f"⚠️ Erro ao gerar chave do cache: {e}")
+            return None
+        
+        if self.local:
+            payload = self.local.get(key)
+            if payload is not None:
+                return payload, False
+        
+        if not self.binary:
+            return None
+        
+        try:
+            value = await self.binary.get(key)
             
             if value:
-                print(f"🎯 Cache HIT: {key[:50]}...")
-                return json.loads(value)
+                soft_expires_at, stamp, value = self._split_header(value)
+                if stamp and not await self._is_current(stamp):
+                    print(f"♻️ Cache INVALIDATED: {key[:50]}...")
+                    return None
+                
+                payload = serializers.decompress(value)
+                remaining = soft_expires_at - time.time() if soft_expires_at else self.local_ttl_fallback
+                stale = remaining <= 0
+                print(f"🎯 Cache HIT{' (stale)' if stale else ''}: {key[:50]}...")
+                if self.local and not stale:
+                    # Entradas locais nunca ultrapassam o soft TTL
+                    self.local.set(key, payload, remaining)
+                return payload, stale
             
             print(f"❌ Cache MISS: {key[:50]}...")
             return None
@@ -82,12 +228,77 @@ class RedisCache:
             print(f"⚠️ Erro ao buscar do cache: {e}")
             return None
     
+    @staticmethod
+    def _split_header(value: bytes) -> Tuple[Optional[float], Optional[Dict[str, int]], bytes]:
+        """Separar o cabeçalho 'swr:<soft_expires_at>:[@<gerações>|]' do payload."""
+        if not value.startswith(SWR_HEADER):
+            # Valores gravados antes do soft TTL
+            return None, None, value
+        
+        soft_expires_at, _, payload = value[len(SWR_HEADER):].partition(b":")
+        stamp = None
+        if payload.startswith(STAMP_MARKER):
+            encoded, _, payload = payload[len(STAMP_MARKER):].partition(STAMP_END)
+            stamp = {}
+            for item in encoded.decode().split(","):
+                tag, _, generation = item.rpartition("#")
+                stamp[unquote(tag)] = int(generation)
+        return float(soft_expires_at), stamp, payload
+    
+    @staticmethod
+    def _encode_stamp(generations: Dict[str, int]) -> bytes:
+        items = ",".join(f"{quote(tag, safe='')}#{generation}" for tag, generation in generations.items())
+        return STAMP_MARKER + items.encode() + STAMP_END
+    
+    @staticmethod
+    def _entry_tags(prefix: str, tags: Optional[Iterable[str]]) -> List[str]:
+        """
+        Tags de uma entrada: global, cada nível do prefixo e as tabelas.
+        
+        'analytics:churn:metrics' gera 'analytics', 'analytics:churn' e
+        'analytics:churn:metrics', para que clear('analytics:churn:*') seja um INCR.
+        """
+        parts = prefix.split(":")
+        scopes = [":".join(parts[:i]) for i in range(1, len(parts) + 1)]
+        return [GLOBAL_TAG, *scopes, *sorted(set(tags or ()))]
+    
+    async def generations(self, prefix: str, tags: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """
+        Gerações atuais das tags de uma entrada.
+        
+        Capture antes de calcular o valor e passe para set(): se uma tag for
+        invalidada durante o cálculo, o resultado já nasce invalidado.
+        """
+        return await self._current_generations(self._entry_tags(prefix, tags))
+    
+    async def _current_generations(self, tags: List[str]) -> Dict[str, int]:
+        now = time.monotonic()
+        missing = [
+            tag for tag in tags
+            if tag not in self._generations
+            or now - self._generations[tag][0] > settings.CACHE_GENERATION_TTL
+        ]
+        if missing and self.redis:
+            try:
+                values = await self.redis.mget([f"{GENERATION_PREFIX}{tag}" for tag in missing])
+                for tag, value in zip(missing, values):
+                    self._generations[tag] = (now, int(value or 0))
+            except Exception as e:
+                print(f"⚠️ Erro ao ler gerações do cache: {e}")
+        return {tag: self._generations.get(tag, (now, 0))[1] for tag in tags}
+    
+    async def _is_current(self, stamp: Dict[str, int]) -> bool:
+        current = await self._current_generations(list(stamp))
+        return all(current[tag] == generation for tag, generation in stamp.items())
+    
     async def set(
         self, 
         prefix: str, 
         data: dict, 
         value: Any, 
-        ttl: Optional[int] = None
+        ttl: Optional[int] = None,
+        tags: Optional[Iterable[str]] = None,
+        generations: Optional[Dict[str, int]] = None
     ) -> bool:
         """
         Salvar valor no cache.
@@ -95,22 +306,46 @@ class RedisCache:
         Args:
             prefix: Prefixo da chave
             data: Dados para gerar chave
-            value: Valor a ser cacheado
-            ttl: Time to live em segundos (padrão: 300s)
+            value: Valor a ser cacheado. str é JSON já serializado e volta
+                como está em get_entry; bytes são opacos e voltam em get();
+                outros objetos usam o codec binário e voltam com os tipos
+                originais em get()
+            ttl: Soft TTL em segundos (padrão: 300s); o valor continua
+                disponível como stale por mais CACHE_STALE_TTL segundos
+            tags: Tabelas das quais o valor depende (ver invalidate_tags)
+            generations: Gerações capturadas com generations() antes do cálculo
+                (padrão: as gerações atuais de prefix + tags)
         
         Returns:
             True se salvou com sucesso
         """
-        if not self.redis:
-            return False
-        
         try:
             key = self._generate_key(prefix, data)
-            value_str = json.dumps(value, default=str)
+            blob = serializers.encode(value)
             ttl = ttl or self.default_ttl
             
-            await self.redis.setex(key, ttl, value_str)
-            print(f"💾 Cache SET: {key[:50]}... (TTL: {ttl}s)")
+            if generations is None:
+                generations = await self.generations(prefix, tags)
+            elif not await self._is_current(generations):
+                # Invalidado durante o cálculo: não gravar em nenhuma camada
+                print(f"⏭️ Cache SET skipped (invalidated while computing): {key[:50]}...")
+                return False
+            
+            if self.local:
+                self.local.set(key, blob, ttl)
+            
+            if not self.binary:
+                return False
+            
+            soft_expires_at = time.time() + ttl
+            hard_ttl = ttl + settings.CACHE_STALE_TTL
+            header = SWR_HEADER + f"{soft_expires_at:.3f}:".encode() + self._encode_stamp(generations)
+            stored = serializers.compress(blob)
+            await self.binary.setex(key, hard_ttl, header + stored)
+            print(
+                f"💾 Cache SET: {key[:50]}... (TTL: {ttl}s + {settings.CACHE_STALE_TTL}s stale, "
+                f"{len(stored)}/{len(blob)} bytes)"
+            )
             return True
         
         except Exception as e:
@@ -128,12 +363,16 @@ class RedisCache:
         Returns:
             True se deletou com sucesso
         """
+        key = self._generate_key(prefix, data)
+        if self.local:
+            self.local.delete(key)
+        
         if not self.redis:
             return False
         
         try:
-            key = self._generate_key(prefix, data)
             await self.redis.delete(key)
+            await self.redis.publish(INVALIDATION_CHANNEL, f"key:{key}")
             print(f"🗑️ Cache DELETE: {key[:50]}...")
             return True
         
@@ -141,35 +380,108 @@ class RedisCache:
             print(f"⚠️ Erro ao deletar do cache: {e}")
             return False
     
+    @staticmethod
+    def scope_for_pattern(pattern: str) -> Optional[str]:
+        """
+        Tag equivalente a um padrão de limpeza, se houver.
+        
+        '*' -> tag global; 'analytics:query:*' -> tag 'analytics:query'.
+        Outros padrões não correspondem a uma tag e precisam de SCAN.
+        """
+        if pattern == "*":
+            return GLOBAL_TAG
+        if pattern.endswith(":*"):
+            scope = pattern[:-2]
+            if not any(char in scope for char in "*?[]") and (
+                scope == "analytics" or scope.startswith("analytics:")
+            ):
+                return scope
+        return None
+    
     async def clear_pattern(self, pattern: str) -> int:
         """
         Deletar todas as chaves que correspondem ao padrão.
         
+        Padrões de prefixo ('*', 'analytics:*', 'analytics:query:*') viram um
+        INCR de geração (O(1)); os demais varrem o keyspace com SCAN e apagam
+        em lotes com UNLINK.
+        
         Args:
             pattern: Padrão (ex: 'analytics:*')
         
         Returns:
-            Número de chaves deletadas
+            Número de chaves deletadas (0 quando invalidado por geração)
         """
+        scope = self.scope_for_pattern(pattern)
+        if scope is not None:
+            await self.invalidate_tags([scope])
+            return 0
+        
+        if self.local:
+            self.local.delete_pattern(pattern)
+        
         if not self.redis:
             return 0
         
         try:
-            keys = []
-            async for key in self.redis.scan_iter(match=pattern):
-                keys.append(key)
+            await self.redis.publish(INVALIDATION_CHANNEL, f"pattern:{pattern}")
+            deleted = 0
+            batch = []
+            async for key in self.redis.scan_iter(match=pattern, count=1000):
+                batch.append(key)
+                if len(batch) >= 500:
+                    deleted += await self.redis.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += await self.redis.unlink(*batch)
             
-            if keys:
-                deleted = await self.redis.delete(*keys)
+            if deleted:
                 print(f"🗑️ Cache CLEAR: {deleted} chaves deletadas ({pattern})")
-                return deleted
-            
-            return 0
+            return deleted
         
         except Exception as e:
             print(f"⚠️ Erro ao limpar cache: {e}")
             return 0
     
+    async def invalidate_tags(self, tags: Iterable[str]) -> Dict[str, int]:
+        """
+        Invalidar todas as entradas que dependem de alguma das tags.
+        
+        Um INCR por tag: nenhuma chave é lida ou apagada, as entradas antigas
+        deixam de casar com a geração atual e expiram pelo TTL.
+        
+        Args:
+            tags: Tabelas / escopos alterados (ex: ['sales', 'sales@store=12'])
+        
+        Returns:
+            Nova geração de cada tag
+        """
+        tags = list(tags)
+        if self.local:
+            # O nível local não guarda as tags de cada entrada
+            self.local.clear()
+        if not self.redis or not tags:
+            return {}
+        
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for tag in tags:
+                    pipe.incr(f"{GENERATION_PREFIX}{tag}")
+                for tag in tags:
+                    pipe.publish(INVALIDATION_CHANNEL, f"gen:{tag}")
+                results = await pipe.execute()
+            
+            now = time.monotonic()
+            generations = dict(zip(tags, results[:len(tags)]))
+            for tag, generation in generations.items():
+                self._generations[tag] = (now, generation)
+            print(f"🗑️ Cache INVALIDATE: {', '.join(tags)}")
+            return generations
+        
+        except Exception as e:
+            print(f"⚠️ Erro ao invalidar tags: {e}")
+            return {}
+    
     async def get_stats(self) -> dict:
         """
         Obter estatísticas do Redis.
@@ -177,13 +489,16 @@ class RedisCache:
         Returns:
             Dict com estatísticas
         """
+        local_stats = self.local.stats() if self.local else None
         if not self.redis:
-            return {"connected": False}
+            return {"connected": False, "local": local_stats}
         
         try:
             info = await self.redis.info()
             return {
                 "connected": True,
+                "local": local_stats,
+                "serialization": serializers.backends(),
                 "used_memory_human": info.get("used_memory_human"),
                 "total_keys": await self.redis.dbsize(),
                 "hits": info.get("keyspace_hits", 0),
@@ -198,6 +513,38 @@ class RedisCache:
             print(f"⚠️ Erro ao obter stats: {e}")
             return {"connected": False, "error": str(e)}
 
+    
+    async def _listen_invalidations(self):
+        """Aplicar no cache local as invalidações publicadas por qualquer worker."""
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    kind, _, target = message["data"].partition(":")
+                    if kind == "gen":
+                        # Força reler a geração no próximo acesso
+                        self._generations.pop(target, None)
+                        if self.local:
+                            self.local.clear()
+                    elif not self.local:
+                        continue
+                    elif kind == "key":
+                        self.local.delete(target)
+                    elif kind == "pattern":
+                        self.local.delete_pattern(target)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Sem o canal, invalidações podem ser perdidas: limpar e reconectar
+                print(f"⚠️ Canal de invalidação desconectado: {e}")
+                self._generations.clear()
+                if self.local:
+                    self.local.clear()
+                await asyncio.sleep(5)
+
 
 # Instância global
 redis_cache = RedisCache()
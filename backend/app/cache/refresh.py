@@ -0,0 +1,170 @@
+"""
+Background cache refresh
+Stale-while-revalidate: recalcula em background entradas que passaram do
+soft TTL e atualiza proativamente as chaves mais requisitadas antes de expirarem
+"""
+import asyncio
+import json
+import uuid
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from app.config import settings
+from app.cache.redis_client import redis_cache
+
+# Sorted set com a popularidade (decaimento exponencial) de cada chave
+POPULARITY_KEY = "analytics:cache:popularity"
+# Hash chave -> (prefix, data) necessário para recalcular a entrada
+REQUESTS_KEY = "analytics:cache:requests"
+# Apenas um worker por ciclo executa os refreshes agendados
+LEADER_KEY = "analytics:cache:refresh-leader"
+
+RefreshFn = Callable[[dict], Awaitable[None]]
+
+
+class CacheRefresher:
+    """Triggers background recomputation of stale and soon-to-expire entries."""
+
+    def __init__(self):
+        # prefix -> coroutine que recalcula e grava a entrada a partir de data
+        self._handlers: Dict[str, RefreshFn] = {}
+        self._refreshing: Set[str] = set()
+        # Contadores locais, enviados ao Redis uma vez por ciclo (sem I/O por request)
+        self._counts: Counter = Counter()
+        self._requests: Dict[str, Tuple[str, dict]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def register(self, prefix: str, handler: RefreshFn):
+        """Register how entries under prefix are recomputed."""
+        self._handlers[prefix] = handler
+
+    def record(self, prefix: str, data: dict):
+        """Count a request for (prefix, data) towards the top-N ranking."""
+        if prefix not in self._handlers:
+            return
+        key = redis_cache.key_for(prefix, data)
+        self._counts[key] += 1
+        self._requests[key] = (prefix, data)
+
+    def trigger(self, prefix: str, data: dict):
+        """Schedule one background refresh of a stale entry (fire and forget)."""
+        key = redis_cache.key_for(prefix, data)
+        if key in self._refreshing or prefix not in self._handlers:
+            return
+        self._refreshing.add(key)
+        asyncio.create_task(self._refresh(key, prefix, data))
+
+    async def _refresh(self, key: str, prefix: str, data: dict):
+        try:
+            # Lock curto: outro worker que também viu o valor stale não recalcula
+            if redis_cache.redis:
+                acquired = await redis_cache.redis.set(
+                    f"refresh:{key}", uuid.uuid4().hex, nx=True, ex=settings.SINGLE_FLIGHT_LOCK_TTL
+                )
+                if not acquired:
+                    return
+            await self._handlers[prefix](data)
+            self.refreshes += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Erro no refresh em background ({key[:50]}...): {e}")
+        finally:
+            self._refreshing.discard(key)
+
+    def start(self):
+        """Start the periodic top-N refresh loop."""
+        if self._task is None and settings.CACHE_REFRESH_TOP_N > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.CACHE_REFRESH_INTERVAL)
+            try:
+                await self._flush_counts()
+                await self.refresh_top_keys()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Erro no ciclo de refresh do cache: {e}")
+
+    async def _flush_counts(self):
+        """Send local request counts to the shared popularity ranking."""
+        redis = redis_cache.redis
+        if not redis or not self._counts:
+            return
+
+        counts, requests = self._counts, self._requests
+        self._counts, self._requests = Counter(), {}
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, count in counts.items():
+                pipe.zincrby(POPULARITY_KEY, count, key)
+                prefix, data = requests[key]
+                pipe.hset(REQUESTS_KEY, key, json.dumps({"prefix": prefix, "data": data}, default=str))
+            await pipe.execute()
+
+    async def refresh_top_keys(self):
+        """Recompute the top-N keys whose soft TTL ends before the next cycle."""
+        redis = redis_cache.redis
+        if not redis:
+            return
+
+        acquired = await redis.set(LEADER_KEY, uuid.uuid4().hex, nx=True, ex=settings.CACHE_REFRESH_INTERVAL)
+        if not acquired:
+            return
+
+        top_keys = await redis.zrevrange(POPULARITY_KEY, 0, settings.CACHE_REFRESH_TOP_N - 1)
+        if not top_keys:
+            return
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in top_keys:
+                pipe.pttl(key)
+            pipe.hmget(REQUESTS_KEY, top_keys)
+            *ttls_ms, specs = await pipe.execute()
+
+        refreshed = 0
+        for key, ttl_ms, spec in zip(top_keys, ttls_ms, specs):
+            if not spec:
+                continue
+            # hard TTL = soft TTL + CACHE_STALE_TTL (-2 = chave já expirou)
+            soft_remaining = ttl_ms / 1000 - settings.CACHE_STALE_TTL if ttl_ms >= 0 else 0
+            if ttl_ms == -1 or soft_remaining > settings.CACHE_REFRESH_INTERVAL * 1.5:
+                continue
+            entry = json.loads(spec)
+            self.trigger(entry["prefix"], entry["data"])
+            refreshed += 1
+
+        # Decaimento: metade do peso a cada ciclo, ranking limitado a 1000 chaves
+        dropped = await redis.zrange(POPULARITY_KEY, 0, -1001)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zunionstore(POPULARITY_KEY, {POPULARITY_KEY: 0.5})
+            if dropped:
+                pipe.zrem(POPULARITY_KEY, *dropped)
+                pipe.hdel(REQUESTS_KEY, *dropped)
+            await pipe.execute()
+
+        if refreshed:
+            print(f"🔄 Cache refresh: {refreshed} chaves populares agendadas")
+
+    def stats(self) -> dict:
+        return {
+            "handlers": sorted(self._handlers),
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "failures": self.failures
+        }
+
+
+# Instância global
+cache_refresher = CacheRefresher()
@@ -0,0 +1,233 @@
+"""
+Cache payload serialization
+Formato binário versionado dos valores do cache: 1 byte de versão
+(codec + compressão) seguido do corpo. orjson, msgpack e zstandard são
+opcionais; sem eles o cache usa json, JSON tipado e zlib da stdlib.
+"""
+import json
+import zlib
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Tuple
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from app.config import settings
+
+
+# Byte de versão: 1CCC XXXX (bit alto ligado, para nunca colidir com o primeiro
+# caractere de um JSON em texto gravado antes deste formato)
+VERSION_FLAG = 0x80
+
+# Codecs (bits 4-6)
+CODEC_JSON = 1        # JSON já serializado (respostas da API); servido sem decodificar
+CODEC_MSGPACK = 2     # objetos Python com tipos preservados
+CODEC_TYPED_JSON = 3  # fallback sem msgpack: JSON com marcadores de tipo
+CODEC_RAW = 4         # bytes opacos (ex.: Arrow IPC); devolvidos como estão
+
+# Compressão (bits 0-3)
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+
+# Extensões msgpack / marcadores do JSON tipado
+_EXT_DATE = 1
+_EXT_DATETIME = 2
+_EXT_TIME = 3
+_EXT_DECIMAL = 4
+_EXT_UUID = 5
+_EXT_TYPES = {
+    _EXT_DATE: date.fromisoformat,
+    _EXT_DATETIME: datetime.fromisoformat,
+    _EXT_TIME: time.fromisoformat,
+    _EXT_DECIMAL: Decimal,
+    _EXT_UUID: UUID,
+}
+_TYPE_MARKER = "$t"
+
+
+def _ext_code(value: Any) -> int:
+    # datetime antes de date (datetime é subclasse de date)
+    if isinstance(value, datetime):
+        return _EXT_DATETIME
+    if isinstance(value, date):
+        return _EXT_DATE
+    if isinstance(value, time):
+        return _EXT_TIME
+    if isinstance(value, Decimal):
+        return _EXT_DECIMAL
+    if isinstance(value, UUID):
+        return _EXT_UUID
+    raise TypeError(f"Tipo não serializável no cache: {type(value).__name__}")
+
+
+def _ext_text(value: Any) -> str:
+    return value.isoformat() if isinstance(value, (date, time)) else str(value)
+
+
+def _msgpack_default(value: Any):
+    code = _ext_code(value)
+    return msgpack.ExtType(code, _ext_text(value).encode())
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    parse = _EXT_TYPES.get(code)
+    return parse(data.decode()) if parse else msgpack.ExtType(code, data)
+
+
+def _typed_json_default(value: Any):
+    return {_TYPE_MARKER: _ext_code(value), "v": _ext_text(value)}
+
+
+def _typed_json_hook(obj: dict):
+    if len(obj) == 2 and _TYPE_MARKER in obj and "v" in obj:
+        parse = _EXT_TYPES.get(obj[_TYPE_MARKER])
+        if parse:
+            return parse(obj["v"])
+    return obj
+
+
+def json_dumps(value: Any) -> bytes:
+    """JSON compacto em bytes (orjson quando disponível)."""
+    if orjson is not None:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=str, separators=(",", ":")).encode()
+
+
+def json_loads(payload: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def _compression() -> int:
+    configured = settings.CACHE_COMPRESSION
+    if configured == "none":
+        return COMPRESSION_NONE
+    if configured in ("zstd", "auto") and zstandard is not None:
+        return COMPRESSION_ZSTD
+    return COMPRESSION_ZLIB
+
+
+def _compress(body: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.ZstdCompressor(level=settings.CACHE_COMPRESSION_LEVEL).compress(body)
+    return zlib.compress(body, min(settings.CACHE_COMPRESSION_LEVEL, 9))
+
+
+def _decompress(body: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return body
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("Valor do cache comprimido com zstd, mas zstandard não está instalado")
+        return zstandard.ZstdDecompressor().decompress(body)
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(body)
+    raise ValueError(f"Compressão desconhecida no cache: {compression}")
+
+
+def _split_version(blob: bytes) -> Tuple[int, int, bytes]:
+    """(codec, compressão, corpo); valores sem byte de versão são JSON em texto."""
+    if not blob or blob[0] < VERSION_FLAG:
+        return CODEC_JSON, COMPRESSION_NONE, blob
+    version = blob[0]
+    return (version >> 4) & 0x07, version & 0x0F, blob[1:]
+
+
+def _join_version(codec: int, compression: int, body: bytes) -> bytes:
+    return bytes((VERSION_FLAG | (codec << 4) | compression,)) + body
+
+
+def encode(value: Any) -> bytes:
+    """
+    Serializar um valor para o formato versionado (sem compressão)
+
+    str é tratado como JSON já serializado (ex.: model_dump_json) e fica como
+    está, para ser devolvido direto pela API; bytes são opacos (ex.: Arrow
+    IPC). Outros valores usam msgpack (ou JSON tipado), preservando datas,
+    Decimals e UUIDs.
+    """
+    if isinstance(value, str):
+        return _join_version(CODEC_JSON, COMPRESSION_NONE, value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return _join_version(CODEC_RAW, COMPRESSION_NONE, bytes(value))
+    if msgpack is not None:
+        body = msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+        return _join_version(CODEC_MSGPACK, COMPRESSION_NONE, body)
+    body = json.dumps(value, default=_typed_json_default, separators=(",", ":")).encode()
+    return _join_version(CODEC_TYPED_JSON, COMPRESSION_NONE, body)
+
+
+def compress(blob: bytes) -> bytes:
+    """Comprimir um valor codificado se ele passar de CACHE_COMPRESSION_MIN_BYTES."""
+    codec, compression, body = _split_version(blob)
+    if compression != COMPRESSION_NONE or len(body) < settings.CACHE_COMPRESSION_MIN_BYTES:
+        return blob
+    compression = _compression()
+    if compression == COMPRESSION_NONE:
+        return blob
+    compressed = _compress(body, compression)
+    if len(compressed) >= len(body):
+        return blob
+    return _join_version(codec, compression, compressed)
+
+
+def decompress(blob: bytes) -> bytes:
+    """Versão sem compressão de um valor (é o que o cache local guarda)."""
+    codec, compression, body = _split_version(blob)
+    if compression == COMPRESSION_NONE:
+        return blob
+    return _join_version(codec, COMPRESSION_NONE, _decompress(body, compression))
+
+
+def loads(blob: bytes) -> Any:
+    """Decodificar um valor para objetos Python (tipos preservados)."""
+    codec, compression, body = _split_version(blob)
+    body = _decompress(body, compression)
+    if codec == CODEC_RAW:
+        return body
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("Valor do cache em msgpack, mas msgpack não está instalado")
+        return msgpack.unpackb(body, ext_hook=_msgpack_ext_hook, raw=False)
+    if codec == CODEC_TYPED_JSON:
+        return json.loads(body, object_hook=_typed_json_hook)
+    return json_loads(body)
+
+
+def to_json(blob: bytes) -> bytes:
+    """Payload JSON de um valor, sem decodificar quando já é JSON."""
+    codec, compression, body = _split_version(blob)
+    body = _decompress(body, compression)
+    if codec == CODEC_JSON:
+        return body
+    if codec == CODEC_RAW:
+        raise ValueError("Valor do cache é binário opaco, não JSON")
+    return json_dumps(loads(_join_version(codec, COMPRESSION_NONE, body)))
+
+
+def backends() -> dict:
+    """Bibliotecas opcionais disponíveis (para /cache/stats)."""
+    return {
+        "json": "orjson" if orjson is not None else "json",
+        "objects": "msgpack" if msgpack is not None else "typed-json",
+        "compression": {
+            COMPRESSION_NONE: "none", COMPRESSION_ZLIB: "zlib", COMPRESSION_ZSTD: "zstd"
+        }[_compression()],
+        "compression_min_bytes": settings.CACHE_COMPRESSION_MIN_BYTES,
+    }
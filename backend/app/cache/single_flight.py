@@ -0,0 +1,138 @@
+"""
+Single-flight request coalescing
+Requisições idênticas em andamento compartilham uma única execução no banco
+"""
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.config import settings
+from app.cache.redis_client import redis_cache
+
+# Libera o lock apenas se ainda pertence a quem o adquiriu
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution."""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        cache_lookup: Optional[Callable[[], Awaitable[Any]]] = None
+    ) -> Any:
+        """
+        Run fn once per key; concurrent callers await the same result.
+
+        Args:
+            key: Normalized request key
+            fn: Coroutine factory doing the actual work
+            cache_lookup: Optional coroutine factory returning the cached result;
+                used to pick up the value computed by another worker when the
+                distributed lock is enabled
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # A execução roda numa task própria: se o cliente que a iniciou
+            # desconectar, os demais waiters continuam recebendo o resultado
+            task = asyncio.ensure_future(self._run_leader(key, fn, cache_lookup))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Último waiter cancelado (ex.: cliente desconectou): ninguém vai usar
+            # o resultado, então a execução (e a query no banco) é cancelada
+            if self._waiters[key] == 1 and not task.done() and settings.SINGLE_FLIGHT_CANCEL_ABANDONED:
+                task.cancel()
+                self.abandoned += 1
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _forget(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def _run_leader(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        cache_lookup: Optional[Callable[[], Awaitable[Any]]]
+    ) -> Any:
+        redis = redis_cache.redis
+        if not settings.SINGLE_FLIGHT_DISTRIBUTED or not redis or not cache_lookup:
+            self.executions += 1
+            return await fn()
+
+        lock_key = f"lock:{key}"
+        token = uuid.uuid4().hex
+        acquired = False
+        try:
+            acquired = await redis.set(lock_key, token, nx=True, px=settings.SINGLE_FLIGHT_LOCK_TTL * 1000)
+        except Exception as e:
+            print(f"⚠️ Erro ao adquirir lock distribuído: {e}")
+
+        if not acquired:
+            result = await self._wait_for_remote(lock_key, cache_lookup)
+            if result is not None:
+                self.coalesced += 1
+                return result
+
+        try:
+            self.executions += 1
+            return await fn()
+        finally:
+            if acquired:
+                try:
+                    await redis.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    print(f"⚠️ Erro ao liberar lock distribuído: {e}")
+
+    async def _wait_for_remote(self, lock_key: str, cache_lookup: Callable[[], Awaitable[Any]]) -> Any:
+        """Poll the cache while another worker holds the lock."""
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_LOCK_TTL
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+            result = await cache_lookup()
+            if result is not None:
+                return result
+            try:
+                if not await redis_cache.redis.exists(lock_key):
+                    # O líder terminou (ou falhou) sem gravar no cache
+                    return await cache_lookup()
+            except Exception:
+                return None
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned
+        }
+
+
+# Instância global
+single_flight = SingleFlight()
@@ -0,0 +1,180 @@
+"""
+Persistent alert storage (Postgres)
+
+Alerts live in the `alerts` table, indexed on enabled and metric. Every write
+gives the row a new value from alerts_revision_seq, so (row count, sum of
+revisions) changes whenever any alert is created, updated or deleted: a worker
+keeping an in-memory copy compares that stamp, and only on a mismatch diffs
+the (id, revision) pairs and fetches the rows that changed (see AlertService).
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+from uuid import UUID
+
+from psycopg.types.json import Jsonb
+
+from app.db.database import db, use_primary
+from app.models.alert import Alert, AlertCondition
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    "CREATE SEQUENCE IF NOT EXISTS alerts_revision_seq",
+    """
+    CREATE TABLE IF NOT EXISTS alerts (
+        id UUID PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        metric TEXT NOT NULL,
+        operator TEXT NOT NULL,
+        threshold DOUBLE PRECISION NOT NULL,
+        filters JSONB NOT NULL DEFAULT '{}',
+        window_minutes INTEGER,
+        enabled BOOLEAN NOT NULL DEFAULT TRUE,
+        notification_channels TEXT[] NOT NULL DEFAULT '{toast}',
+        created_at TIMESTAMP NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        last_triggered_at TIMESTAMP,
+        trigger_count INTEGER NOT NULL DEFAULT 0,
+        revision BIGINT NOT NULL DEFAULT nextval('alerts_revision_seq')
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_alerts_enabled ON alerts (enabled)",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_metric ON alerts (metric)",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_revision ON alerts (revision)",
+]
+
+COLUMNS = """
+    id, name, description, metric, operator, threshold, filters, window_minutes, enabled,
+    notification_channels, created_at, updated_at, last_triggered_at, trigger_count, revision
+"""
+
+UPSERT_QUERY = """
+INSERT INTO alerts (
+    id, name, description, metric, operator, threshold, filters, window_minutes, enabled,
+    notification_channels, created_at, updated_at, last_triggered_at, trigger_count
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (id) DO UPDATE SET
+    name = EXCLUDED.name,
+    description = EXCLUDED.description,
+    metric = EXCLUDED.metric,
+    operator = EXCLUDED.operator,
+    threshold = EXCLUDED.threshold,
+    filters = EXCLUDED.filters,
+    window_minutes = EXCLUDED.window_minutes,
+    enabled = EXCLUDED.enabled,
+    notification_channels = EXCLUDED.notification_channels,
+    updated_at = EXCLUDED.updated_at,
+    revision = nextval('alerts_revision_seq')
+RETURNING {columns}
+""".format(columns=COLUMNS)
+
+
+def _to_alert(row: Dict[str, Any]) -> Alert:
+    # Sem revalidar: linhas gravadas antes de uma regra nova (ex.: filtros) continuam legíveis
+    return Alert.model_construct(
+        id=row['id'],
+        name=row['name'],
+        description=row['description'],
+        condition=AlertCondition(
+            metric=row['metric'],
+            operator=row['operator'],
+            threshold=row['threshold'],
+        ),
+        filters=row['filters'] or {},
+        window_minutes=row['window_minutes'],
+        enabled=row['enabled'],
+        notification_channels=row['notification_channels'],
+        created_at=row['created_at'],
+        updated_at=row['updated_at'],
+        last_triggered_at=row['last_triggered_at'],
+        trigger_count=row['trigger_count'],
+    )
+
+
+class AlertRepository:
+    """CRUD on the alerts table; reads go to the primary (read-your-writes)"""
+
+    def __init__(self):
+        self._schema_ready = False
+
+    async def ensure_schema(self):
+        if self._schema_ready:
+            return
+        async with db.connection() as conn:
+            for statement in SCHEMA:
+                await conn.execute(statement)
+        self._schema_ready = True
+
+    @use_primary
+    async def stamp(self) -> Tuple[int, int]:
+        """(row count, sum of revisions)"""
+        await self.ensure_schema()
+        row = await db.fetch_one(
+            "SELECT COUNT(*) AS total, COALESCE(SUM(revision), 0) AS revisions FROM alerts"
+        )
+        return row['total'], int(row['revisions'])
+
+    @use_primary
+    async def revisions(self) -> Dict[UUID, int]:
+        """Current revision of every alert"""
+        await self.ensure_schema()
+        columns, rows = await db.fetch_tuples("SELECT id, revision FROM alerts")
+        return dict(rows)
+
+    @use_primary
+    async def fetch(self, alert_ids: List[UUID]) -> List[Tuple[int, Alert]]:
+        """(revision, alert) of the given alerts that still exist"""
+        await self.ensure_schema()
+        rows = await db.fetch_all(f"SELECT {COLUMNS} FROM alerts WHERE id = ANY(%s)", alert_ids)
+        return [(row['revision'], _to_alert(row)) for row in rows]
+
+    @use_primary
+    async def save(self, alert: Alert) -> Tuple[int, Alert]:
+        """Insert or update an alert (trigger counters are left untouched); returns the stored row"""
+        await self.ensure_schema()
+        row = await db.fetch_one(
+            UPSERT_QUERY,
+            alert.id,
+            alert.name,
+            alert.description,
+            alert.condition.metric,
+            alert.condition.operator,
+            alert.condition.threshold,
+            Jsonb(alert.filters),
+            alert.window_minutes,
+            alert.enabled,
+            list(alert.notification_channels),
+            alert.created_at,
+            alert.updated_at,
+            alert.last_triggered_at,
+            alert.trigger_count,
+        )
+        return row['revision'], _to_alert(row)
+
+    async def delete(self, alert_id: UUID) -> bool:
+        await self.ensure_schema()
+        return await db.execute("DELETE FROM alerts WHERE id = %s", alert_id) > 0
+
+    async def record_triggers(self, alert_ids: Iterable[UUID], triggered_at: datetime) -> int:
+        """Count one trigger for each alert, in a single statement"""
+        ids = list(alert_ids)
+        if not ids:
+            return 0
+        await self.ensure_schema()
+        return await db.execute(
+            """
+            UPDATE alerts SET
+                trigger_count = trigger_count + 1,
+                last_triggered_at = %s,
+                revision = nextval('alerts_revision_seq')
+            WHERE id = ANY(%s)
+            """,
+            triggered_at,
+            ids
+        )
+
+
+# Instância global
+alert_repository = AlertRepository()
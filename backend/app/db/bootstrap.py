@@ -0,0 +1,245 @@
+"""
+Database bootstrap - indexes and optional monthly partitioning for sales
+
+Usage:
+    python -m app.db.bootstrap                # create supporting indexes
+    python -m app.db.bootstrap --partition    # convert sales to monthly range partitions
+    python -m app.db.bootstrap --verify       # EXPLAIN every date-bounded query path
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import date
+from typing import Dict, List, Optional
+
+import psycopg
+
+from app.config import settings
+
+# Fix for Windows ProactorEventLoop issue with psycopg3
+if sys.platform == 'win32':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+# Every analytics query filters sale_status_desc = 'COMPLETED' and most are
+# bounded by created_at: equality column first, range column last.
+SALES_INDEXES = {
+    # Covering index: KPI / compare summaries can run as index-only scans
+    "idx_sales_status_created_at": """
+        ON sales (sale_status_desc, created_at)
+        INCLUDE (store_id, channel_id, customer_id, total_amount, delivery_seconds, production_seconds)
+    """,
+    "idx_sales_status_store_created_at": "ON sales (sale_status_desc, store_id, created_at)",
+    "idx_sales_status_channel_created_at": "ON sales (sale_status_desc, channel_id, created_at)",
+    # Churn queries bound created_at without the status filter
+    "idx_sales_created_at": "ON sales (created_at)",
+}
+
+# Join-side indexes used by product / delivery dimensions
+JOIN_INDEXES = {
+    "idx_product_sales_sale_id": "ON product_sales (sale_id)",
+    "idx_delivery_addresses_sale_id": "ON delivery_addresses (sale_id)",
+}
+
+
+def _month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def _next_month(value: date) -> date:
+    return date(value.year + (value.month // 12), value.month % 12 + 1, 1)
+
+
+async def create_indexes(conn: psycopg.AsyncConnection, concurrently: bool = True):
+    """Create the supporting indexes (CONCURRENTLY requires an autocommit connection)"""
+    mode = "CONCURRENTLY " if concurrently else ""
+    for name, definition in {**SALES_INDEXES, **JOIN_INDEXES}.items():
+        print(f"📇 Creating {name}...")
+        await conn.execute(f"CREATE INDEX {mode}IF NOT EXISTS {name} {definition}")
+    await conn.execute("ANALYZE sales")
+    print("✓ Indexes created")
+
+
+async def ensure_partitions(conn: psycopg.AsyncConnection, start: date, end: date):
+    """Create monthly partitions of sales covering [start, end]"""
+    month = _month_start(start)
+    while month <= end:
+        upper = _next_month(month)
+        name = f"sales_p{month:%Y_%m}"
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF sales "
+            f"FOR VALUES FROM ('{month}') TO ('{upper}')"
+        )
+        month = upper
+
+
+async def is_partitioned(conn: psycopg.AsyncConnection) -> bool:
+    cur = await conn.execute("SELECT relkind FROM pg_class WHERE relname = 'sales'")
+    row = await cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+async def partition_sales(conn: psycopg.AsyncConnection, months_ahead: int = 3):
+    """
+    Convert sales into a table partitioned by month on created_at
+
+    The partitioned primary key has to include created_at, so foreign keys
+    referencing sales(id) are dropped. Materialized views keep pointing at the
+    old table (renamed to sales_unpartitioned) and must be recreated with
+    create_views.py afterwards.
+    """
+    if await is_partitioned(conn):
+        print("ℹ️ sales is already partitioned, only adding future partitions")
+        today = date.today()
+        await ensure_partitions(conn, today, _add_months(today, months_ahead))
+        return
+
+    cur = await conn.execute("SELECT MIN(created_at)::date, MAX(created_at)::date FROM sales")
+    min_date, max_date = await cur.fetchone()
+    min_date = min_date or date.today()
+    last_date = max(max_date or date.today(), date.today())
+
+    async with conn.transaction():
+        await conn.execute("LOCK TABLE sales IN ACCESS EXCLUSIVE MODE")
+        await conn.execute("""
+            CREATE TABLE sales_partitioned
+            (LIKE sales INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)
+            PARTITION BY RANGE (created_at)
+        """)
+
+        cur = await conn.execute("""
+            SELECT conrelid::regclass::text, conname
+            FROM pg_constraint
+            WHERE confrelid = 'sales'::regclass AND contype = 'f'
+        """)
+        for table, constraint in await cur.fetchall():
+            print(f"⚠️ Dropping foreign key {table}.{constraint} (references sales.id)")
+            await conn.execute(f"ALTER TABLE {table} DROP CONSTRAINT {constraint}")
+
+        await conn.execute("ALTER TABLE sales RENAME TO sales_unpartitioned")
+        await conn.execute("ALTER TABLE sales_partitioned RENAME TO sales")
+
+        # Keep the id sequence alive if the old table is dropped later
+        cur = await conn.execute("SELECT pg_get_serial_sequence('sales_unpartitioned', 'id')")
+        sequence = (await cur.fetchone())[0]
+        if sequence:
+            await conn.execute(f"ALTER SEQUENCE {sequence} OWNED BY sales.id")
+        await ensure_partitions(conn, min_date, _add_months(last_date, months_ahead))
+        await conn.execute("CREATE TABLE sales_default PARTITION OF sales DEFAULT")
+
+        print("📦 Copying rows into partitions...")
+        await conn.execute("INSERT INTO sales SELECT * FROM sales_unpartitioned")
+        await conn.execute("ALTER TABLE sales ADD PRIMARY KEY (id, created_at)")
+
+        # Indexes on the partitioned parent cascade to every partition
+        await create_indexes(conn, concurrently=False)
+
+    print("✓ sales partitioned by month (old table kept as sales_unpartitioned)")
+    print("⚡ Recreate the materialized views: python create_views.py")
+
+
+def _add_months(value: date, months: int) -> date:
+    for _ in range(months):
+        value = _next_month(value)
+    return value
+
+
+def _collect_sales_scans(plan: dict, scans: List[Dict]):
+    """Collect every plan node that reads from sales (or one of its partitions)"""
+    relation = plan.get("Relation Name") or ""
+    if relation == "sales" or relation.startswith("sales_p") or relation == "sales_default":
+        condition = plan.get("Index Cond") or ""
+        # Bitmap heap scans carry the index condition on their child nodes
+        for child in plan.get("Plans", []):
+            condition += child.get("Index Cond") or ""
+        scans.append({
+            "relation": relation,
+            "node": plan["Node Type"],
+            "index": plan.get("Index Name"),
+            "condition": condition,
+        })
+    for child in plan.get("Plans", []):
+        _collect_sales_scans(child, scans)
+
+
+async def explain_date_paths(conn: psycopg.AsyncConnection) -> bool:
+    """
+    EXPLAIN every date-bounded query path and check that sales is reached
+    through an index range or partition pruning
+
+    Sequential scans are disabled for the check so the result shows whether the
+    predicates are sargable, independently of table size and statistics.
+    """
+    from app.models.schemas import AnalyticsQueryRequest, DateRangeFilter
+    from app.services.analytics_service import analytics_service
+
+    start, end = date(2025, 5, 1), date(2025, 5, 31)
+    date_range = DateRangeFilter(start_date=start, end_date=end)
+
+    paths = {
+        "/query (raw sales)": analytics_service._build_query(AnalyticsQueryRequest(
+            metrics=["faturamento", "qtd_vendas"], dimensions=["canal_venda"], date_range=date_range
+        )),
+        "/query (produto)": analytics_service._build_query(AnalyticsQueryRequest(
+            metrics=["qtd_vendas"], dimensions=["nome_produto"], date_range=date_range
+        )),
+        "/kpis": analytics_service._build_kpi_query(start, end, {}),
+        "/compare (per period)": analytics_service._build_kpi_query(start, end, {"canal_venda": ["iFood"]}),
+    }
+
+    partitioned = await is_partitioned(conn)
+    total_partitions = 0
+    if partitioned:
+        cur = await conn.execute("SELECT COUNT(*) FROM pg_inherits WHERE inhparent = 'sales'::regclass")
+        total_partitions = (await cur.fetchone())[0]
+
+    all_ok = True
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_seqscan = off")
+        for name, (query, params) in paths.items():
+            cur = await conn.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+            plan = (await cur.fetchone())[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+
+            scans: List[Dict] = []
+            _collect_sales_scans(plan[0]["Plan"], scans)
+
+            index_range = all("created_at" in scan["condition"] for scan in scans)
+            pruned = partitioned and len({scan["relation"] for scan in scans}) < total_partitions
+            ok = bool(scans) and (index_range or pruned)
+            all_ok &= ok
+
+            status = "✓" if ok else "✗"
+            print(f"{status} {name}")
+            for scan in scans:
+                print(f"    {scan['node']} on {scan['relation']} {scan['index'] or ''} {scan['condition']}")
+
+    return all_ok
+
+
+async def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bootstrap sales indexes and partitions")
+    parser.add_argument("--partition", action="store_true", help="Convert sales to monthly range partitions")
+    parser.add_argument("--months-ahead", type=int, default=3, help="Future monthly partitions to create")
+    parser.add_argument("--verify", action="store_true", help="EXPLAIN the date-bounded query paths")
+    options = parser.parse_args(args)
+
+    conn = await psycopg.AsyncConnection.connect(settings.DATABASE_URL, autocommit=True)
+    try:
+        if options.verify:
+            ok = await explain_date_paths(conn)
+            print("✓ Every date-bounded path uses an index or partition pruning" if ok
+                  else "✗ Some paths still scan sales sequentially")
+            return
+        if options.partition:
+            await partition_sales(conn, options.months_ahead)
+        else:
+            await create_indexes(conn)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
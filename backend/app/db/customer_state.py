@@ -0,0 +1,302 @@
+"""
+Incremental per-customer state for churn / RFM analysis
+
+customer_state keeps first/last purchase, frequency, monetary value and the
+stores of each customer. It is updated from the sales inserted after a
+watermark (sales.id), so the churn endpoints read O(customers) rows instead of
+aggregating the whole sales history on every call.
+
+Usage:
+    python -m app.db.customer_state            # create the tables and catch up
+    python -m app.db.customer_state --rebuild  # recompute everything from sales
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from app.config import settings
+from app.db.database import db, statement_timeout, use_lane, HEAVY
+
+# Fix for Windows ProactorEventLoop issue with psycopg3
+if sys.platform == 'win32':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+logger = logging.getLogger(__name__)
+
+# Evita dois workers sincronizando ao mesmo tempo (pg_try_advisory_xact_lock)
+SYNC_LOCK_ID = 72_310_017
+
+
+class CustomerStateNotReady(RuntimeError):
+    """customer_state is still catching up with sales (its numbers would be partial)"""
+
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS customer_state (
+        customer_id INTEGER PRIMARY KEY,
+        first_purchase_at TIMESTAMP NOT NULL,
+        last_purchase_at TIMESTAMP NOT NULL,
+        frequency INTEGER NOT NULL,
+        monetary NUMERIC NOT NULL,
+        store_ids INTEGER[] NOT NULL DEFAULT '{}',
+        customer_name TEXT,
+        updated_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_customer_state_last_purchase ON customer_state (last_purchase_at)",
+    # Uma linha: watermark e intervalo de datas de todo o dataset (referência do churn)
+    """
+    CREATE TABLE IF NOT EXISTS customer_state_meta (
+        id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        last_sale_id BIGINT NOT NULL DEFAULT 0,
+        min_sale_at TIMESTAMP,
+        max_sale_at TIMESTAMP,
+        synced_at TIMESTAMP
+    )
+    """,
+    "INSERT INTO customer_state_meta (id) VALUES (1) ON CONFLICT (id) DO NOTHING",
+]
+
+# Aplica as vendas com id em (since, until] ao estado de cada cliente
+APPLY_SALES = """
+WITH delta AS (
+    SELECT
+        customer_id,
+        MIN(created_at) AS first_purchase_at,
+        MAX(created_at) AS last_purchase_at,
+        COUNT(*) AS frequency,
+        COALESCE(SUM(total_amount), 0) AS monetary,
+        COALESCE(ARRAY_AGG(DISTINCT store_id) FILTER (WHERE store_id IS NOT NULL), '{}') AS store_ids,
+        (ARRAY_AGG(customer_name ORDER BY created_at DESC) FILTER (WHERE customer_name IS NOT NULL))[1] AS customer_name
+    FROM sales
+    WHERE id > %s AND id <= %s AND customer_id IS NOT NULL
+    GROUP BY customer_id
+)
+INSERT INTO customer_state AS cs (
+    customer_id, first_purchase_at, last_purchase_at, frequency, monetary, store_ids, customer_name
+)
+SELECT customer_id, first_purchase_at, last_purchase_at, frequency, monetary, store_ids, customer_name
+FROM delta
+ON CONFLICT (customer_id) DO UPDATE SET
+    first_purchase_at = LEAST(cs.first_purchase_at, EXCLUDED.first_purchase_at),
+    last_purchase_at = GREATEST(cs.last_purchase_at, EXCLUDED.last_purchase_at),
+    frequency = cs.frequency + EXCLUDED.frequency,
+    monetary = cs.monetary + EXCLUDED.monetary,
+    store_ids = ARRAY(SELECT DISTINCT unnest(cs.store_ids || EXCLUDED.store_ids) ORDER BY 1),
+    customer_name = COALESCE(EXCLUDED.customer_name, cs.customer_name),
+    updated_at = now()
+"""
+
+ADVANCE_WATERMARK = """
+UPDATE customer_state_meta m SET
+    last_sale_id = %s,
+    min_sale_at = LEAST(m.min_sale_at, batch.min_sale_at),
+    max_sale_at = GREATEST(m.max_sale_at, batch.max_sale_at),
+    synced_at = now()
+FROM (
+    SELECT MIN(created_at) AS min_sale_at, MAX(created_at) AS max_sale_at
+    FROM sales
+    WHERE id > %s AND id <= %s
+) batch
+WHERE m.id = 1
+"""
+
+
+class CustomerState:
+    """Keeps customer_state in sync with sales (watermark on sales.id)"""
+
+    def __init__(self):
+        self._schema_ready = False
+        self._lock = asyncio.Lock()
+        self._last_sync = 0.0
+        # True once the watermark reached MAX(sales.id) (até lá, leituras falham)
+        self._ready = False
+        self._task: Optional[asyncio.Task] = None
+        self.last_result: Dict[str, Any] = {}
+
+    def start(self):
+        """Catch up in the background at startup, so no request runs the initial sync"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._catch_up())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @use_lane(HEAVY)
+    async def _catch_up(self):
+        while not self._ready:
+            try:
+                with statement_timeout(0):
+                    await self.sync(force=True)
+                if not self._ready:
+                    # Outro worker está sincronizando: conferir o atraso dele
+                    await self._check_ready()
+            except asyncio.CancelledError:
+                raise
+            except CustomerStateNotReady:
+                pass
+            except Exception as e:
+                logger.warning(f"⚠️ customer_state catch-up failed: {e}")
+            if not self._ready:
+                await asyncio.sleep(settings.CUSTOMER_STATE_SYNC_INTERVAL)
+
+    async def ensure_schema(self):
+        if self._schema_ready:
+            return
+        async with db.connection() as conn:
+            for statement in SCHEMA:
+                await conn.execute(statement)
+        self._schema_ready = True
+
+    async def sync(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Apply the sales inserted since the watermark
+
+        Runs at most once per CUSTOMER_STATE_SYNC_INTERVAL per worker (unless
+        forced), in batches of CUSTOMER_STATE_BATCH_SIZE sale ids, each batch
+        in its own transaction together with the watermark. If another worker
+        is already syncing, returns without waiting (readers see the state as
+        of its last committed batch) and retries on the next call.
+
+        Requests never run the initial catch-up: until the watermark is within
+        CUSTOMER_STATE_MAX_LAG sale ids of MAX(sales.id), a non-forced sync
+        raises CustomerStateNotReady instead of letting callers read (and
+        cache) a partial state. The catch-up runs at startup (start()) or from
+        the CLI.
+
+        Note: a sale committed with an id lower than the watermark (long
+        concurrent transactions) is only picked up by rebuild().
+        """
+        if not force and time.monotonic() - self._last_sync < settings.CUSTOMER_STATE_SYNC_INTERVAL:
+            return self.last_result
+
+        async with self._lock:
+            if not force and time.monotonic() - self._last_sync < settings.CUSTOMER_STATE_SYNC_INTERVAL:
+                return self.last_result
+
+            await self.ensure_schema()
+            if not force and not self._ready:
+                await self._check_ready()
+
+            start = time.time()
+            batches = 0
+            customers_updated = 0
+            last_sale_id = None
+            locked = False
+            while True:
+                result = await self._apply_batch()
+                if result is False:
+                    locked = True
+                    break
+                if result is None:
+                    break
+                last_sale_id, updated = result
+                customers_updated += updated
+                batches += 1
+
+            if not locked:
+                self._ready = True
+                self._last_sync = time.monotonic()
+            self.last_result = {
+                "batches": batches,
+                "customers_updated": customers_updated,
+                "last_sale_id": last_sale_id,
+                "locked": locked,
+                "sync_ms": round((time.time() - start) * 1000, 2),
+            }
+            if batches:
+                logger.info(f"👥 customer_state: {batches} batches, {customers_updated} customers updated")
+            return self.last_result
+
+    async def _check_ready(self):
+        """Mark the state ready when the watermark is close to MAX(sales.id), else raise"""
+        async with db.connection() as conn:
+            cur = await conn.execute(
+                "SELECT m.last_sale_id, (SELECT MAX(id) FROM sales) FROM customer_state_meta m WHERE m.id = 1"
+            )
+            last_sale_id, max_sale_id = await cur.fetchone()
+        behind = (max_sale_id or 0) - last_sale_id
+        if behind > settings.CUSTOMER_STATE_MAX_LAG:
+            raise CustomerStateNotReady(
+                f"customer_state is catching up ({behind} sales behind); try again shortly"
+            )
+        self._ready = True
+
+    async def _apply_batch(self) -> Union[Tuple[int, int], None, bool]:
+        """
+        Apply one batch: (new watermark, customers updated), None when there
+        is nothing new, or False when another worker holds the lock
+        """
+        async with db.connection() as conn:
+            async with conn.transaction():
+                cur = await conn.execute("SELECT pg_try_advisory_xact_lock(%s)", (SYNC_LOCK_ID,))
+                if not (await cur.fetchone())[0]:
+                    return False
+
+                cur = await conn.execute("SELECT last_sale_id FROM customer_state_meta WHERE id = 1")
+                since = (await cur.fetchone())[0]
+                cur = await conn.execute(
+                    "SELECT MAX(id) FROM (SELECT id FROM sales WHERE id > %s ORDER BY id LIMIT %s) batch",
+                    (since, settings.CUSTOMER_STATE_BATCH_SIZE)
+                )
+                until = (await cur.fetchone())[0]
+                if until is None:
+                    return None
+
+                cur = await conn.execute(APPLY_SALES, (since, until))
+                updated = cur.rowcount
+                await conn.execute(ADVANCE_WATERMARK, (until, since, until))
+                return until, updated
+
+    async def rebuild(self) -> Dict[str, Any]:
+        """Recompute the whole state from sales (e.g. after updates/deletes of old sales)"""
+        await self.ensure_schema()
+        async with db.connection() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock(%s)", (SYNC_LOCK_ID,))
+                await conn.execute("TRUNCATE customer_state")
+                await conn.execute(
+                    "UPDATE customer_state_meta SET last_sale_id = 0, min_sale_at = NULL, "
+                    "max_sale_at = NULL, synced_at = NULL WHERE id = 1"
+                )
+        return await self.sync(force=True)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        row = await db.fetch_one("""
+            SELECT m.last_sale_id, m.min_sale_at, m.max_sale_at, m.synced_at,
+                   (SELECT COUNT(*) FROM customer_state) AS customers
+            FROM customer_state_meta m
+        """)
+        return {**(row or {}), "last_sync": self.last_result}
+
+
+# Instância global
+customer_state = CustomerState()
+
+
+async def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Create / update the customer_state table")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute everything from sales")
+    options = parser.parse_args(args)
+
+    await db.connect()
+    try:
+        with statement_timeout(0):
+            result = await (customer_state.rebuild() if options.rebuild else customer_state.sync(force=True))
+        print(f"✓ customer_state up to date: {result}")
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
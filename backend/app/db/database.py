@@ -1,57 +1,362 @@
 """
 Database connection and session management
 """
-from psycopg_pool import AsyncConnectionPool
-from typing import Optional, List, Dict, Any
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from psycopg.conninfo import conninfo_to_dict
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+import asyncio
+import functools
+import itertools
 import logging
+import uuid
+import psycopg
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Pool lanes: interactive dashboard queries never queue behind heavy work
+INTERACTIVE = "interactive"
+HEAVY = "heavy"  # churn, RFM, exports
+
+_current_lane: ContextVar[str] = ContextVar("db_lane", default=INTERACTIVE)
+_read_from_primary: ContextVar[bool] = ContextVar("db_read_from_primary", default=False)
+_statement_timeout_ms: ContextVar[Optional[int]] = ContextVar("db_statement_timeout_ms", default=None)
+
+# Replica lag: 0 when everything received has been replayed, otherwise the age
+# of the last replayed transaction
+REPLICA_STATUS_QUERY = """
+SELECT
+    pg_is_in_recovery() AS in_recovery,
+    CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag_seconds
+"""
+
+
+def _with_context(var: ContextVar, value: Any):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            token = var.set(value)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                var.reset(token)
+        return wrapper
+    return decorator
+
+
+def use_lane(lane: str):
+    """Run an async function's queries on the given pool lane"""
+    return _with_context(_current_lane, lane)
+
+
+def use_primary(fn):
+    """Run an async function's reads on the primary (read-your-writes)"""
+    return _with_context(_read_from_primary, True)(fn)
+
+
+@contextmanager
+def statement_timeout(timeout_ms: Optional[int]):
+    """
+    Apply a statement_timeout (ms, 0 = no limit) to the queries run inside the block
+    
+    Also covers executions started inside it (single-flight, cache compute), since
+    asyncio tasks inherit the context. Outside any block, connections use
+    DB_STATEMENT_TIMEOUT_MS.
+    """
+    token = _statement_timeout_ms.set(timeout_ms)
+    try:
+        yield
+    finally:
+        _statement_timeout_ms.reset(token)
+
+
+def _pool_stats(pool: AsyncConnectionPool) -> Dict[str, Any]:
+    pool_stats = pool.get_stats()
+    requests = pool_stats.get("requests_num", 0)
+    wait_ms = pool_stats.get("requests_wait_ms", 0)
+    return {
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+        "size": pool_stats.get("pool_size", 0),
+        "in_use": pool_stats.get("pool_size", 0) - pool_stats.get("pool_available", 0),
+        "waiting": pool_stats.get("requests_waiting", 0),
+        "requests": requests,
+        "queued": pool_stats.get("requests_queued", 0),
+        "wait_ms_total": wait_ms,
+        "wait_ms_avg": round(wait_ms / requests, 2) if requests else 0.0,
+        # Recusadas: fila cheia (max_waiting) ou timeout esperando conexão
+        "rejected": pool_stats.get("requests_errors", 0),
+        "timeouts": pool_stats.get("requests_timeouts", 0),
+        "connection_errors": pool_stats.get("connections_errors", 0),
+    }
+
+
+def _create_pool(
+    conninfo: str,
+    name: str,
+    min_size: int,
+    max_size: int,
+    max_waiting: int,
+    timeout: float
+) -> AsyncConnectionPool:
+    return AsyncConnectionPool(
+        conninfo,
+        name=name,
+        min_size=min_size,
+        max_size=max_size,
+        timeout=timeout,
+        max_waiting=max_waiting,
+        kwargs={"prepare_threshold": settings.DB_PREPARE_THRESHOLD},
+        configure=Database._configure_connection,
+        open=False
+    )
+
+
+def _create_lane_pools(conninfo: str, prefix: str = "") -> Dict[str, AsyncConnectionPool]:
+    return {
+        INTERACTIVE: _create_pool(
+            conninfo,
+            f"{prefix}{INTERACTIVE}",
+            settings.DB_POOL_MIN_SIZE,
+            settings.DB_POOL_MAX_SIZE,
+            settings.DB_POOL_MAX_WAITING,
+            settings.DB_POOL_TIMEOUT
+        ),
+        HEAVY: _create_pool(
+            conninfo,
+            f"{prefix}{HEAVY}",
+            settings.DB_HEAVY_POOL_MIN_SIZE,
+            settings.DB_HEAVY_POOL_MAX_SIZE,
+            settings.DB_HEAVY_POOL_MAX_WAITING,
+            settings.DB_HEAVY_POOL_TIMEOUT
+        ),
+    }
+
+
+class Replica:
+    """Read replica: one pool per lane plus health / lag state"""
+    
+    def __init__(self, conninfo: str, name: str):
+        self.name = name
+        params = conninfo_to_dict(conninfo)
+        self.host = f"{params.get('host', 'localhost')}:{params.get('port', 5432)}"
+        self.pools = _create_lane_pools(conninfo, prefix=f"{name}-")
+        self.healthy = False  # até o primeiro health check
+        self.lag_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.in_flight = 0
+    
+    @asynccontextmanager
+    async def connection(self, lane: str):
+        self.in_flight += 1
+        try:
+            async with self.pools[lane].connection(timeout=settings.DB_REPLICA_CHECKOUT_TIMEOUT) as conn:
+                yield conn
+        finally:
+            self.in_flight -= 1
+    
+    def mark_unhealthy(self, error: Any):
+        if self.healthy:
+            logger.warning(f"⚠️ Replica {self.name} ({self.host}) fora do roteamento: {error}")
+        self.healthy = False
+        self.last_error = str(error)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "host": self.host,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag_seconds,
+            "in_flight": self.in_flight,
+            "last_error": self.last_error,
+            **{lane: _pool_stats(pool) for lane, pool in self.pools.items()},
+        }
+
 
 class Database:
     """Database connection pool manager with optimized connection handling"""
     
     def __init__(self):
-        self.pool: Optional[AsyncConnectionPool] = None
+        self.pool: Optional[AsyncConnectionPool] = None  # interactive lane
+        self.heavy_pool: Optional[AsyncConnectionPool] = None
+        self.replicas: List[Replica] = []
+        self._round_robin = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
     
     async def connect(self):
-        """Create database connection pool with retry logic"""
+        """Create database connection pools (primary and replicas) with retry logic"""
         if not self.pool:
             try:
-                # Otimizado para free tier: menos conexões = melhor performance
-                self.pool = AsyncConnectionPool(
-                    settings.DATABASE_URL,
-                    min_size=1,
-                    max_size=5,
-                    timeout=20,
-                    max_waiting=5,
-                    open=False
-                )
+                pools = _create_lane_pools(settings.DATABASE_URL)
+                self.pool, self.heavy_pool = pools[INTERACTIVE], pools[HEAVY]
                 await self.pool.open()
-                logger.info("✓ Database connection pool created (min: 1, max: 5)")
+                await self.heavy_pool.open()
+                logger.info(
+                    f"✓ Database connection pools created "
+                    f"(interactive: {settings.DB_POOL_MIN_SIZE}-{settings.DB_POOL_MAX_SIZE}, "
+                    f"heavy: {settings.DB_HEAVY_POOL_MIN_SIZE}-{settings.DB_HEAVY_POOL_MAX_SIZE})"
+                )
             except Exception as e:
                 logger.error(f"✗ Failed to create database pool: {e}")
                 raise
+            
+            await self._connect_replicas()
     
-    async def disconnect(self):
-        """Close database connection pool gracefully"""
-        if self.pool:
+    async def _connect_replicas(self):
+        """Open replica pools and start the health / lag monitor"""
+        for i, conninfo in enumerate(settings.DATABASE_REPLICA_URLS, start=1):
+            replica = Replica(conninfo, f"replica-{i}")
+            for pool in replica.pools.values():
+                await pool.open()
+            self.replicas.append(replica)
+        
+        if self.replicas:
+            await self._check_replicas()
+            self._health_task = asyncio.create_task(self._monitor_replicas())
+            healthy = sum(1 for replica in self.replicas if replica.healthy)
+            logger.info(f"✓ Read replicas: {healthy}/{len(self.replicas)} healthy")
+    
+    async def _check_replicas(self):
+        await asyncio.gather(*[self._check_replica(replica) for replica in self.replicas])
+    
+    async def _check_replica(self, replica: Replica):
+        """Mark a replica healthy if it answers and its lag is within DB_REPLICA_MAX_LAG_SECONDS"""
+        try:
+            async with replica.connection(INTERACTIVE) as conn:
+                cur = await conn.execute(REPLICA_STATUS_QUERY)
+                _, lag_seconds = await cur.fetchone()
+        except Exception as e:
+            replica.lag_seconds = None
+            replica.mark_unhealthy(e)
+            return
+        
+        replica.lag_seconds = float(lag_seconds)
+        if replica.lag_seconds > settings.DB_REPLICA_MAX_LAG_SECONDS:
+            replica.mark_unhealthy(f"lag de {replica.lag_seconds:.1f}s")
+        else:
+            if not replica.healthy:
+                logger.info(f"✓ Replica {replica.name} ({replica.host}) disponível para leituras")
+            replica.healthy = True
+            replica.last_error = None
+    
+    async def _monitor_replicas(self):
+        while True:
+            await asyncio.sleep(settings.DB_REPLICA_HEALTH_INTERVAL)
             try:
-                await self.pool.close()
-                logger.info("✓ Database connection pool closed")
+                await self._check_replicas()
             except Exception as e:
-                logger.error(f"✗ Error closing database pool: {e}")
+                logger.error(f"✗ Replica health check failed: {e}")
     
-    async def fetch_all(self, query: str, *args) -> List[Dict[str, Any]]:
-        """Execute query and fetch all results with error handling"""
+    @staticmethod
+    async def _configure_connection(conn):
+        """
+        Per-connection setup
+        
+        Each pooled connection keeps the most recently used query shapes as
+        prepared statements (psycopg LRU); the least recently used one is
+        deallocated when DB_PREPARED_MAX is reached. Queries are bounded by
+        DB_STATEMENT_TIMEOUT_MS unless a statement_timeout() block overrides it.
+        """
+        conn.prepared_max = settings.DB_PREPARED_MAX
+        await conn.execute(
+            "SELECT set_config('statement_timeout', %s, false)",
+            (str(settings.DB_STATEMENT_TIMEOUT_MS),)
+        )
+        await conn.commit()
+    
+    async def disconnect(self):
+        """Close database connection pools gracefully"""
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        
+        pools = [pool for replica in self.replicas for pool in replica.pools.values()]
+        for pool in [*pools, self.heavy_pool, self.pool]:
+            if pool:
+                try:
+                    await pool.close()
+                    logger.info(f"✓ Database connection pool closed ({pool.name})")
+                except Exception as e:
+                    logger.error(f"✗ Error closing database pool: {e}")
+        self.replicas = []
+    
+    def _pool_for(self, lane: Optional[str] = None) -> AsyncConnectionPool:
         if not self.pool:
             raise RuntimeError("Database pool not initialized")
+        if (lane or _current_lane.get()) == HEAVY and self.heavy_pool:
+            return self.heavy_pool
+        return self.pool
+    
+    def _pick_replica(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if settings.DB_REPLICA_BALANCING == "least_connections":
+            return min(healthy, key=lambda replica: replica.in_flight)
+        return healthy[next(self._round_robin) % len(healthy)]
+    
+    @asynccontextmanager
+    async def connection(
+        self,
+        lane: Optional[str] = None,
+        read: bool = False,
+        timeout_ms: Optional[int] = None
+    ):
+        """
+        Check out a connection from the pool of the current lane
         
+        Queries run on the interactive pool unless the caller is inside
+        use_lane(HEAVY) (or passes lane=HEAVY). Reads (read=True) go to a healthy
+        replica when any is configured, except inside use_primary; if the
+        replica can't hand out a connection in DB_REPLICA_CHECKOUT_TIMEOUT it
+        leaves the rotation and the read falls back to the primary.
+        
+        If the task is cancelled while a query runs (e.g. the client
+        disconnected), psycopg cancels the query on the server before the
+        connection goes back to the pool. timeout_ms overrides the
+        statement_timeout() of the current context.
+        """
+        lane = lane or _current_lane.get()
+        replica = self._pick_replica() if read and not _read_from_primary.get() else None
+        
+        async with AsyncExitStack() as stack:
+            conn = None
+            if replica:
+                try:
+                    conn = await stack.enter_async_context(replica.connection(lane))
+                except (PoolTimeout, psycopg.OperationalError) as e:
+                    replica.mark_unhealthy(e)
+            if conn is None:
+                conn = await stack.enter_async_context(self._pool_for(lane).connection())
+            
+            if timeout_ms is None:
+                timeout_ms = _statement_timeout_ms.get()
+            if timeout_ms is not None and timeout_ms != settings.DB_STATEMENT_TIMEOUT_MS:
+                # Local à transação: o pool faz commit/rollback ao devolver a conexão
+                await conn.execute("SELECT set_config('statement_timeout', %s, true)", (str(timeout_ms),))
+            yield conn
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Pool metrics per lane (size, connections in use, waits, rejections) and replica health"""
+        stats = {}
+        for lane, pool in ((INTERACTIVE, self.pool), (HEAVY, self.heavy_pool)):
+            if pool:
+                stats[lane] = _pool_stats(pool)
+        stats["replicas"] = [replica.get_stats() for replica in self.replicas]
+        return stats
+    
+    async def fetch_all(self, query: str, *args, prepare: Optional[bool] = None) -> List[Dict[str, Any]]:
+        """Execute query and fetch all results with error handling"""
         try:
-            async with self.pool.connection() as conn:
+            async with self.connection(read=True) as conn:
                 async with conn.cursor() as cur:
-                    await cur.execute(query, args or ())
+                    await cur.execute(query, args or (), prepare=prepare)
                     if not cur.description:
                         return []
                     columns = [desc[0] for desc in cur.description]
@@ -62,15 +367,12 @@ class Database:
             logger.debug(f"Query: {query}")
             raise
     
-    async def fetch_one(self, query: str, *args) -> Optional[Dict[str, Any]]:
+    async def fetch_one(self, query: str, *args, prepare: Optional[bool] = None) -> Optional[Dict[str, Any]]:
         """Execute query and fetch one result with error handling"""
-        if not self.pool:
-            raise RuntimeError("Database pool not initialized")
-        
         try:
-            async with self.pool.connection() as conn:
+            async with self.connection(read=True) as conn:
                 async with conn.cursor() as cur:
-                    await cur.execute(query, args or ())
+                    await cur.execute(query, args or (), prepare=prepare)
                     row = await cur.fetchone()
                     if row and cur.description:
                         columns = [desc[0] for desc in cur.description]
@@ -81,13 +383,96 @@ class Database:
             logger.debug(f"Query: {query}")
             raise
     
+    async def fetch_tuples(
+        self,
+        query: str,
+        *args,
+        prepare: Optional[bool] = None
+    ) -> Tuple[List[str], List[tuple]]:
+        """
+        Execute query and return rows as plain tuples
+        
+        Results come in binary format (no text parsing of numerics/dates) and
+        no dict is built per row. Use for large results where the caller only
+        needs the values, or builds its own output structure.
+        
+        Args:
+            prepare: True to prepare the statement on the connection right away,
+                False to never prepare it, None to let psycopg prepare it after
+                DB_PREPARE_THRESHOLD executions
+        
+        Returns:
+            (column names, rows)
+        """
+        try:
+            async with self.connection(read=True) as conn:
+                async with conn.cursor(binary=True) as cur:
+                    await cur.execute(query, args or (), prepare=prepare)
+                    if not cur.description:
+                        return [], []
+                    columns = [desc[0] for desc in cur.description]
+                    return columns, await cur.fetchall()
+        except Exception as e:
+            logger.error(f"✗ Error executing query: {e}")
+            logger.debug(f"Query: {query}")
+            raise
+    
+    async def fetch_columns(
+        self,
+        query: str,
+        *args,
+        prepare: Optional[bool] = None
+    ) -> Tuple[List[str], List[list]]:
+        """
+        Execute query and return results column by column (see fetch_tuples)
+        
+        Returns:
+            (column names, one list of values per column)
+        """
+        columns, rows = await self.fetch_tuples(query, *args, prepare=prepare)
+        if not rows:
+            return columns, [[] for _ in columns]
+        return columns, [list(values) for values in zip(*rows)]
+    
+    async def stream(
+        self,
+        query: str,
+        *args,
+        batch_size: int = 1000,
+        timeout_ms: Optional[int] = None
+    ) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+        """
+        Stream results in batches through a server-side (named) cursor
+        
+        Only one batch is held in memory at a time. The pooled connection stays
+        checked out until the consumer finishes (or stops) iterating, so streams
+        always run on the heavy lane. The first batch is always yielded, even if
+        empty, so consumers get the columns. timeout_ms sets the stream's
+        statement_timeout (it usually outlives the caller's context).
+        
+        Yields:
+            (column names, rows as tuples)
+        """
+        try:
+            async with self.connection(HEAVY, read=True, timeout_ms=timeout_ms) as conn:
+                async with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+                    cur.itersize = batch_size
+                    await cur.execute(query, args or ())
+                    columns = [desc[0] for desc in cur.description] if cur.description else []
+                    while True:
+                        rows = await cur.fetchmany(batch_size)
+                        yield columns, rows
+                        if len(rows) < batch_size:
+                            break
+        except Exception as e:
+            logger.error(f"✗ Error streaming query: {e}")
+            logger.debug(f"Query: {query}")
+            raise
+    
     async def execute(self, query: str, *args) -> int:
         """Execute query without returning results, returns affected rows"""
-        if not self.pool:
-            raise RuntimeError("Database pool not initialized")
-        
         try:
-            async with self.pool.connection() as conn:
+            async with self.connection() as conn:
                 async with conn.cursor() as cur:
                     await cur.execute(query, args or ())
                     return cur.rowcount
@@ -0,0 +1,465 @@
+"""
+Incrementally maintained summary tables for the query router
+
+vendas_agregadas, produtos_analytics and delivery_metrics used to be
+materialized views: refreshing them recomputed every historical day. They are
+now regular tables bucketed by data_venda. Each refresh recomputes only the
+days touched by sales inserted since a watermark (sales.id), plus the last
+SUMMARY_REFRESH_LOOKBACK_DAYS days (late product/address rows, status
+changes), replacing those days in one transaction per table.
+
+Usage:
+    python -m app.db.summaries           # incremental refresh
+    python -m app.db.summaries --init    # convert the materialized views and backfill
+    python -m app.db.summaries --full    # recompute every day
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg
+
+from app.cache.redis_client import redis_cache, store_invalidation_tags
+from app.config import settings
+from app.db.database import db, HEAVY
+
+# Fix for Windows ProactorEventLoop issue with psycopg3
+if sys.platform == 'win32':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+logger = logging.getLogger(__name__)
+
+# Um lock por tabela (base + posição): workers não refrescam a mesma tabela juntos
+REFRESH_LOCK_ID = 72_310_021
+
+# Filtro de intervalo inserido no WHERE de cada SELECT (vazio para criar a tabela)
+RANGE_FILTER = "AND s.created_at >= %s AND s.created_at < %s"
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS summary_refresh_state (
+    name TEXT PRIMARY KEY,
+    last_sale_id BIGINT NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP,
+    duration_ms DOUBLE PRECISION,
+    days_refreshed INTEGER,
+    rows_written BIGINT
+)
+"""
+
+
+class SummaryTable:
+    """A summary table: its SELECT (with a {range_filter} slot) and indexes"""
+
+    def __init__(self, name: str, select: str, indexes: Dict[str, str]):
+        self.name = name
+        self.select = select
+        self.indexes = indexes
+
+
+SUMMARIES = [
+    SummaryTable(
+        name="vendas_agregadas",
+        select="""
+            SELECT
+                s.store_id,
+                st.name as store_name,
+                s.channel_id,
+                ch.name as channel_name,
+                DATE(s.created_at) as data_venda,
+                EXTRACT(DOW FROM s.created_at) as dia_semana,
+                EXTRACT(HOUR FROM s.created_at) as hora,
+                CASE
+                    WHEN EXTRACT(HOUR FROM s.created_at) BETWEEN 6 AND 11 THEN 'Manhã'
+                    WHEN EXTRACT(HOUR FROM s.created_at) BETWEEN 12 AND 17 THEN 'Tarde'
+                    WHEN EXTRACT(HOUR FROM s.created_at) BETWEEN 18 AND 23 THEN 'Noite'
+                    ELSE 'Madrugada'
+                END as periodo_dia,
+                COUNT(DISTINCT s.id) as qtd_vendas,
+                SUM(s.total_amount) as faturamento,
+                AVG(s.total_amount) as ticket_medio,
+                COUNT(DISTINCT s.customer_id) FILTER (WHERE s.customer_id IS NOT NULL) as clientes_unicos,
+                SUM(s.total_discount) as total_descontos,
+                AVG(s.production_seconds) FILTER (WHERE s.production_seconds IS NOT NULL) as tempo_medio_preparo_seg,
+                AVG(s.delivery_seconds) FILTER (WHERE s.delivery_seconds IS NOT NULL) as tempo_medio_entrega_seg,
+                -- Componentes aditivos para re-agregar médias no query router
+                SUM(s.production_seconds) as soma_preparo_seg,
+                COUNT(s.production_seconds) as qtd_preparos,
+                SUM(s.delivery_seconds) as soma_entrega_seg,
+                COUNT(s.delivery_seconds) as qtd_entregas
+            FROM sales s
+            JOIN stores st ON s.store_id = st.id
+            JOIN channels ch ON s.channel_id = ch.id
+            WHERE s.sale_status_desc = 'COMPLETED'
+            {range_filter}
+            GROUP BY s.store_id, st.name, s.channel_id, ch.name,
+                     DATE(s.created_at), dia_semana, hora, periodo_dia
+        """,
+        indexes={
+            "idx_vendas_agregadas_data": "(data_venda)",
+            "idx_vendas_agregadas_store": "(store_id)",
+            "idx_vendas_agregadas_channel": "(channel_id)",
+        },
+    ),
+    SummaryTable(
+        name="produtos_analytics",
+        select="""
+            SELECT
+                p.id as product_id,
+                p.name as produto_nome,
+                cat.name as categoria,
+                s.channel_id,
+                ch.name as channel_name,
+                DATE(s.created_at) as data_venda,
+                EXTRACT(DOW FROM s.created_at) as dia_semana,
+                CASE
+                    WHEN EXTRACT(HOUR FROM s.created_at) BETWEEN 6 AND 11 THEN 'Manhã'
+                    WHEN EXTRACT(HOUR FROM s.created_at) BETWEEN 12 AND 17 THEN 'Tarde'
+                    WHEN EXTRACT(HOUR FROM s.created_at) BETWEEN 18 AND 23 THEN 'Noite'
+                    ELSE 'Madrugada'
+                END as periodo_dia,
+                SUM(ps.quantity) as quantidade_vendida,
+                SUM(ps.total_price) as faturamento_produto,
+                COUNT(DISTINCT s.id) as num_vendas
+            FROM product_sales ps
+            JOIN sales s ON ps.sale_id = s.id
+            JOIN products p ON ps.product_id = p.id
+            JOIN categories cat ON p.category_id = cat.id
+            JOIN channels ch ON s.channel_id = ch.id
+            WHERE s.sale_status_desc = 'COMPLETED'
+            {range_filter}
+            GROUP BY p.id, p.name, cat.name, s.channel_id, ch.name,
+                     DATE(s.created_at), dia_semana, periodo_dia
+        """,
+        indexes={
+            "idx_produtos_analytics_product": "(product_id)",
+            "idx_produtos_analytics_data": "(data_venda)",
+            "idx_produtos_analytics_channel": "(channel_id)",
+        },
+    ),
+    SummaryTable(
+        name="delivery_metrics",
+        select="""
+            SELECT
+                da.neighborhood as bairro,
+                da.city as cidade,
+                da.state as estado,
+                s.channel_id,
+                ch.name as channel_name,
+                DATE(s.created_at) as data_venda,
+                COUNT(s.id) as total_entregas,
+                AVG(s.delivery_seconds / 60.0) as tempo_medio_entrega_min,
+                PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY s.delivery_seconds / 60.0) as p50_entrega_min,
+                PERCENTILE_CONT(0.90) WITHIN GROUP (ORDER BY s.delivery_seconds / 60.0) as p90_entrega_min,
+                PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY s.delivery_seconds / 60.0) as p95_entrega_min,
+                AVG(da.latitude) as avg_latitude,
+                AVG(da.longitude) as avg_longitude
+            FROM sales s
+            JOIN delivery_addresses da ON s.id = da.sale_id
+            JOIN channels ch ON s.channel_id = ch.id
+            WHERE s.sale_status_desc = 'COMPLETED'
+              AND s.delivery_seconds IS NOT NULL
+              AND da.neighborhood IS NOT NULL
+            {range_filter}
+            GROUP BY da.neighborhood, da.city, da.state, s.channel_id, ch.name, DATE(s.created_at)
+        """,
+        indexes={
+            "idx_delivery_metrics_bairro": "(bairro)",
+            "idx_delivery_metrics_data": "(data_venda)",
+        },
+    ),
+]
+
+
+def _day_ranges(days: List[date]) -> List[Tuple[date, date]]:
+    """Coalesce days into half-open [start, end) ranges of consecutive days"""
+    ranges: List[Tuple[date, date]] = []
+    for day in sorted(set(days)):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1] = (ranges[-1][0], day + timedelta(days=1))
+        else:
+            ranges.append((day, day + timedelta(days=1)))
+    return ranges
+
+
+async def _relkind(conn: psycopg.AsyncConnection, name: str) -> Optional[str]:
+    cur = await conn.execute(
+        "SELECT relkind FROM pg_class WHERE relname = %s AND relnamespace = 'public'::regnamespace",
+        (name,)
+    )
+    row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def create_summary_tables(conn: psycopg.AsyncConnection):
+    """
+    Create the summary tables (empty) and the refresh state
+
+    Materialized views with the same name are dropped and their watermark
+    reset, so the next refresh backfills every day.
+    """
+    await conn.execute(STATE_SCHEMA)
+    for summary in SUMMARIES:
+        kind = await _relkind(conn, summary.name)
+        if kind == 'm':
+            print(f"🔁 Converting materialized view {summary.name} into a summary table...")
+            await conn.execute(f"DROP MATERIALIZED VIEW {summary.name} CASCADE")
+            kind = None
+        if kind is None:
+            await conn.execute(
+                f"CREATE TABLE {summary.name} AS {summary.select.format(range_filter='')} WITH NO DATA"
+            )
+            await conn.execute("DELETE FROM summary_refresh_state WHERE name = %s", (summary.name,))
+        for index, columns in summary.indexes.items():
+            await conn.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {summary.name} {columns}")
+        await conn.execute(
+            "INSERT INTO summary_refresh_state (name) VALUES (%s) ON CONFLICT (name) DO NOTHING",
+            (summary.name,)
+        )
+
+
+async def refresh_summary(
+    conn: psycopg.AsyncConnection,
+    position: int,
+    full: bool = False
+) -> Optional[Dict[str, Any]]:
+    """
+    Replace the days of one summary touched since its watermark
+
+    Runs in a single transaction (readers see either the old or the new
+    days). Returns None when another worker holds the table's lock.
+    """
+    summary = SUMMARIES[position]
+    start = time.time()
+    async with conn.transaction():
+        cur = await conn.execute("SELECT pg_try_advisory_xact_lock(%s)", (REFRESH_LOCK_ID + position,))
+        if not (await cur.fetchone())[0]:
+            return None
+
+        # Linha de estado ausente (tabela criada à mão): começa do zero
+        await conn.execute(
+            "INSERT INTO summary_refresh_state (name) VALUES (%s) ON CONFLICT (name) DO NOTHING",
+            (summary.name,)
+        )
+        cur = await conn.execute(
+            "SELECT last_sale_id FROM summary_refresh_state WHERE name = %s FOR UPDATE",
+            (summary.name,)
+        )
+        since = (await cur.fetchone())[0]
+        cur = await conn.execute("SELECT MAX(id), MAX(created_at)::date FROM sales")
+        until, last_day = await cur.fetchone()
+        if until is None:
+            return {"name": summary.name, "days_refreshed": 0, "rows_written": 0,
+                    "last_sale_id": since, "duration_ms": 0.0, "changed": False, "stores": []}
+
+        # Lojas (id e nome) das vendas novas, para invalidar só o cache delas; None = todas
+        stores: Optional[List[Any]] = None
+        if not (full or since == 0):
+            cur = await conn.execute(
+                """
+                SELECT DISTINCT s.store_id, st.name
+                FROM sales s LEFT JOIN stores st ON st.id = s.store_id
+                WHERE s.id > %s AND s.id <= %s
+                """,
+                (since, until)
+            )
+            stores = sorted(
+                {value for row in await cur.fetchall() for value in row if value is not None}, key=str
+            )
+
+        if full or since == 0:
+            cur = await conn.execute("SELECT MIN(created_at)::date FROM sales")
+            first_day = (await cur.fetchone())[0]
+            days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+        else:
+            cur = await conn.execute(
+                "SELECT DISTINCT created_at::date FROM sales WHERE id > %s AND id <= %s",
+                (since, until)
+            )
+            days = [row[0] for row in await cur.fetchall()]
+            days += [last_day - timedelta(days=i) for i in range(settings.SUMMARY_REFRESH_LOOKBACK_DAYS + 1)]
+
+        rows_written = 0
+        insert = f"INSERT INTO {summary.name} {summary.select.format(range_filter=RANGE_FILTER)}"
+        for range_start, range_end in _day_ranges(days):
+            await conn.execute(
+                f"DELETE FROM {summary.name} WHERE data_venda >= %s AND data_venda < %s",
+                (range_start, range_end)
+            )
+            cur = await conn.execute(insert, (range_start, range_end))
+            rows_written += cur.rowcount
+
+        duration_ms = round((time.time() - start) * 1000, 2)
+        await conn.execute(
+            """
+            UPDATE summary_refresh_state SET
+                last_sale_id = %s, refreshed_at = now(), duration_ms = %s,
+                days_refreshed = %s, rows_written = %s
+            WHERE name = %s
+            """,
+            (until, duration_ms, len(set(days)), rows_written, summary.name)
+        )
+
+    return {
+        "name": summary.name,
+        "days_refreshed": len(set(days)),
+        "rows_written": rows_written,
+        "last_sale_id": until,
+        "duration_ms": duration_ms,
+        # Os dias de lookback são reescritos sempre; só vendas novas ou um refresh completo mudam os dados
+        "changed": full or since == 0 or until > since,
+        "stores": stores,
+    }
+
+
+class SummaryRefresher:
+    """Refreshes the summary tables on a schedule inside the app"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.last_result: Dict[str, Any] = {}
+
+    def start(self):
+        if self._task is None and settings.SUMMARY_REFRESH_INTERVAL > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.SUMMARY_REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"⚠️ Summary refresh failed: {e}")
+
+    async def refresh(self, full: bool = False) -> Dict[str, Any]:
+        """
+        Refresh every summary that exists as a table
+
+        Tables still defined as materialized views are skipped until
+        converted with --init. Cached results are invalidated only when new
+        sales were applied (for their stores) or a full refresh ran.
+        """
+        async with self._lock:
+            results = []
+            for position, summary in enumerate(SUMMARIES):
+                # Uma conexão (e transação) por tabela, sem statement_timeout
+                async with db.connection(lane=HEAVY, timeout_ms=0) as conn:
+                    if await _relkind(conn, "summary_refresh_state") != 'r':
+                        break
+                    if await _relkind(conn, summary.name) != 'r':
+                        continue
+                    result = await refresh_summary(conn, position, full=full)
+                if result:
+                    results.append(result)
+
+            self.runs += 1
+            self.last_result = {
+                "finished_at": datetime.now().isoformat(),
+                "tables": results,
+            }
+            changed = [result for result in results if result["changed"]]
+            if changed:
+                # Resultados roteados para as tabelas de resumo são cacheados com as tags de sales
+                if any(result["stores"] is None for result in changed):
+                    tags = ["sales"]
+                else:
+                    stores = {store for result in changed for store in result["stores"]}
+                    tags = store_invalidation_tags("sales", sorted(stores, key=str))
+                await redis_cache.invalidate_tags(tags)
+                logger.info(
+                    "📚 Summaries refreshed: "
+                    + ", ".join(f"{r['name']} ({r['days_refreshed']} days, {r['duration_ms']}ms)" for r in results)
+                )
+            return self.last_result
+
+    async def get_freshness(self) -> Dict[str, Any]:
+        """
+        Freshness of each summary table
+
+        age_seconds: since the last refresh. pending_sales: sales inserted
+        after the watermark. lag_seconds: how long those sales have been
+        waiting at most (0 when up to date).
+        """
+        row = await db.fetch_one("SELECT to_regclass('summary_refresh_state') IS NOT NULL AS ready")
+        if not row or not row['ready']:
+            return {"interval_seconds": settings.SUMMARY_REFRESH_INTERVAL, "runs": self.runs,
+                    "failures": self.failures, "tables": []}
+        
+        rows = await db.fetch_all("""
+            SELECT
+                st.name,
+                st.last_sale_id,
+                st.refreshed_at,
+                st.duration_ms,
+                st.days_refreshed,
+                st.rows_written,
+                EXTRACT(EPOCH FROM now() - st.refreshed_at) AS age_seconds,
+                (SELECT COUNT(*) FROM sales s WHERE s.id > st.last_sale_id) AS pending_sales
+            FROM summary_refresh_state st
+            ORDER BY st.name
+        """)
+        tables = []
+        for row in rows:
+            age = float(row['age_seconds']) if row['age_seconds'] is not None else None
+            tables.append({
+                "name": row['name'],
+                "last_sale_id": row['last_sale_id'],
+                "refreshed_at": row['refreshed_at'].isoformat() if row['refreshed_at'] else None,
+                "age_seconds": round(age, 1) if age is not None else None,
+                "duration_ms": row['duration_ms'],
+                "days_refreshed": row['days_refreshed'],
+                "rows_written": row['rows_written'],
+                "pending_sales": row['pending_sales'],
+                "lag_seconds": (round(age, 1) if age is not None else None) if row['pending_sales'] else 0,
+            })
+        return {
+            "interval_seconds": settings.SUMMARY_REFRESH_INTERVAL,
+            "runs": self.runs,
+            "failures": self.failures,
+            "tables": tables,
+        }
+
+
+# Instância global
+summary_refresher = SummaryRefresher()
+
+
+async def main(args: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Refresh the analytics summary tables")
+    parser.add_argument("--init", action="store_true", help="Create / convert the tables and backfill")
+    parser.add_argument("--full", action="store_true", help="Recompute every day")
+    options = parser.parse_args(args)
+
+    await db.connect()
+    try:
+        if options.init:
+            async with db.connection(lane=HEAVY, timeout_ms=0) as conn:
+                async with conn.transaction():
+                    await create_summary_tables(conn)
+        result = await summary_refresher.refresh(full=options.full)
+        for table in result["tables"]:
+            print(f"✓ {table['name']}: {table['days_refreshed']} days, {table['rows_written']} rows, {table['duration_ms']}ms")
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
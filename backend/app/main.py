@@ -15,7 +15,16 @@ if sys.platform == 'win32':
 from app.config import settings
 from app.db.database import db
 from app.cache.redis_client import redis_cache
+from app.cache.refresh import cache_refresher
+from app.db.summaries import summary_refresher
+from app.db.customer_state import customer_state
+from app.services.alert_service import alert_service
+from app.services.alert_scheduler import alert_scheduler
+from app.services.live_updates import live_hub
+from app.services.rolling_aggregates import rolling_aggregates
+from app.services.query_router import query_router
 from app.api import analytics, alerts
+from app.api.middleware import CancelOnDisconnectMiddleware
 
 # Configure logging
 logging.basicConfig(
@@ -31,11 +40,26 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("🚀 Starting Restaurant Analytics API...")
     await db.connect()
+    await query_router.load_catalog()
     await redis_cache.connect()
     logger.info("✅ Redis cache connected")
+    cache_refresher.start()
+    summary_refresher.start()
+    customer_state.start()
+    alert_service.start()
+    alert_scheduler.start()
+    rolling_aggregates.start()
+    live_hub.start()
     yield
     # Shutdown
     logger.info("🔴 Shutting down Restaurant Analytics API...")
+    await live_hub.stop()
+    await rolling_aggregates.stop()
+    await alert_scheduler.stop()
+    await alert_service.stop()
+    await customer_state.stop()
+    await summary_refresher.stop()
+    await cache_refresher.stop()
     await redis_cache.disconnect()
     await db.disconnect()
 
@@ -57,6 +81,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Stop the SQL of requests whose client went away
+app.add_middleware(CancelOnDisconnectMiddleware)
+
 # Include routers
 app.include_router(analytics.router)
 app.include_router(alerts.router)
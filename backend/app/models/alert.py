@@ -1,8 +1,8 @@
 """
 Modelos para sistema de alertas
 """
-from pydantic import BaseModel, Field
-from typing import Optional, List, Literal
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional, List, Literal, Dict, Any
 from datetime import datetime
 from uuid import UUID, uuid4
 
@@ -14,16 +14,40 @@ class AlertCondition(BaseModel):
     threshold: float = Field(..., description="Valor limite")
 
 
+def _check_filter_keys(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Só dimensões conhecidas: a chave vira uma expressão SQL na avaliação"""
+    # Import tardio: o serviço de analytics importa os modelos
+    from app.services.analytics_service import AnalyticsService
+    unknown = sorted(set(filters or {}) - set(AnalyticsService.DIMENSIONS_MAP))
+    if unknown:
+        raise ValueError(f"Filtros desconhecidos: {', '.join(unknown)} (use as dimensões do /query)")
+    return filters
+
+
 class AlertCreate(BaseModel):
     """Request para criar alerta"""
     name: str = Field(..., description="Nome do alerta")
     description: Optional[str] = Field(None, description="Descrição do alerta")
     condition: AlertCondition
+    filters: Dict[str, Any] = Field(
+        default={},
+        description="Filtros aplicados à métrica, no formato do /query (ex.: {'canal_venda': ['iFood']})"
+    )
+    window_minutes: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Janela móvel em minutos até agora (None = todo o histórico)"
+    )
     enabled: bool = Field(True, description="Se o alerta está ativo")
     notification_channels: List[Literal["toast", "email", "webhook"]] = Field(
         default=["toast"], 
         description="Canais de notificação"
     )
+    
+    @field_validator("filters")
+    @classmethod
+    def validate_filters(cls, filters: Dict[str, Any]) -> Dict[str, Any]:
+        return _check_filter_keys(filters)
 
 
 class AlertUpdate(BaseModel):
@@ -31,8 +55,15 @@ class AlertUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     condition: Optional[AlertCondition] = None
+    filters: Optional[Dict[str, Any]] = None
+    window_minutes: Optional[int] = Field(None, ge=1)
     enabled: Optional[bool] = None
     notification_channels: Optional[List[str]] = None
+    
+    @field_validator("filters")
+    @classmethod
+    def validate_filters(cls, filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        return _check_filter_keys(filters)
 
 
 class Alert(AlertCreate):
@@ -57,6 +57,40 @@ class AnalyticsQueryRequest(BaseModel):
     )
     limit: Optional[int] = Field(default=100, le=1000)
     offset: Optional[int] = Field(default=0, ge=0)
+    cursor: Optional[str] = Field(
+        default=None,
+        description="Continuation token (metadata.next_cursor of the previous page); replaces offset"
+    )
+
+
+class AnalyticsExportRequest(AnalyticsQueryRequest):
+    """Analytics query streamed as a file export (no row cap)"""
+    limit: Optional[int] = Field(default=None, ge=1)
+
+
+class AnalyticsBatchRequest(BaseModel):
+    """Several analytics queries executed together (e.g. all widgets of a dashboard)"""
+    queries: List[AnalyticsQueryRequest] = Field(..., min_length=1, max_length=20)
+
+
+class LiveKPIRequest(BaseModel):
+    """KPI cards of a live subscription (same parameters as GET /kpis)"""
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    filters: Dict[str, Any] = Field(default={}, description="canal_venda / nome_loja / nome_produto lists")
+    hours: Optional[int] = Field(default=None, ge=1, description="Only the last N hours")
+
+
+class LiveSubscription(BaseModel):
+    """One widget of a live dashboard: an analytics query or the KPI cards"""
+    id: str = Field(..., max_length=200, description="Client id of the widget, echoed in its events")
+    query: Optional[AnalyticsQueryRequest] = None
+    kpis: Optional[LiveKPIRequest] = None
+
+
+class LiveSubscribeRequest(BaseModel):
+    """Set of widgets a client wants pushed (POST /live)"""
+    subscriptions: List[LiveSubscription] = Field(..., min_length=1, max_length=50)
 
 
 class ComparisonPeriod(BaseModel):
@@ -73,6 +107,8 @@ class QueryMetadata(BaseModel):
     total_rows: int
     query_time_ms: float
     cached: bool = False
+    source: Optional[str] = Field(default=None, description="Relation that answered the query (e.g. 'sales', 'vendas_agregadas')")
+    next_cursor: Optional[str] = Field(default=None, description="Token for the next page (keyset pagination), None on the last page")
     timestamp: datetime = Field(default_factory=datetime.now)
 
 
@@ -105,6 +141,12 @@ class AnalyticsQueryResponse(BaseModel):
     metadata: QueryMetadata
 
 
+class AnalyticsBatchResponse(BaseModel):
+    """Batch query response, results in the same order as the requested queries"""
+    results: List[AnalyticsQueryResponse]
+    metadata: QueryMetadata
+
+
 class KPICard(BaseModel):
     """KPI card data"""
     label: str
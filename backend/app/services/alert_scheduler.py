@@ -0,0 +1,246 @@
+"""
+Server-side alert evaluation
+
+Every ALERT_EVAL_INTERVAL seconds the enabled alerts are grouped by the
+filters they apply (and the extra joins their metric needs). Each group is
+answered by one statement computing all of its metrics over all of its
+windows (AnalyticsService.build_window_metrics_query), so N alerts cost one
+query per distinct filter set instead of one per alert.
+
+With Redis, one worker per tick evaluates (leader key) and publishes the
+results on RESULTS_CHANNEL; every worker forwards them to its own
+/alerts/stream clients. Without Redis each worker evaluates on its own.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.cache.redis_client import redis_cache
+from app.cache.serializers import json_dumps
+from app.config import settings
+from app.db.database import db, statement_timeout, use_lane, HEAVY
+from app.models.alert import Alert, AlertCheckResult
+from app.services.alert_service import alert_service
+from app.services.analytics_service import analytics_service
+
+logger = logging.getLogger(__name__)
+
+# Eventos guardados por assinante lento antes de descartar os mais antigos
+SUBSCRIBER_QUEUE_SIZE = 16
+# Apenas um worker por ciclo avalia os alertas
+LEADER_KEY = "alerts:scheduler-leader"
+# Resultados de cada avaliação, repassados por todos os workers aos seus clientes
+RESULTS_CHANNEL = "alerts:results"
+
+GroupKey = Tuple[str, frozenset]
+
+
+class AlertGroup:
+    """Alerts answered by the same statement: same filters and metric joins"""
+
+    def __init__(self, filters: Dict[str, Any]):
+        self.filters = filters
+        self.metrics: List[str] = []
+        self.windows: List[Optional[int]] = []
+
+    def add(self, alert: Alert):
+        if alert.condition.metric not in self.metrics:
+            self.metrics.append(alert.condition.metric)
+        if alert.window_minutes not in self.windows:
+            self.windows.append(alert.window_minutes)
+
+
+def _is_additive(metric: str) -> bool:
+    # Somas e contagens valem 0 numa janela sem vendas; médias e percentis ficam indefinidos
+    return analytics_service.METRICS_MAP[metric].startswith(("SUM(", "COUNT("))
+
+
+class AlertScheduler:
+    """Evaluates the enabled alerts periodically and pushes the results"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._subscribers: Set[asyncio.Queue] = set()
+        self.runs = 0
+        self.failures = 0
+        self.statements = 0
+        self.failed_groups = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_results: List[AlertCheckResult] = []
+
+    def start(self):
+        if self._listener is None and redis_cache.redis:
+            self._listener = asyncio.create_task(self._listen())
+        if self._task is None and settings.ALERT_EVAL_INTERVAL > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._task, self._listener):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._listener = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.ALERT_EVAL_INTERVAL)
+            try:
+                redis = redis_cache.redis
+                if redis:
+                    acquired = await redis.set(
+                        LEADER_KEY, uuid.uuid4().hex, nx=True, ex=max(1, int(settings.ALERT_EVAL_INTERVAL))
+                    )
+                    if not acquired:
+                        continue
+                await self.evaluate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"⚠️ Alert evaluation failed: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = redis_cache.redis.pubsub()
+                await pubsub.subscribe(RESULTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._deliver(message["data"].encode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Alert results channel disconnected: {e}")
+                await asyncio.sleep(5)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue receiving the encoded payload of every evaluation"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    async def _publish(self, results: List[AlertCheckResult]):
+        # Serializado uma vez para todos os assinantes
+        payload = json_dumps({
+            "checked_at": self.last_run_at.isoformat(),
+            "results": [result.model_dump(mode="json") for result in results],
+        })
+        if self._listener:
+            try:
+                await redis_cache.redis.publish(RESULTS_CHANNEL, payload)
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ Could not publish alert results: {e}")
+        self._deliver(payload)
+
+    def _deliver(self, payload: bytes):
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(payload)
+
+    @use_lane(HEAVY)
+    async def _fetch_group(self, group: AlertGroup) -> Dict[Optional[int], Dict[str, Any]]:
+        """Metric values of a group, per window (heavy lane: windows may span all history)"""
+        query, params = analytics_service.build_window_metrics_query(group.metrics, group.filters, group.windows)
+        with statement_timeout(settings.DB_TIMEOUT_ALERTS_MS):
+            columns, rows = await db.fetch_tuples(query, *params)
+        self.statements += 1
+        values: Dict[Optional[int], Dict[str, Any]] = {}
+        for row in rows:
+            record = dict(zip(columns, row))
+            values[group.windows[record.pop("_window")]] = record
+        return values
+
+    async def evaluate(self) -> List[AlertCheckResult]:
+        """
+        Evaluate every enabled alert now
+
+        Alerts with an unknown metric, or whose metric is undefined over their
+        window (e.g. an average with no sales), are skipped.
+        """
+        async with self._lock:
+            start = time.time()
+            alerts = await alert_service.list_alerts(enabled_only=True)
+
+            groups: Dict[GroupKey, AlertGroup] = {}
+            keys: Dict[Any, GroupKey] = {}
+            for alert in alerts:
+                metric = alert.condition.metric
+                if metric not in analytics_service.METRICS_MAP:
+                    logger.warning(f"⚠️ Alert '{alert.name}' uses unknown metric {metric}, skipped")
+                    continue
+                key = (
+                    json.dumps(alert.filters, sort_keys=True, default=str),
+                    frozenset(analytics_service.metric_joins(metric)),
+                )
+                groups.setdefault(key, AlertGroup(alert.filters)).add(alert)
+                keys[alert.id] = key
+
+            # Em sequência, no lane HEAVY: poucas queries, sem disputar o pool com o dashboard
+            values: Dict[GroupKey, Dict[Optional[int], Dict[str, Any]]] = {}
+            failed = 0
+            for key, group in groups.items():
+                try:
+                    values[key] = await self._fetch_group(group)
+                except Exception as e:
+                    # Um grupo com erro (filtro inválido, timeout) não impede os demais
+                    failed += 1
+                    logger.warning(f"⚠️ Alert group {group.filters} ({', '.join(group.metrics)}) failed: {e}")
+
+            results = []
+            for alert in alerts:
+                if alert.id not in keys or keys[alert.id] not in values:
+                    continue
+                metric = alert.condition.metric
+                value = values[keys[alert.id]].get(alert.window_minutes, {}).get(metric)
+                if value is None:
+                    if not _is_additive(metric):
+                        continue
+                    value = 0
+                results.append(alert_service.check_alert(alert, {metric: float(value)}))
+
+            self.runs += 1
+            self.failed_groups += failed
+            self.last_run_at = datetime.utcnow()
+            self.last_duration_ms = round((time.time() - start) * 1000, 2)
+            self.last_results = results
+            await alert_service.record_triggers(results)
+            await self._publish(results)
+
+            triggered = sum(1 for result in results if result.triggered)
+            logger.info(
+                f"🔔 Alerts evaluated: {len(results)} alerts, {len(groups)} queries ({failed} failed), "
+                f"{triggered} triggered ({self.last_duration_ms}ms)"
+            )
+            return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": settings.ALERT_EVAL_INTERVAL,
+            "runs": self.runs,
+            "failures": self.failures,
+            "statements": self.statements,
+            "failed_groups": self.failed_groups,
+            "subscribers": len(self._subscribers),
+            "alerts": alert_service.stats(),
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_duration_ms": self.last_duration_ms,
+        }
+
+
+# Instância global
+alert_scheduler = AlertScheduler()
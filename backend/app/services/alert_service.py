@@ -1,57 +1,178 @@
 """
 Serviço de gerenciamento de alertas
+
+Os alertas ficam no Postgres (app/db/alert_repository.py). Cada worker mantém
+uma cópia em memória com write-through: escritas vão para o banco e para a
+cópia local, e são anunciadas no Redis (ALERTS_CHANNEL) para os outros workers
+ressincronizarem. A cópia também é conferida com o banco a cada
+ALERT_CACHE_CHECK_INTERVAL segundos, caso uma mensagem se perca.
 """
-from typing import List, Optional, Dict
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional
 from uuid import UUID
 from datetime import datetime
 
+from app.cache.redis_client import redis_cache
+from app.config import settings
+from app.db.alert_repository import alert_repository
 from app.models.alert import Alert, AlertCreate, AlertUpdate, AlertCheckResult, AlertCondition
 
+logger = logging.getLogger(__name__)
+
+# Canal pub/sub com o id de cada alerta criado, alterado ou removido
+ALERTS_CHANNEL = "alerts:changed"
+
+# Campos de AlertUpdate que aceitam null explícito (os demais null são ignorados)
+NULLABLE_FIELDS = {"description", "window_minutes"}
+
 
 class AlertService:
-    """Gerenciamento de alertas em memória (pode ser migrado para DB depois)"""
+    """Gerenciamento de alertas: Postgres + cópia em memória por worker"""
     
     def __init__(self):
         self.alerts: Dict[UUID, Alert] = {}
+        self._revisions: Dict[UUID, int] = {}
+        self._revision_sum = 0
+        # Listas ordenadas (mais recentes primeiro), refeitas só depois de uma mudança
+        self._sorted: Optional[List[Alert]] = None
+        self._enabled: Optional[List[Alert]] = None
+        self._loaded = False
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self._listener: Optional[asyncio.Task] = None
+        self.syncs = 0
     
-    def create_alert(self, alert_data: AlertCreate) -> Alert:
-        """Cria um novo alerta"""
-        alert = Alert(**alert_data.model_dump())
+    def start(self):
+        """Escutar as mudanças feitas por outros workers"""
+        if self._listener is None and redis_cache.redis:
+            self._listener = asyncio.create_task(self._listen())
+    
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+    
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = redis_cache.redis.pubsub()
+                await pubsub.subscribe(ALERTS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        # Próxima leitura confere o banco
+                        self._checked_at = 0.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Alerts channel disconnected: {e}")
+                self._checked_at = 0.0
+                await asyncio.sleep(5)
+    
+    async def _announce(self, alert_ids: Iterable[UUID]):
+        if not redis_cache.redis:
+            return
+        try:
+            # Uma mensagem por mudança (os ids são só informativos: quem recebe confere o banco)
+            await redis_cache.redis.publish(ALERTS_CHANNEL, ",".join(str(alert_id) for alert_id in alert_ids))
+        except Exception as e:
+            logger.warning(f"⚠️ Could not announce alert change: {e}")
+    
+    def _remember(self, alert: Alert, revision: int):
+        current = self._revisions.get(alert.id)
+        if current is not None and current > revision:
+            # Leitura anterior a uma escrita já aplicada
+            return
+        self._revision_sum += revision - (current or 0)
+        self._revisions[alert.id] = revision
         self.alerts[alert.id] = alert
+        self._sorted = self._enabled = None
+    
+    def _forget(self, alert_id: UUID):
+        if alert_id in self._revisions:
+            self._revision_sum -= self._revisions.pop(alert_id)
+            self.alerts.pop(alert_id, None)
+            self._sorted = self._enabled = None
+    
+    def _is_fresh(self) -> bool:
+        return self._loaded and time.monotonic() - self._checked_at < settings.ALERT_CACHE_CHECK_INTERVAL
+    
+    async def _sync(self):
+        """Alinhar a cópia local com o banco (só busca as linhas que mudaram)"""
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            checked_at = time.monotonic()
+            stamp = await alert_repository.stamp()
+            if stamp != (len(self._revisions), self._revision_sum):
+                current = await alert_repository.revisions()
+                for alert_id in set(self._revisions) - set(current):
+                    self._forget(alert_id)
+                changed = [alert_id for alert_id, revision in current.items() if self._revisions.get(alert_id) != revision]
+                if changed:
+                    for revision, alert in await alert_repository.fetch(changed):
+                        self._remember(alert, revision)
+                self.syncs += 1
+            self._loaded = True
+            self._checked_at = checked_at
+    
+    async def create_alert(self, alert_data: AlertCreate) -> Alert:
+        """Cria um novo alerta"""
+        await self._sync()
+        revision, alert = await alert_repository.save(Alert(**alert_data.model_dump()))
+        self._remember(alert, revision)
+        await self._announce([alert.id])
         return alert
     
-    def get_alert(self, alert_id: UUID) -> Optional[Alert]:
+    async def get_alert(self, alert_id: UUID) -> Optional[Alert]:
         """Obtém um alerta por ID"""
+        await self._sync()
         return self.alerts.get(alert_id)
     
-    def list_alerts(self, enabled_only: bool = False) -> List[Alert]:
-        """Lista todos os alertas"""
-        alerts = list(self.alerts.values())
-        if enabled_only:
-            alerts = [a for a in alerts if a.enabled]
-        # Ordenar por data de criação (mais recentes primeiro)
-        return sorted(alerts, key=lambda x: x.created_at, reverse=True)
+    async def list_alerts(self, enabled_only: bool = False) -> List[Alert]:
+        """Lista todos os alertas (mais recentes primeiro)"""
+        await self._sync()
+        if self._sorted is None:
+            self._sorted = sorted(self.alerts.values(), key=lambda x: x.created_at, reverse=True)
+            self._enabled = [a for a in self._sorted if a.enabled]
+        return list(self._enabled if enabled_only else self._sorted)
     
-    def update_alert(self, alert_id: UUID, alert_data: AlertUpdate) -> Optional[Alert]:
+    async def update_alert(self, alert_id: UUID, alert_data: AlertUpdate) -> Optional[Alert]:
         """Atualiza um alerta existente"""
+        await self._sync()
         alert = self.alerts.get(alert_id)
         if not alert:
             return None
         
-        # Atualizar apenas campos fornecidos
-        update_dict = alert_data.model_dump(exclude_unset=True)
-        for key, value in update_dict.items():
-            setattr(alert, key, value)
-        
-        alert.updated_at = datetime.utcnow()
-        return alert
+        # Atualizar apenas campos fornecidos (revalidando, para condition virar AlertCondition)
+        update_dict = {
+            key: value for key, value in alert_data.model_dump(exclude_unset=True).items()
+            if value is not None or key in NULLABLE_FIELDS
+        }
+        updated = Alert.model_validate({
+            **alert.model_dump(),
+            **update_dict,
+            "updated_at": datetime.utcnow(),
+        })
+        revision, updated = await alert_repository.save(updated)
+        self._remember(updated, revision)
+        await self._announce([alert_id])
+        return updated
     
-    def delete_alert(self, alert_id: UUID) -> bool:
+    async def delete_alert(self, alert_id: UUID) -> bool:
         """Deleta um alerta"""
-        if alert_id in self.alerts:
-            del self.alerts[alert_id]
-            return True
-        return False
+        deleted = await alert_repository.delete(alert_id)
+        self._forget(alert_id)
+        if deleted:
+            await self._announce([alert_id])
+        return deleted
     
     def check_condition(self, condition: AlertCondition, current_value: float) -> bool:
         """Verifica se a condição do alerta foi atendida"""
@@ -72,17 +193,12 @@ class AlertService:
         return False
     
     def check_alert(self, alert: Alert, current_metrics: Dict[str, float]) -> AlertCheckResult:
-        """Verifica se um alerta deve ser disparado"""
+        """Verifica se um alerta deve ser disparado (contadores gravados por record_triggers)"""
         metric = alert.condition.metric
         current_value = current_metrics.get(metric, 0.0)
         
         triggered = self.check_condition(alert.condition, current_value)
         
-        # Atualizar contador se disparado
-        if triggered:
-            alert.last_triggered_at = datetime.utcnow()
-            alert.trigger_count += 1
-        
         # Gerar mensagem
         operator_labels = {
             "gt": "maior que",
@@ -107,13 +223,31 @@ class AlertService:
             message=message
         )
     
-    def check_all_alerts(self, current_metrics: Dict[str, float]) -> List[AlertCheckResult]:
+    async def record_triggers(self, results: List[AlertCheckResult]):
+        """Gravar no banco os disparos de uma verificação (um UPDATE para todos)"""
+        triggered = [result.alert_id for result in results if result.triggered]
+        if not triggered:
+            return
+        await alert_repository.record_triggers(triggered, datetime.utcnow())
+        # Contadores atualizados no banco (nova revisão): a próxima leitura ressincroniza
+        self._checked_at = 0.0
+        await self._announce(triggered)
+    
+    async def check_all_alerts(self, current_metrics: Dict[str, float]) -> List[AlertCheckResult]:
         """Verifica todos os alertas ativos"""
         results = []
-        for alert in self.list_alerts(enabled_only=True):
+        for alert in await self.list_alerts(enabled_only=True):
             result = self.check_alert(alert, current_metrics)
             results.append(result)
+        await self.record_triggers(results)
         return results
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "alerts": len(self.alerts),
+            "syncs": self.syncs,
+            "listening": self._listener is not None,
+        }
 
 
 # Instância global do serviço
@@ -1,24 +1,75 @@
 """
 Analytics Service - Core business logic for data analytics
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from datetime import datetime, date
+import asyncio
+import csv
+import io
+import json
+import re
 import time
 import logging
 
 from app.db.database import db
-from app.cache.redis_client import redis_cache
+from app.cache.redis_client import redis_cache, store_tags
+from app.cache.single_flight import single_flight
+from app.cache.refresh import cache_refresher
+from app.cache.decorators import cached
+from app.cache.serializers import json_dumps
 from app.config import settings
+from app.services.sql_builder import (
+    build_date_range_conditions,
+    build_filter_conditions,
+    build_keyset_condition,
+    build_order_limit_clauses
+)
+from app.services.query_router import query_router
+from app.services.rolling_aggregates import rolling_aggregates
+from app.services import columnar
+from app.services.pagination import InvalidCursor, cursor_scope, decode_cursor, encode_cursor
 from app.models.schemas import (
     AnalyticsQueryRequest, 
     AnalyticsQueryResponse,
+    AnalyticsExportRequest,
+    DateRangeFilter,
     QueryMetadata,
     KPICard,
-    KPIDashboard
+    KPIDashboard,
+    MetricComparison,
+    PeriodComparisonResponse,
+    DimensionValue,
+    DimensionValuesResponse
 )
 
 logger = logging.getLogger(__name__)
 
+# Tabelas lidas pela query de KPIs / comparação (filtros de canal, loja e produto)
+KPI_TABLES = ["channels", "stores", "product_sales", "products"]
+
+# Alias de uma métrica customizada ("SUM(total_amount) as faturamento")
+CUSTOM_METRIC_ALIAS = re.compile(r"\s+as\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*$", re.IGNORECASE)
+
+
+def _kpi_cache_tags(data: dict) -> List[str]:
+    """Cache tags of a KPI / compare result, scoped to the stores it filters on"""
+    stores = (data.get("filters") or {}).get("nome_loja")
+    return store_tags("sales", stores) + KPI_TABLES
+
+
+def _export_chunk(columns: List[str], rows: List[tuple], fmt: str, header: bool = False) -> bytes:
+    """One batch of export rows as CSV (header + BOM on the first chunk) or NDJSON"""
+    if fmt == "ndjson":
+        return b"".join(json_dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        # BOM para o Excel reconhecer UTF-8
+        buffer.write("\ufeff")
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
 
 class AnalyticsService:
     """Service for executing analytics queries"""
@@ -86,25 +137,314 @@ class AnalyticsService:
         """),
     }
     
+    # Joins in dependency order (alias, SQL). Joins marked as row-multiplying
+    # change the number of rows per sale and therefore the aggregates.
+    JOINS = [
+        ("channels", "JOIN channels ch ON s.channel_id = ch.id"),
+        ("stores", "JOIN stores st ON s.store_id = st.id"),
+        ("product_sales", "JOIN product_sales ps ON s.id = ps.sale_id"),
+        ("products", "JOIN products p ON ps.product_id = p.id"),
+        ("categories", "JOIN categories cat ON p.category_id = cat.id"),
+        ("delivery_addresses", "LEFT JOIN delivery_addresses da ON s.id = da.sale_id"),
+    ]
+    ROW_MULTIPLYING_JOINS = {"product_sales", "products", "categories", "delivery_addresses"}
+    
     async def execute_query(self, request: AnalyticsQueryRequest) -> AnalyticsQueryResponse:
         """Execute analytics query based on request"""
         start_time = time.time()
         
         # ✅ Tentar buscar do cache primeiro
         cache_key_data = request.model_dump(exclude_none=True)
-        cached_result = await redis_cache.get("analytics:query", cache_key_data)
+        cache_refresher.record("analytics:query", cache_key_data)
+        cached_response = await self._get_cached_query(cache_key_data, start_time)
+        if cached_response:
+            return cached_response
+        
+        self._normalize_date_filters(request)
+        return await self._run_query(request, cache_key_data, start_time)
+    
+    async def execute_batch(self, requests: List[AnalyticsQueryRequest]) -> List[AnalyticsQueryResponse]:
+        """
+        Execute several analytics queries sharing table scans
+        
+        Requests with the same filters and row-multiplying joins are merged into a
+        single GROUPING SETS statement; everything else runs concurrently through
+        execute_query. Results are returned in request order.
+        """
+        start_time = time.time()
+        responses: List[Optional[AnalyticsQueryResponse]] = [None] * len(requests)
+        cache_keys = [request.model_dump(exclude_none=True) for request in requests]
+        for cache_key_data in cache_keys:
+            cache_refresher.record("analytics:query", cache_key_data)
+        
+        # Cache lookups first: only misses need to touch the database
+        cached = await asyncio.gather(*[
+            self._get_cached_query(cache_key_data, start_time) for cache_key_data in cache_keys
+        ])
+        
+        scan_groups: Dict[tuple, List[int]] = {}
+        individual: List[int] = []
+        for i, request in enumerate(requests):
+            if cached[i]:
+                responses[i] = cached[i]
+                continue
+            
+            self._normalize_date_filters(request)
+            if query_router.route(request) or not self._is_mergeable(request):
+                individual.append(i)
+            else:
+                scan_groups.setdefault(self._scan_key(request), []).append(i)
+        
+        merged_groups = []
+        for indexes in scan_groups.values():
+            if len(indexes) > 1:
+                merged_groups.append(indexes)
+            else:
+                individual.extend(indexes)
+        
+        async def run_individual(i: int):
+            responses[i] = await self._run_query(requests[i], cache_keys[i], start_time)
+        
+        async def run_merged(indexes: List[int]):
+            generations = await asyncio.gather(*[
+                redis_cache.generations("analytics:query", self._query_tags(requests[i])) for i in indexes
+            ])
+            query, params = self._build_grouping_sets_query([requests[i] for i in indexes])
+            result_columns, rows = await db.fetch_tuples(query, *params)
+            position_of = {col: j for j, col in enumerate(result_columns)}
+            batch_index = position_of['_batch_query']
+            
+            rows_by_query: Dict[int, List[tuple]] = {position: [] for position in range(len(indexes))}
+            for row in rows:
+                rows_by_query[row[batch_index]].append(row)
+            
+            for position, i in enumerate(indexes):
+                columns = list(requests[i].dimensions) + list(requests[i].metrics)
+                picks = [position_of[col] for col in columns]
+                data = [
+                    dict(zip(columns, [row[j] for j in picks])) for row in rows_by_query[position]
+                ]
+                responses[i] = await self._finish_query(
+                    cache_keys[i], data, start_time, "sales", generations[position],
+                    next_cursor=self._next_cursor(requests[i], data)
+                )
+        
+        await asyncio.gather(
+            *[run_individual(i) for i in individual],
+            *[run_merged(indexes) for indexes in merged_groups]
+        )
+        
+        logger.debug(
+            f"📦 Batch: {len(requests)} queries, {sum(1 for c in cached if c)} cached, "
+            f"{len(merged_groups)} merged scans, {len(individual)} individual"
+        )
+        return responses
+    
+    async def stream_query(self, request: AnalyticsExportRequest, fmt: str = "csv") -> AsyncIterator[bytes]:
+        """
+        Stream every row of a query as CSV or NDJSON chunks
+        
+        Rows come from a server-side cursor in EXPORT_BATCH_SIZE batches and are
+        written out batch by batch, so memory stays flat regardless of the
+        number of rows. Exports bypass the cache.
+        
+        The query runs and its first batch is fetched before this returns, so
+        SQL errors (timeout, unknown column) raise here, while the caller can
+        still answer with an error status. Errors on later batches propagate
+        out of the returned iterator, aborting the response body.
+        """
+        self._normalize_date_filters(request)
+        query, params, _ = self._build_page_query(request)
+        
+        batches = db.stream(
+            query,
+            *params,
+            batch_size=settings.EXPORT_BATCH_SIZE,
+            timeout_ms=settings.DB_TIMEOUT_EXPORT_MS
+        )
+        try:
+            first_batch = await batches.__anext__()
+        except BaseException:
+            await batches.aclose()
+            raise
+        return self._encode_export(first_batch, batches, fmt)
+    
+    async def _encode_export(self, first_batch, batches, fmt: str) -> AsyncIterator[bytes]:
+        """Export chunks: the already fetched first batch, then the rest of the stream"""
+        try:
+            columns, rows = first_batch
+            yield _export_chunk(columns, rows, fmt, header=True)
+            async for columns, rows in batches:
+                yield _export_chunk(columns, rows, fmt)
+        except Exception as e:
+            # Cabeçalhos (200) já enviados: propagar aborta a resposta em vez de
+            # entregar um arquivo truncado como se estivesse completo
+            logger.error(f"❌ Export aborted mid-stream: {e}")
+            raise
+        finally:
+            await batches.aclose()
+    
+    async def execute_columnar(self, request: AnalyticsQueryRequest, fmt: str = "arrow") -> bytes:
+        """
+        Execute a query and return the result as an Arrow IPC stream (or Parquet)
+        
+        Rows are fetched column by column and encoded straight into columnar
+        arrays, skipping the per-row dicts and the JSON round trip. Encoded
+        tables are cached under their own key in the 'analytics:query' scope.
+        """
+        cache_key_data = {**request.model_dump(exclude_none=True), "format": fmt}
+        cached_payload = await redis_cache.get("analytics:query:columnar", cache_key_data, allow_stale=False)
+        if cached_payload is not None:
+            return cached_payload
+        
+        self._normalize_date_filters(request)
         
-        if cached_result:
+        async def run() -> bytes:
+            generations = await redis_cache.generations("analytics:query:columnar", self._query_tags(request))
+            query, params, _ = self._build_page_query(request)
+            
+            columns, values = await db.fetch_columns(query, *params)
+            payload = columnar.encode(columns, values, fmt)
+            await redis_cache.set(
+                "analytics:query:columnar",
+                cache_key_data,
+                payload,
+                ttl=settings.CACHE_TTL,
+                generations=generations
+            )
+            return payload
+        
+        return await single_flight.do(redis_cache.key_for("analytics:query:columnar", cache_key_data), run)
+    
+    async def refresh_query(self, cache_key_data: dict):
+        """Recompute a cached query (background refresh), bypassing the cache read"""
+        request = AnalyticsQueryRequest(**cache_key_data)
+        self._normalize_date_filters(request)
+        await single_flight.do(
+            redis_cache.key_for("analytics:query", cache_key_data),
+            lambda: self._execute_uncached(request, cache_key_data, time.time())
+        )
+    
+    async def _run_query(
+        self,
+        request: AnalyticsQueryRequest,
+        cache_key_data: dict,
+        start_time: float
+    ) -> AnalyticsQueryResponse:
+        """Execute a (normalized) request against the database and cache the result"""
+        # Requisições idênticas simultâneas (ex.: logo após o cache expirar)
+        # compartilham uma única execução no banco
+        return await single_flight.do(
+            redis_cache.key_for("analytics:query", cache_key_data),
+            lambda: self._execute_uncached(request, cache_key_data, start_time),
+            cache_lookup=lambda: self._get_cached_query(cache_key_data, start_time)
+        )
+    
+    async def _execute_uncached(
+        self,
+        request: AnalyticsQueryRequest,
+        cache_key_data: dict,
+        start_time: float
+    ) -> AnalyticsQueryResponse:
+        """Run the SQL for a request and cache the response"""
+        # Gerações lidas antes da consulta (ver RedisCache.generations)
+        generations = await redis_cache.generations("analytics:query", self._query_tags(request))
+        
+        # Build SQL query (aggregate views when they can answer it, raw tables otherwise)
+        query, params, source = self._build_page_query(request)
+        
+        # Execute query (binary tuples; one dict per row, built only for the response)
+        columns, rows = await db.fetch_tuples(query, *params)
+        data = [dict(zip(columns, row)) for row in rows]
+        
+        return await self._finish_query(
+            cache_key_data, data, start_time, source, generations,
+            next_cursor=self._next_cursor(request, data)
+        )
+    
+    async def _get_cached_query(self, cache_key_data: dict, start_time: float) -> Optional[AnalyticsQueryResponse]:
+        """Return the cached response for a query, if any (callers count the request)"""
+        entry = await redis_cache.get_entry("analytics:query", cache_key_data)
+        
+        if entry:
+            payload, stale = entry
+            if stale:
+                # Stale-while-revalidate: responde já e recalcula em background
+                cache_refresher.trigger("analytics:query", cache_key_data)
+            cached_result = json.loads(payload)
+            
             # Cache HIT - retornar dados cacheados
             cached_result["metadata"]["from_cache"] = True
             cached_result["metadata"]["query_time_ms"] = (time.time() - start_time) * 1000
             return AnalyticsQueryResponse(**cached_result)
         
-        # Extract date filters from filters dict and move to date_range
+        return None
+    
+    async def _finish_query(
+        self,
+        cache_key_data: dict,
+        data: List[Dict[str, Any]],
+        start_time: float,
+        source: str,
+        generations: Dict[str, int],
+        next_cursor: Optional[str] = None
+    ) -> AnalyticsQueryResponse:
+        """Build the response for freshly computed rows and store it in the cache"""
+        # Calculate query time
+        query_time_ms = (time.time() - start_time) * 1000
+        
+        # Build metadata
+        metadata = QueryMetadata(
+            total_rows=len(data),
+            query_time_ms=round(query_time_ms, 2),
+            cached=False,
+            from_cache=False,
+            source=source,
+            next_cursor=next_cursor
+        )
+        
+        # Criar resposta
+        response = AnalyticsQueryResponse(data=data, metadata=metadata)
+        
+        # ✅ Salvar no cache já serializado (o endpoint devolve esses bytes direto num HIT)
+        cached_metadata = metadata.model_copy(update={"cached": True})
+        await redis_cache.set(
+            "analytics:query", 
+            cache_key_data, 
+            response.model_copy(update={"metadata": cached_metadata}).model_dump_json(),
+            ttl=settings.CACHE_TTL,
+            generations=generations
+        )
+        
+        return response
+    
+    def _query_tags(self, request: AnalyticsQueryRequest) -> List[str]:
+        """
+        Tables a query result depends on (cache invalidation tags)
+        
+        Aggregate views are derived from sales, so results served from them
+        share the tags of the equivalent raw query.
+        """
+        joins_needed, _, _ = self._build_scan(request)
+        return store_tags("sales", self._store_scope(request.filters)) + sorted(joins_needed)
+    
+    def _store_scope(self, filters: Dict[str, Any]) -> Optional[List[Any]]:
+        """Stores a request is restricted to (by id or name), None if unrestricted"""
+        for field in ("store_id", "nome_loja", "store"):
+            value = filters.get(field)
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                # Only equality / IN restrict to a known set of stores
+                value = value.get("eq", value.get("in"))
+                if value is None:
+                    return None
+            return sorted(value, key=str) if isinstance(value, list) else [value]
+        return None
+    
+    def _normalize_date_filters(self, request: AnalyticsQueryRequest):
+        """Extract date filters from filters dict and move them to date_range"""
         if 'data_venda_gte' in request.filters or 'data_venda_lte' in request.filters:
-            from datetime import datetime
-            from app.models.schemas import DateRangeFilter
-            
             start_date = None
             end_date = None
             
@@ -125,45 +465,145 @@ class AnalyticsService:
             # Set date_range if not already set
             if not request.date_range:
                 request.date_range = DateRangeFilter(start_date=start_date, end_date=end_date)
+    
+    def _metric_alias(self, metric: str) -> Optional[str]:
+        """Output column name of a metric (predefined name or custom 'expr as alias')"""
+        if metric in self.METRICS_MAP:
+            return metric
+        match = CUSTOM_METRIC_ALIAS.search(metric)
+        return match.group(1) if match else None
+    
+    def _sort_keys(self, request: AnalyticsQueryRequest) -> Optional[List[Tuple[str, str]]]:
+        """
+        Total order of a request's rows, used for keyset pagination
         
-        # Build SQL query
-        query, params = self._build_query(request)
+        The requested order followed by every dimension as tie-breaker (the
+        dimensions are the GROUP BY, so together they identify a row). None
+        when a sort field is not an output column or there is no dimension.
+        """
+        dimensions = [dim for dim in request.dimensions if dim in self.DIMENSIONS_MAP]
+        if not dimensions:
+            return None
         
-        # Execute query
-        rows = await db.fetch_all(query, *params)
+        columns = set(dimensions) | {self._metric_alias(metric) for metric in request.metrics}
+        sort_keys: List[Tuple[str, str]] = []
+        for order_spec in request.order_by or []:
+            field = order_spec.get("field")
+            direction = order_spec.get("direction", "desc").lower()
+            if field not in columns or direction not in ("asc", "desc"):
+                return None
+            if field not in dict(sort_keys):
+                sort_keys.append((field, direction))
+        for dim in dimensions:
+            if dim not in dict(sort_keys):
+                sort_keys.append((dim, "asc"))
+        return sort_keys
+    
+    def _page_order(self, request: AnalyticsQueryRequest) -> Optional[List[Dict[str, str]]]:
+        """ORDER BY of a paged request: its sort keys, so pages line up with cursors"""
+        sort_keys = self._sort_keys(request) if request.limit else None
+        if sort_keys is None:
+            return request.order_by
+        return [{"field": field, "direction": direction} for field, direction in sort_keys]
+    
+    def _cursor_scope(self, request: AnalyticsQueryRequest) -> str:
+        """Cursors are only valid for the same query and sort (page size may change)"""
+        return cursor_scope(request.model_dump(mode="json", exclude={"cursor", "offset", "limit"}, exclude_none=True))
+    
+    def _next_cursor(self, request: AnalyticsQueryRequest, data: List[Dict[str, Any]]) -> Optional[str]:
+        """Continuation token after the last row, when the page came back full"""
+        sort_keys = self._sort_keys(request)
+        if not sort_keys or not request.limit or len(data) < request.limit:
+            return None
+        last = data[-1]
+        return encode_cursor([last.get(field) for field, _ in sort_keys], self._cursor_scope(request))
+    
+    def _build_page_query(self, request: AnalyticsQueryRequest) -> tuple[str, list, str]:
+        """
+        SQL for one page of a request: (query, params, source relation)
         
-        # Convert rows to dict
-        data = [dict(row) for row in rows]
+        Answered from the aggregate views when possible. With a cursor the
+        unpaged query is wrapped and filtered on the sort key of the previous
+        page's last row (keyset), so deep pages cost the same as the first
+        one to sort and return - OFFSET is ignored.
+        """
+        page_request = request.model_copy(update={"order_by": self._page_order(request)})
         
-        # Calculate query time
-        query_time_ms = (time.time() - start_time) * 1000
+        if not request.cursor:
+            routed = query_router.route(page_request)
+            if routed:
+                return routed
+            return (*self._build_query(page_request), "sales")
         
-        # Build metadata
-        metadata = QueryMetadata(
-            total_rows=len(data),
-            query_time_ms=round(query_time_ms, 2),
-            cached=False,
-            from_cache=False
-        )
+        sort_keys = self._sort_keys(request)
+        if not sort_keys:
+            raise InvalidCursor("Cursor pagination needs dimensions and an order on returned columns")
+        values = decode_cursor(request.cursor, self._cursor_scope(request))
+        if len(values) != len(sort_keys):
+            raise InvalidCursor("Invalid cursor")
         
-        # Criar resposta
-        response = AnalyticsQueryResponse(data=data, metadata=metadata)
+        unpaged = request.model_copy(update={"order_by": None, "limit": None, "offset": None, "cursor": None})
+        routed = query_router.route(unpaged)
+        if routed:
+            inner_query, params, source = routed
+        else:
+            (inner_query, params), source = self._build_query(unpaged), "sales"
         
-        # ✅ Salvar no cache (async, sem esperar)
-        await redis_cache.set(
-            "analytics:query", 
-            cache_key_data, 
-            response.model_dump(),
-            ttl=settings.CACHE_TTL
+        keyset_condition = build_keyset_condition(sort_keys, values, params)
+        order_by_clause, limit_clause, _ = build_order_limit_clauses(
+            page_request.order_by, request.limit, None, params
         )
-        
-        return response
+        query = f"""
+SELECT * FROM (
+{inner_query}
+) page
+WHERE {keyset_condition}
+{order_by_clause}
+{limit_clause}
+        """.strip()
+        return query, params, source
     
     def _build_query(self, request: AnalyticsQueryRequest) -> tuple[str, list]:
         """Build SQL query from request"""
-        params = []
-        
         # Build SELECT clause
+        select_clause = ",\n    ".join(self._build_select_parts(request))
+        
+        # Build FROM / WHERE clauses
+        joins_needed, where_conditions, params = self._build_scan(request)
+        from_clause = self._build_from_clause(joins_needed)
+        where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+        
+        # Build GROUP BY clause
+        group_by_clause = ""
+        if request.dimensions:
+            group_by_fields = []
+            for i, dim in enumerate(request.dimensions, start=1):
+                if dim in self.DIMENSIONS_MAP:
+                    group_by_fields.append(str(i))
+            if group_by_fields:
+                group_by_clause = f"GROUP BY {', '.join(group_by_fields)}"
+        
+        # Build ORDER BY / LIMIT / OFFSET clauses
+        order_by_clause, limit_clause, offset_clause = build_order_limit_clauses(
+            request.order_by, request.limit, request.offset, params
+        )
+        
+        # Assemble final query
+        query = f"""
+SELECT
+    {select_clause}
+{from_clause}
+{where_clause}
+{group_by_clause}
+{order_by_clause}
+{limit_clause}
+{offset_clause}
+        """.strip()
+        
+        return query, params
+    
+    def _build_select_parts(self, request: AnalyticsQueryRequest) -> List[str]:
+        """Build the SELECT expressions for dimensions and metrics"""
         select_parts = []
         
         # Add dimensions
@@ -182,42 +622,27 @@ class AnalyticsService:
                 # Custom SQL expression (already contains alias)
                 select_parts.append(metric)
         
-        select_clause = ",\n    ".join(select_parts)
+        return select_parts
+    
+    def _joins_for(self, join_hint: str) -> set:
+        """Tables a DIMENSIONS_MAP join hint requires"""
+        return {table for table, join_sql in self.JOINS if f"JOIN {table}" in join_hint}
+    
+    def _build_scan(self, request: AnalyticsQueryRequest) -> tuple[set, List[str], list]:
+        """
+        Build the part of the query that defines which rows are scanned
         
-        # Build FROM clause (use most complex join needed)
-        from_clause = "FROM sales s"
+        Returns:
+            (joins needed, WHERE conditions, params)
+        """
+        params = []
         joins_needed = set()
         
         # Check what joins we need
         for dim in request.dimensions:
             if dim in self.DIMENSIONS_MAP:
                 _, join_hint = self.DIMENSIONS_MAP[dim]
-                if "JOIN channels" in join_hint:
-                    joins_needed.add("channels")
-                if "JOIN stores" in join_hint:
-                    joins_needed.add("stores")
-                if "JOIN product_sales" in join_hint:
-                    joins_needed.add("product_sales")
-                if "JOIN products" in join_hint:
-                    joins_needed.add("products")
-                if "JOIN categories" in join_hint:
-                    joins_needed.add("categories")
-                if "JOIN delivery_addresses" in join_hint:
-                    joins_needed.add("delivery_addresses")
-        
-        # Add joins
-        if "channels" in joins_needed:
-            from_clause += "\nJOIN channels ch ON s.channel_id = ch.id"
-        if "stores" in joins_needed:
-            from_clause += "\nJOIN stores st ON s.store_id = st.id"
-        if "product_sales" in joins_needed:
-            from_clause += "\nJOIN product_sales ps ON s.id = ps.sale_id"
-        if "products" in joins_needed:
-            from_clause += "\nJOIN products p ON ps.product_id = p.id"
-        if "categories" in joins_needed:
-            from_clause += "\nJOIN categories cat ON p.category_id = cat.id"
-        if "delivery_addresses" in joins_needed:
-            from_clause += "\nLEFT JOIN delivery_addresses da ON s.id = da.sale_id"
+                joins_needed |= self._joins_for(join_hint)
         
         # Build WHERE clause
         where_conditions = ["s.sale_status_desc = 'COMPLETED'"]
@@ -227,14 +652,11 @@ class AnalyticsService:
             if "delivery_addresses" in joins_needed:
                 where_conditions.append("da.neighborhood IS NOT NULL")
         
-        # Add date range filter
+        # Add date range filter (half-open range on created_at, index friendly)
         if request.date_range:
-            if request.date_range.start_date:
-                params.append(request.date_range.start_date)
-                where_conditions.append(f"DATE(s.created_at) >= %s")
-            if request.date_range.end_date:
-                params.append(request.date_range.end_date)
-                where_conditions.append(f"DATE(s.created_at) <= %s")
+            where_conditions.extend(build_date_range_conditions(
+                "s.created_at", request.date_range.start_date, request.date_range.end_date, params
+            ))
         
         # Add custom filters (excluding date filters handled above)
         for field, filter_value in request.filters.items():
@@ -247,166 +669,220 @@ class AnalyticsService:
             if field in self.DIMENSIONS_MAP:
                 field_expr, join_hint = self.DIMENSIONS_MAP[field]
                 # Ensure necessary joins are added for this filter
-                if "JOIN channels" in join_hint and "channels" not in joins_needed:
-                    joins_needed.add("channels")
-                    from_clause += "\nJOIN channels ch ON s.channel_id = ch.id"
-                if "JOIN stores" in join_hint and "stores" not in joins_needed:
-                    joins_needed.add("stores")
-                    from_clause += "\nJOIN stores st ON s.store_id = st.id"
-                if "JOIN product_sales" in join_hint and "product_sales" not in joins_needed:
-                    joins_needed.add("product_sales")
-                    from_clause += "\nJOIN product_sales ps ON s.id = ps.sale_id"
-                if "JOIN products" in join_hint and "products" not in joins_needed:
-                    joins_needed.add("products")
-                    from_clause += "\nJOIN products p ON ps.product_id = p.id"
-                if "JOIN categories" in join_hint and "categories" not in joins_needed:
-                    joins_needed.add("categories")
-                    from_clause += "\nJOIN categories cat ON p.category_id = cat.id"
-                if "JOIN delivery_addresses" in join_hint and "delivery_addresses" not in joins_needed:
-                    joins_needed.add("delivery_addresses")
-                    from_clause += "\nLEFT JOIN delivery_addresses da ON s.id = da.sale_id"
-                
-            if isinstance(filter_value, dict):
-                # Complex filter with operator
-                for operator, value in filter_value.items():
-                    if operator == "eq":
-                        params.append(value)
-                        where_conditions.append(f"{field_expr} = %s")
-                    elif operator == "in" and isinstance(value, list):
-                        placeholders = []
-                        for v in value:
-                            params.append(v)
-                            placeholders.append("%s")
-                        where_conditions.append(f"{field_expr} IN ({', '.join(placeholders)})")
-                    elif operator in ["gt", "gte", "lt", "lte"]:
-                        op_map = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
-                        params.append(value)
-                        where_conditions.append(f"{field_expr} {op_map[operator]} %s")
-            else:
-                # Simple equality filter (list = IN clause, single value = equality)
-                if isinstance(filter_value, list):
-                    placeholders = []
-                    for v in filter_value:
-                        params.append(v)
-                        placeholders.append("%s")
-                    where_conditions.append(f"{field_expr} IN ({', '.join(placeholders)})")
-                else:
-                    params.append(filter_value)
-                    where_conditions.append(f"{field_expr} = %s")
+                joins_needed |= self._joins_for(join_hint)
+            
+            where_conditions.extend(build_filter_conditions(field_expr, filter_value, params))
         
-        where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+        return joins_needed, where_conditions, params
+    
+    def _build_from_clause(self, joins_needed: set) -> str:
+        """Build FROM clause with the needed joins in dependency order"""
+        from_clause = "FROM sales s"
+        for table, join_sql in self.JOINS:
+            if table in joins_needed:
+                from_clause += f"\n{join_sql}"
+        return from_clause
+    
+    def _is_mergeable(self, request: AnalyticsQueryRequest) -> bool:
+        """Check whether a request can take part in a GROUPING SETS batch"""
+        # Custom SQL metrics have free-form aliases that could collide across queries
+        if any(metric not in self.METRICS_MAP for metric in request.metrics):
+            return False
+        if not request.metrics:
+            return False
+        # Páginas por cursor embrulham a query inteira (ver _build_page_query)
+        if request.cursor:
+            return False
+        aliases = set(request.dimensions) | set(request.metrics)
+        for order_spec in request.order_by or []:
+            if order_spec.get("field") not in aliases:
+                return False
+        return True
+    
+    def _scan_key(self, request: AnalyticsQueryRequest) -> tuple:
+        """
+        Key identifying the rows a request aggregates over
         
-        # Build GROUP BY clause
-        group_by_clause = ""
-        if request.dimensions:
-            group_by_fields = []
-            for i, dim in enumerate(request.dimensions, start=1):
-                if dim in self.DIMENSIONS_MAP:
-                    group_by_fields.append(str(i))
-            if group_by_fields:
-                group_by_clause = f"GROUP BY {', '.join(group_by_fields)}"
+        channels/stores joins are lookups (one row per sale), so requests that
+        only differ by them scan the same rows and can share a statement.
+        """
+        joins_needed, where_conditions, params = self._build_scan(request)
+        return (
+            frozenset(joins_needed & self.ROW_MULTIPLYING_JOINS),
+            tuple(where_conditions),
+            repr(params)
+        )
+    
+    def _build_grouping_sets_query(self, requests: List[AnalyticsQueryRequest]) -> tuple[str, list]:
+        """
+        Build one statement answering several requests over the same scan
+        
+        Each request becomes a grouping set; its rows are selected back from the
+        shared aggregation with its own ORDER BY / LIMIT and tagged with
+        _batch_query (the request position in the list).
+        """
+        joins_needed = set()
+        for request in requests:
+            request_joins, where_conditions, params = self._build_scan(request)
+            joins_needed |= request_joins
+        from_clause = self._build_from_clause(joins_needed)
+        where_clause = "WHERE " + " AND ".join(where_conditions)
         
-        # Build ORDER BY clause
-        order_by_clause = ""
-        if request.order_by:
-            order_parts = []
-            for order_spec in request.order_by:
-                field = order_spec.get("field")
-                direction = order_spec.get("direction", "desc").upper()
-                order_parts.append(f"{field} {direction}")
-            order_by_clause = "ORDER BY " + ", ".join(order_parts)
+        # Distinct grouping expressions across every request
+        dim_exprs: List[str] = []
+        for request in requests:
+            for dim in request.dimensions:
+                dim_expr, _ = self.DIMENSIONS_MAP[dim]
+                if dim_expr not in dim_exprs:
+                    dim_exprs.append(dim_expr)
         
-        # Build LIMIT clause
-        limit_clause = f"LIMIT {request.limit}" if request.limit else ""
-        offset_clause = f"OFFSET {request.offset}" if request.offset else ""
+        select_parts = []
+        dim_aliases: Dict[str, str] = {}
+        metric_aliases: List[str] = []
+        for request in requests:
+            for dim in request.dimensions:
+                if dim not in dim_aliases:
+                    dim_aliases[dim] = self.DIMENSIONS_MAP[dim][0]
+                    select_parts.append(f"{dim_aliases[dim]} as {dim}")
+            for metric in request.metrics:
+                if metric not in metric_aliases:
+                    metric_aliases.append(metric)
+                    select_parts.append(f"{self.METRICS_MAP[metric]} as {metric}")
+        if dim_exprs:
+            select_parts.append(f"GROUPING({', '.join(dim_exprs)}) as _grouping")
+        else:
+            select_parts.append("0 as _grouping")
         
-        # Assemble final query
+        grouping_sets = []
+        branches = []
+        for position, request in enumerate(requests):
+            exprs = [self.DIMENSIONS_MAP[dim][0] for dim in request.dimensions]
+            grouping_set = f"({', '.join(dict.fromkeys(exprs))})"
+            if grouping_set not in grouping_sets:
+                grouping_sets.append(grouping_set)
+            
+            # GROUPING() bit is 1 for every expression NOT grouped in this set
+            mask = 0
+            for expr in dim_exprs:
+                mask = (mask << 1) | (0 if expr in exprs else 1)
+            
+            order_by_clause, limit_clause, offset_clause = build_order_limit_clauses(
+                self._page_order(request), request.limit, request.offset, params
+            )
+            branches.append(f"""(
+SELECT {position} as _batch_query, batch_scan.*
+FROM batch_scan
+WHERE _grouping = {mask}
+{order_by_clause}
+{limit_clause}
+{offset_clause}
+)""")
+        
+        select_clause = ",\n    ".join(select_parts)
+        union_clause = "\nUNION ALL\n".join(branches)
         query = f"""
+WITH batch_scan AS (
 SELECT
     {select_clause}
 {from_clause}
 {where_clause}
-{group_by_clause}
-{order_by_clause}
-{limit_clause}
-{offset_clause}
+GROUP BY GROUPING SETS ({', '.join(grouping_sets)})
+)
+{union_clause}
         """.strip()
         
         return query, params
     
+    def metric_joins(self, metric: str) -> set:
+        """Tables a predefined metric reads besides sales (qtd_produtos needs product_sales)"""
+        return {"product_sales"} if "ps." in self.METRICS_MAP[metric] else set()
+    
+    def build_window_metrics_query(
+        self,
+        metrics: List[str],
+        filters: Dict[str, Any],
+        windows: List[Optional[int]]
+    ) -> tuple[str, list]:
+        """
+        Build one statement computing predefined metrics over trailing windows
+
+        Each window (minutes before now, None = all history) is a row of a
+        VALUES list joined to the scan: a sale is aggregated once per window it
+        falls in, and each window comes back as one row tagged _window (its
+        position in the list). Metrics must agree on metric_joins.
+        """
+        request = AnalyticsQueryRequest(metrics=metrics, filters=filters)
+        joins_needed, where_conditions, scan_params = self._build_scan(request)
+        for metric in metrics:
+            joins_needed |= self.metric_joins(metric)
+
+        # Parâmetros do VALUES vêm antes dos do WHERE no texto da query
+        params: list = list(windows) + scan_params
+        window_rows = ", ".join(f"({i}, %s::int)" for i in range(len(windows)))
+        from_clause = (
+            self._build_from_clause(joins_needed)
+            + f"\nCROSS JOIN (VALUES {window_rows}) w(_window, minutes)"
+        )
+        where_conditions.append(
+            "(w.minutes IS NULL OR s.created_at >= LOCALTIMESTAMP - make_interval(mins => w.minutes))"
+        )
+        if None not in windows:
+            # Limite da maior janela direto em created_at, para o índice delimitar o scan
+            params.append(max(windows))
+            where_conditions.append("s.created_at >= LOCALTIMESTAMP - make_interval(mins => %s::int)")
+
+        select_parts = ["w._window"] + [f"{self.METRICS_MAP[metric]} as {metric}" for metric in metrics]
+        select_clause = ",\n    ".join(select_parts)
+        where_clause = " AND ".join(where_conditions)
+        query = f"""
+SELECT
+    {select_clause}
+{from_clause}
+WHERE {where_clause}
+GROUP BY w._window
+        """.strip()
+
+        return query, params
+
     async def get_kpi_dashboard(
-        self, 
+        self,
         start_date: Optional[date] = None,
         end_date: Optional[date] = None,
-        filters: Optional[Dict[str, Any]] = None
+        filters: Optional[Dict[str, Any]] = None,
+        hours: Optional[int] = None
+    ) -> KPIDashboard:
+        """
+        Get main KPI dashboard with optional filters
+        
+        Recent ranges (today, last `hours` hours) are answered from the rolling
+        in-memory aggregates when they cover the request; everything else runs
+        the summary query (cached).
+        """
+        start_time = time.time()
+        row = rolling_aggregates.kpi_row(start_date, end_date, filters, hours)
+        if row is None:
+            return await self._query_kpi_dashboard(start_date, end_date, filters, hours)
+        return self._kpi_dashboard(row, start_date, end_date, hours, start_time, source="rolling_aggregates")
+    
+    @cached(
+        "analytics:kpis",
+        ttl=lambda: settings.CACHE_TTL_KPIS,
+        tags=_kpi_cache_tags,
+        model=KPIDashboard
+    )
+    async def _query_kpi_dashboard(
+        self,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        hours: Optional[int] = None
     ) -> KPIDashboard:
-        """Get main KPI dashboard with optional filters"""
+        """KPI dashboard from the summary query over sales"""
         start_time = time.time()
         
         logger.debug(f"🔧 get_kpi_dashboard called with filters: {filters}")
         
-        # Build date filter
-        date_filter = ""
-        params = []
-        if start_date:
-            params.append(start_date)
-            date_filter += f" AND DATE(s.created_at) >= %s"
-        if end_date:
-            params.append(end_date)
-            date_filter += f" AND DATE(s.created_at) <= %s"
-        
-        # Build filter conditions
-        filter_conditions = []
-        if filters:
-            # Add filter for sales channels
-            if 'canal_venda' in filters and filters['canal_venda']:
-                placeholders = ', '.join(['%s'] * len(filters['canal_venda']))
-                filter_conditions.append(f"ch.name IN ({placeholders})")
-                params.extend(filters['canal_venda'])
-            
-            # Add filter for stores
-            if 'nome_loja' in filters and filters['nome_loja']:
-                placeholders = ', '.join(['%s'] * len(filters['nome_loja']))
-                filter_conditions.append(f"st.name IN ({placeholders})")
-                params.extend(filters['nome_loja'])
-            
-            # Add filter for products
-            if 'nome_produto' in filters and filters['nome_produto']:
-                placeholders = ', '.join(['%s'] * len(filters['nome_produto']))
-                filter_conditions.append(f"""
-                    s.id IN (
-                        SELECT DISTINCT ps.sale_id 
-                        FROM product_sales ps
-                        JOIN products p ON p.id = ps.product_id
-                        WHERE p.name IN ({placeholders})
-                    )
-                """)
-                params.extend(filters['nome_produto'])
-        
-        additional_where = ' AND ' + ' AND '.join(filter_conditions) if filter_conditions else ''
-        
-        # Determine if we need JOINs
-        needs_channel_join = 'canal_venda' in (filters or {})
-        needs_store_join = 'nome_loja' in (filters or {})
-        
-        joins = ""
-        if needs_channel_join:
-            joins += "\nLEFT JOIN channels ch ON ch.id = s.channel_id"
-        if needs_store_join:
-            joins += "\nLEFT JOIN stores st ON st.id = s.store_id"
-        
-        query = f"""
-        SELECT
-            SUM(total_amount) as faturamento_total,
-            AVG(total_amount) as ticket_medio,
-            COUNT(DISTINCT s.id) as total_vendas,
-            COUNT(DISTINCT customer_id) FILTER (WHERE customer_id IS NOT NULL) as clientes_unicos,
-            AVG(delivery_seconds / 60.0) FILTER (WHERE delivery_seconds IS NOT NULL) as tempo_medio_entrega_min,
-            AVG(production_seconds / 60.0) FILTER (WHERE production_seconds IS NOT NULL) as tempo_medio_preparo_min
-        FROM sales s
-        {joins}
-        WHERE sale_status_desc = 'COMPLETED' {date_filter} {additional_where}
-        """
+        query, params = self._build_kpi_query(start_date, end_date, filters, hours)
         
         logger.debug(f"📝 SQL Query: {query}")
         logger.debug(f"📝 SQL Params: {params}")
@@ -415,6 +891,18 @@ SELECT
         
         logger.debug(f"💰 Query result - Faturamento: {row['faturamento_total']}, Vendas: {row['total_vendas']}")
         
+        return self._kpi_dashboard(row, start_date, end_date, hours, start_time)
+    
+    def _kpi_dashboard(
+        self,
+        row: Dict[str, Any],
+        start_date: Optional[date],
+        end_date: Optional[date],
+        hours: Optional[int],
+        start_time: float,
+        source: Optional[str] = None
+    ) -> KPIDashboard:
+        """KPI cards from a row of the summary query (or the rolling aggregates)"""
         kpis = [
             KPICard(
                 label="Faturamento Total",
@@ -453,10 +941,16 @@ SELECT
         metadata = QueryMetadata(
             total_rows=len(kpis),
             query_time_ms=round(query_time_ms, 2),
-            cached=False
+            cached=False,
+            source=source
         )
         
-        period_label = f"{start_date} a {end_date}" if start_date and end_date else "Todos os períodos"
+        if hours:
+            period_label = f"Últimas {hours} horas"
+        elif start_date and end_date:
+            period_label = f"{start_date} a {end_date}"
+        else:
+            period_label = "Todos os períodos"
         
         return KPIDashboard(
             kpis=kpis,
@@ -464,52 +958,47 @@ SELECT
             metadata=metadata
         )
     
-    async def compare_periods(
+    def _build_kpi_query(
         self,
-        base_start: date,
-        base_end: date,
-        compare_start: date,
-        compare_end: date,
-        filters: Optional[Dict[str, Any]] = None
-    ) -> Dict[str, Any]:
-        """Compare metrics between two periods with optional filters"""
-        from app.models.schemas import MetricComparison, PeriodComparisonResponse
-        
-        start_time = time.time()
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        hours: Optional[int] = None
+    ) -> tuple[str, list]:
+        """Build the summary query shared by the KPI dashboard and period comparison"""
+        # Build date filter
+        params = []
+        date_conditions = build_date_range_conditions("s.created_at", start_date, end_date, params)
+        if hours:
+            # Mesma janela dos agregados em memória: a partir do minuto atual menos N horas
+            date_conditions.append("s.created_at >= date_trunc('minute', LOCALTIMESTAMP) - make_interval(hours => %s::int)")
+            params.append(hours)
+        date_filter = ''.join(f" AND {condition}" for condition in date_conditions)
         
-        # Build WHERE clause with filters
+        # Build filter conditions
         filter_conditions = []
-        filter_params_base = [base_start, base_end]
-        filter_params_compare = [compare_start, compare_end]
-        
         if filters:
             # Add filter for sales channels
             if 'canal_venda' in filters and filters['canal_venda']:
-                placeholders = ', '.join(['%s'] * len(filters['canal_venda']))
-                filter_conditions.append(f"ch.name IN ({placeholders})")
-                filter_params_base.extend(filters['canal_venda'])
-                filter_params_compare.extend(filters['canal_venda'])
+                filter_conditions.append("ch.name = ANY(%s)")
+                params.append(list(filters['canal_venda']))
             
             # Add filter for stores
             if 'nome_loja' in filters and filters['nome_loja']:
-                placeholders = ', '.join(['%s'] * len(filters['nome_loja']))
-                filter_conditions.append(f"st.name IN ({placeholders})")
-                filter_params_base.extend(filters['nome_loja'])
-                filter_params_compare.extend(filters['nome_loja'])
+                filter_conditions.append("st.name = ANY(%s)")
+                params.append(list(filters['nome_loja']))
             
             # Add filter for products
             if 'nome_produto' in filters and filters['nome_produto']:
-                placeholders = ', '.join(['%s'] * len(filters['nome_produto']))
-                filter_conditions.append(f"""
+                filter_conditions.append("""
                     s.id IN (
                         SELECT DISTINCT ps.sale_id 
                         FROM product_sales ps
                         JOIN products p ON p.id = ps.product_id
-                        WHERE p.name IN ({placeholders})
+                        WHERE p.name = ANY(%s)
                     )
                 """)
-                filter_params_base.extend(filters['nome_produto'])
-                filter_params_compare.extend(filters['nome_produto'])
+                params.append(list(filters['nome_produto']))
         
         additional_where = ' AND ' + ' AND '.join(filter_conditions) if filter_conditions else ''
         
@@ -523,40 +1012,46 @@ SELECT
         if needs_store_join:
             joins += "\nLEFT JOIN stores st ON st.id = s.store_id"
         
-        # Query for base period
-        base_query = f"""
+        query = f"""
         SELECT
             SUM(total_amount) as faturamento_total,
             AVG(total_amount) as ticket_medio,
             COUNT(DISTINCT s.id) as total_vendas,
             COUNT(DISTINCT customer_id) FILTER (WHERE customer_id IS NOT NULL) as clientes_unicos,
-            AVG(delivery_seconds / 60.0) FILTER (WHERE delivery_seconds IS NOT NULL) as tempo_medio_entrega
+            AVG(delivery_seconds / 60.0) FILTER (WHERE delivery_seconds IS NOT NULL) as tempo_medio_entrega_min,
+            AVG(production_seconds / 60.0) FILTER (WHERE production_seconds IS NOT NULL) as tempo_medio_preparo_min
         FROM sales s
         {joins}
-        WHERE sale_status_desc = 'COMPLETED'
-          AND DATE(s.created_at) >= %s
-          AND DATE(s.created_at) <= %s
-          {additional_where}
+        WHERE sale_status_desc = 'COMPLETED' {date_filter} {additional_where}
         """
         
-        # Query for compare period  
-        compare_query = f"""
-        SELECT
-            SUM(total_amount) as faturamento_total,
-            AVG(total_amount) as ticket_medio,
-            COUNT(DISTINCT s.id) as total_vendas,
-            COUNT(DISTINCT customer_id) FILTER (WHERE customer_id IS NOT NULL) as clientes_unicos,
-            AVG(delivery_seconds / 60.0) FILTER (WHERE delivery_seconds IS NOT NULL) as tempo_medio_entrega
-        FROM sales s
-        {joins}
-        WHERE sale_status_desc = 'COMPLETED'
-          AND DATE(s.created_at) >= %s
-          AND DATE(s.created_at) <= %s
-          {additional_where}
-        """
+        return query, params
+    
+    @cached(
+        "analytics:compare",
+        ttl=lambda: settings.CACHE_TTL_COMPARE,
+        tags=_kpi_cache_tags,
+        model=PeriodComparisonResponse
+    )
+    async def compare_periods(
+        self,
+        base_start: date,
+        base_end: date,
+        compare_start: date,
+        compare_end: date,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> PeriodComparisonResponse:
+        """Compare metrics between two periods with optional filters"""
+        start_time = time.time()
         
-        base_row = await db.fetch_one(base_query, *filter_params_base)
-        compare_row = await db.fetch_one(compare_query, *filter_params_compare)
+        # Both periods use the KPI summary query (half-open ranges on created_at)
+        base_query, base_params = self._build_kpi_query(base_start, base_end, filters)
+        compare_query, compare_params = self._build_kpi_query(compare_start, compare_end, filters)
+        
+        base_row, compare_row = await asyncio.gather(
+            db.fetch_one(base_query, *base_params),
+            db.fetch_one(compare_query, *compare_params)
+        )
         
         # Build comparisons
         comparisons = []
@@ -565,7 +1060,7 @@ SELECT
             ('ticket_medio', 'Ticket Médio'),
             ('total_vendas', 'Total de Vendas'),
             ('clientes_unicos', 'Clientes Únicos'),
-            ('tempo_medio_entrega', 'Tempo Médio de Entrega (min)')
+            ('tempo_medio_entrega_min', 'Tempo Médio de Entrega (min)')
         ]
         
         for metric_key, metric_name in metrics:
@@ -604,7 +1099,108 @@ SELECT
                 cached=False
             )
         )
+    
+    @cached(
+        "analytics:dimensions:stores",
+        ttl=lambda: settings.CACHE_TTL_DIMENSIONS,
+        tags=store_tags("sales") + ["stores"],
+        model=DimensionValuesResponse
+    )
+    async def get_stores(self) -> DimensionValuesResponse:
+        """List active stores with their sales count"""
+        query = """
+        SELECT 
+            s.id,
+            s.name as label,
+            COUNT(DISTINCT sa.id) as count
+        FROM stores s
+        LEFT JOIN sales sa ON s.id = sa.store_id
+        WHERE s.is_active = true
+        GROUP BY s.id, s.name
+        ORDER BY s.name
+        """
+        return await self._fetch_dimension("stores", query)
+    
+    @cached(
+        "analytics:dimensions:channels",
+        ttl=lambda: settings.CACHE_TTL_DIMENSIONS,
+        tags=store_tags("sales") + ["channels"],
+        model=DimensionValuesResponse
+    )
+    async def get_channels(self) -> DimensionValuesResponse:
+        """List sales channels with their sales count"""
+        query = """
+        SELECT 
+            c.id,
+            c.name as label,
+            COUNT(DISTINCT s.id) as count
+        FROM channels c
+        LEFT JOIN sales s ON c.id = s.channel_id
+        GROUP BY c.id, c.name
+        ORDER BY c.name
+        """
+        return await self._fetch_dimension("channels", query)
+    
+    @cached(
+        "analytics:dimensions:products",
+        ttl=lambda: settings.CACHE_TTL_DIMENSIONS,
+        tags=["products", "product_sales"],
+        model=DimensionValuesResponse
+    )
+    async def get_products(self, limit: int = 100) -> DimensionValuesResponse:
+        """List top products by sales volume"""
+        query = """
+        SELECT 
+            p.id,
+            p.name as label,
+            COUNT(DISTINCT ps.id) as count
+        FROM products p
+        LEFT JOIN product_sales ps ON p.id = ps.product_id
+        GROUP BY p.id, p.name
+        ORDER BY count DESC
+        LIMIT %s
+        """
+        return await self._fetch_dimension("products", query, limit)
+    
+    @cached(
+        "analytics:dimensions:regions",
+        ttl=lambda: settings.CACHE_TTL_DIMENSIONS,
+        tags=store_tags("sales") + ["delivery_addresses"],
+        model=DimensionValuesResponse
+    )
+    async def get_regions(self) -> DimensionValuesResponse:
+        """List delivery regions (neighborhoods) by sales count"""
+        query = """
+        SELECT 
+            da.neighborhood as id,
+            CONCAT(da.neighborhood, ' - ', da.city) as label,
+            COUNT(DISTINCT s.id) as count
+        FROM delivery_addresses da
+        JOIN sales s ON da.sale_id = s.id
+        WHERE da.neighborhood IS NOT NULL
+        GROUP BY da.neighborhood, da.city
+        ORDER BY count DESC
+        LIMIT 100
+        """
+        return await self._fetch_dimension("regions", query)
+    
+    async def _fetch_dimension(self, dimension: str, query: str, *params) -> DimensionValuesResponse:
+        rows = await db.fetch_all(query, *params)
+        values = [
+            DimensionValue(
+                id=row['id'],
+                label=row['label'],
+                count=row['count']
+            )
+            for row in rows
+        ]
+        return DimensionValuesResponse(
+            dimension=dimension,
+            values=values,
+            total=len(values)
+        )
 
 
 # Global service instance
 analytics_service = AnalyticsService()
+cache_refresher.register("analytics:query", analytics_service.refresh_query)
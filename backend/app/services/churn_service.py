@@ -4,7 +4,13 @@ Handles customer churn metrics and RFM segmentation analysis
 """
 from typing import List, Dict, Optional
 from datetime import datetime, date, timedelta
-from app.db.database import db
+from app.db.database import db, use_lane, HEAVY
+from app.db.customer_state import customer_state
+from app.services.customer_scoring import customer_scoring
+from app.services.pagination import InvalidCursor, cursor_scope, decode_cursor, encode_cursor
+from app.cache.decorators import cached
+from app.cache.redis_client import store_tags
+from app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,6 +19,8 @@ logger = logging.getLogger(__name__)
 class ChurnService:
     """Service for customer churn analysis"""
     
+    @cached("analytics:churn:metrics", ttl=lambda: settings.CACHE_TTL_CHURN, tags=store_tags("sales"))
+    @use_lane(HEAVY)
     async def get_churn_metrics(self, days_inactive: int = 30) -> Dict:
         """
         Get overall churn metrics
@@ -26,25 +34,27 @@ class ChurnService:
         Note:
             Uses the last sale date in dataset as reference point.
             Churn is calculated relative to the dataset's timeframe, not current date.
+            Reads the incremental customer_state table (one row per customer).
         """
+        await customer_state.sync()
+        
         query = f"""
         WITH dataset_reference AS (
             SELECT 
-                MIN(created_at::date) as start_date,
-                MAX(created_at::date) as reference_date,
-                MAX(created_at::date) - MIN(created_at::date) as dataset_span_days
-            FROM sales
+                min_sale_at::date as start_date,
+                max_sale_at::date as reference_date,
+                max_sale_at::date - min_sale_at::date as dataset_span_days
+            FROM customer_state_meta
         ),
         customer_stats AS (
             SELECT 
                 customer_id,
-                MAX(s.created_at) as last_purchase_date,
-                COUNT(*) as total_purchases,
-                SUM(s.total_amount) as lifetime_value,
-                (SELECT reference_date FROM dataset_reference) - MAX(s.created_at::date) as days_since_last_purchase,
+                last_purchase_at as last_purchase_date,
+                frequency as total_purchases,
+                monetary as lifetime_value,
+                (SELECT reference_date FROM dataset_reference) - last_purchase_at::date as days_since_last_purchase,
                 (SELECT dataset_span_days FROM dataset_reference) as dataset_span
-            FROM sales s
-            GROUP BY customer_id
+            FROM customer_state
         ),
         churn_classification AS (
             SELECT 
@@ -106,12 +116,18 @@ class ChurnService:
             'dataset_span_days': row['dataset_span_days']
         }
     
+    @cached("analytics:churn:at-risk", ttl=lambda: settings.CACHE_TTL_CHURN, tags=store_tags("sales") + ["customers", "stores"])
+    @use_lane(HEAVY)
     async def get_at_risk_customers(
         self, 
         min_purchases: int = 2,
         days_inactive: int = 30,
-        limit: int = 100
-    ) -> List[Dict]:
+        limit: int = 100,
+        offset: int = 0,
+        sort_by: str = 'days_since_last_purchase',
+        descending: bool = True,
+        cursor: Optional[str] = None
+    ) -> Dict:
         """
         Get list of customers at risk of churning
         
@@ -119,62 +135,42 @@ class ChurnService:
             min_purchases: Minimum number of purchases to consider
             days_inactive: Days since last purchase to flag as at-risk
             limit: Maximum number of results
+            offset: Number of results to skip (ignored with a cursor)
+            sort_by: days_since_last_purchase, risk_score, lifetime_value or total_purchases
+            descending: Sort direction
+            cursor: Continuation token (next_cursor of the previous page)
             
         Returns:
-            List of at-risk customer records
+            Dict with the page of at-risk customer records, the total matching
+            and next_cursor (None on the last page)
             
         Note:
-            Uses the last sale date in dataset as reference point instead of CURRENT_DATE
-        """
-        query = f"""
-        WITH dataset_reference AS (
-            SELECT MAX(created_at::date) as reference_date
-            FROM sales
-        )
-        SELECT 
-            s.customer_id,
-            COALESCE(c.customer_name, s.customer_name, 'Cliente #' || s.customer_id) as customer_name,
-            COUNT(DISTINCT s.id) as total_purchases,
-            SUM(s.total_amount) as lifetime_value,
-            AVG(s.total_amount) as avg_order_value,
-            MAX(s.created_at) as last_purchase_date,
-            (SELECT reference_date FROM dataset_reference) - MAX(s.created_at::date) as days_since_last_purchase,
-            STRING_AGG(DISTINCT st.name, ', ') as favorite_stores
-        FROM sales s
-        CROSS JOIN dataset_reference dr
-        LEFT JOIN customers c ON s.customer_id = c.id
-        LEFT JOIN stores st ON s.store_id = st.id
-        WHERE s.customer_id IS NOT NULL
-        GROUP BY s.customer_id, c.customer_name, s.customer_name
-        HAVING 
-            COUNT(*) >= {min_purchases}
-            AND (SELECT reference_date FROM dataset_reference) - MAX(s.created_at::date) BETWEEN {days_inactive // 2} AND {days_inactive}
-        ORDER BY (SELECT reference_date FROM dataset_reference) - MAX(s.created_at::date) DESC, 
-                 SUM(s.total_amount) DESC
-        LIMIT {limit}
+            Uses the last sale date in dataset as reference point instead of CURRENT_DATE.
+            Answered from the in-memory scored frame (see customer_scoring).
         """
+        scope = cursor_scope([min_purchases, days_inactive, sort_by, descending])
+        after = decode_cursor(cursor, scope) if cursor else None
+        if after is not None and len(after) != 3:
+            raise InvalidCursor("Invalid cursor")
         
-        rows = await db.fetch_all(query)
-        
-        return [
-            {
-                'customer_id': row['customer_id'],
-                'customer_name': row['customer_name'],
-                'total_purchases': row['total_purchases'],
-                'lifetime_value': float(row['lifetime_value']),
-                'avg_order_value': float(row['avg_order_value']),
-                'last_purchase_date': row['last_purchase_date'].isoformat() if row['last_purchase_date'] else None,
-                'days_since_last_purchase': row['days_since_last_purchase'],
-                'favorite_stores': row['favorite_stores'],
-                'risk_score': self._calculate_risk_score(
-                    days_inactive=row['days_since_last_purchase'],
-                    total_purchases=row['total_purchases'],
-                    lifetime_value=float(row['lifetime_value'])
-                )
-            }
-            for row in rows
-        ]
+        frame = await customer_scoring.get_frame()
+        customers, total, last_key = frame.at_risk(
+            min_purchases=min_purchases,
+            days_inactive=days_inactive,
+            limit=limit,
+            offset=offset,
+            sort_by=sort_by,
+            descending=descending,
+            after=after
+        )
+        return {
+            'customers': customers,
+            'total': total,
+            'next_cursor': encode_cursor(list(last_key), scope) if last_key else None
+        }
     
+    @cached("analytics:churn:rfm", ttl=lambda: settings.CACHE_TTL_CHURN, tags=store_tags("sales"))
+    @use_lane(HEAVY)
     async def get_rfm_segmentation(self) -> List[Dict]:
         """
         Get RFM (Recency, Frequency, Monetary) segmentation data
@@ -183,73 +179,14 @@ class ChurnService:
             List of customer segments with RFM scores
             
         Note:
-            Uses the last sale date in dataset as reference point instead of CURRENT_DATE
+            Uses the last sale date in dataset as reference point instead of CURRENT_DATE.
+            Quintiles follow NTILE(5) semantics and are computed on the scored frame.
         """
-        query = """
-        WITH dataset_reference AS (
-            SELECT MAX(created_at::date) as reference_date
-            FROM sales
-        ),
-        customer_metrics AS (
-            SELECT 
-                customer_id,
-                (SELECT reference_date FROM dataset_reference) - MAX(s.created_at::date) as recency,
-                COUNT(*) as frequency,
-                SUM(s.total_amount) as monetary
-            FROM sales s
-            WHERE customer_id IS NOT NULL
-            GROUP BY customer_id
-        ),
-        rfm_scores AS (
-            SELECT 
-                customer_id,
-                recency,
-                frequency,
-                monetary,
-                -- Calculate RFM scores (1-5, where 5 is best)
-                NTILE(5) OVER (ORDER BY recency DESC) as recency_score,
-                NTILE(5) OVER (ORDER BY frequency ASC) as frequency_score,
-                NTILE(5) OVER (ORDER BY monetary ASC) as monetary_score
-            FROM customer_metrics
-        )
-        SELECT 
-            recency_score,
-            frequency_score,
-            monetary_score,
-            COUNT(*) as customer_count,
-            ROUND(AVG(recency)::numeric, 2) as avg_recency,
-            ROUND(AVG(frequency)::numeric, 2) as avg_frequency,
-            ROUND(AVG(monetary)::numeric, 2) as avg_monetary,
-            CASE 
-                WHEN recency_score >= 4 AND frequency_score >= 4 THEN 'Campeões'
-                WHEN recency_score >= 3 AND frequency_score >= 3 THEN 'Clientes Fiéis'
-                WHEN recency_score >= 4 AND frequency_score <= 2 THEN 'Promissores'
-                WHEN recency_score <= 2 AND frequency_score >= 4 THEN 'Em Risco'
-                WHEN recency_score <= 2 AND frequency_score <= 2 THEN 'Hibernando'
-                WHEN recency_score <= 1 THEN 'Perdidos'
-                ELSE 'Potenciais'
-            END as segment_name
-        FROM rfm_scores
-        GROUP BY recency_score, frequency_score, monetary_score
-        ORDER BY recency_score DESC, frequency_score DESC, monetary_score DESC
-        """
-        
-        rows = await db.fetch_all(query)
-        
-        return [
-            {
-                'recency_score': row['recency_score'],
-                'frequency_score': row['frequency_score'],
-                'monetary_score': row['monetary_score'],
-                'customer_count': row['customer_count'],
-                'avg_recency': float(row['avg_recency']),
-                'avg_frequency': float(row['avg_frequency']),
-                'avg_monetary': float(row['avg_monetary']),
-                'segment_name': row['segment_name']
-            }
-            for row in rows
-        ]
+        frame = await customer_scoring.get_frame()
+        return frame.segments()
     
+    @cached("analytics:churn:trend", ttl=lambda: settings.CACHE_TTL_CHURN, tags=store_tags("sales"))
+    @use_lane(HEAVY)
     async def get_churn_trend(
         self,
         start_date: Optional[date] = None,
@@ -288,12 +225,41 @@ class ChurnService:
         }
         trunc = date_trunc_map.get(granularity, 'week')
         
+        query, params = self._build_churn_trend_query(start_date, end_date, trunc)
+        
+        rows = await db.fetch_all(query, *params)
+        
+        return [
+            {
+                'date': row['date'].isoformat(),
+                'active_customers': row['active_customers'],
+                'churned_customers': row['churned_customers'],
+                'churn_rate': float(row['churn_rate'])
+            }
+            for row in rows
+        ]
+    
+    def _build_churn_trend_query(self, start_date: date, end_date: date, trunc: str) -> tuple[str, list]:
+        """
+        Build the churn trend query as a single sweep over the periods
+        
+        Each customer's purchase periods are ordered once (window functions) and
+        turned into events: +1 active at the first purchase, +1 churned at the
+        first period more than 30 days after a purchase, -1 churned when the
+        customer buys again. Running sums over the period series give the
+        counts, so the cost is linear in customer-periods plus periods instead
+        of periods × customer-periods.
+        
+        A customer counts as churned in a period when their last purchase up to
+        that period is more than 30 days before the period start.
+        """
+        step = f"'1 {trunc}'::interval"
         query = f"""
         WITH period_series AS (
             SELECT generate_series(
-                DATE_TRUNC('{trunc}', '{start_date}'::date),
-                DATE_TRUNC('{trunc}', '{end_date}'::date),
-                '1 {trunc}'::interval
+                DATE_TRUNC('{trunc}', %s::date),
+                DATE_TRUNC('{trunc}', %s::date),
+                {step}
             )::date as period
         ),
         sales_by_period AS (
@@ -302,26 +268,51 @@ class ChurnService:
                 customer_id,
                 MAX(created_at) as last_purchase_in_period
             FROM sales
-            WHERE created_at::date BETWEEN '{start_date}' AND '{end_date}'
+            WHERE created_at >= %s::date
+                AND created_at < %s::date + 1
                 AND customer_id IS NOT NULL
             GROUP BY DATE_TRUNC('{trunc}', created_at)::date, customer_id
         ),
+        timeline AS (
+            SELECT
+                period,
+                LEAD(period) OVER (PARTITION BY customer_id ORDER BY period) as next_period,
+                ROW_NUMBER() OVER (PARTITION BY customer_id ORDER BY period) = 1 as is_first,
+                -- Primeiro período que começa mais de 30 dias depois da compra
+                (DATE_TRUNC('{trunc}', last_purchase_in_period + INTERVAL '30 days') + {step})::date as churn_period
+            FROM sales_by_period
+        ),
+        events AS (
+            SELECT period, 1 as active_delta, 0 as churned_delta
+            FROM timeline
+            WHERE is_first
+            UNION ALL
+            SELECT churn_period, 0, 1
+            FROM timeline
+            WHERE next_period IS NULL OR churn_period < next_period
+            UNION ALL
+            -- Voltou a comprar: deixa de contar como churned
+            SELECT next_period, 0, -1
+            FROM timeline
+            WHERE next_period IS NOT NULL AND churn_period < next_period
+        ),
+        deltas AS (
+            SELECT period, SUM(active_delta) as active_delta, SUM(churned_delta) as churned_delta
+            FROM events
+            GROUP BY period
+        ),
         customer_status_by_period AS (
             SELECT 
                 ps.period,
-                COUNT(DISTINCT sbp.customer_id) as active_customers,
-                COUNT(DISTINCT CASE 
-                    WHEN sbp.last_purchase_in_period < ps.period - INTERVAL '30 days' 
-                    THEN sbp.customer_id 
-                END) as churned_customers
+                SUM(COALESCE(d.active_delta, 0)) OVER (ORDER BY ps.period) as active_customers,
+                SUM(COALESCE(d.churned_delta, 0)) OVER (ORDER BY ps.period) as churned_customers
             FROM period_series ps
-            LEFT JOIN sales_by_period sbp ON sbp.period <= ps.period
-            GROUP BY ps.period
+            LEFT JOIN deltas d ON d.period = ps.period
         )
         SELECT 
             period::date as date,
-            active_customers,
-            churned_customers,
+            active_customers::int as active_customers,
+            churned_customers::int as churned_customers,
             CASE 
                 WHEN active_customers > 0 
                 THEN ROUND((churned_customers::numeric / active_customers) * 100, 2)
@@ -330,40 +321,7 @@ class ChurnService:
         FROM customer_status_by_period
         ORDER BY period
         """
-        
-        rows = await db.fetch_all(query)
-        
-        return [
-            {
-                'date': row['date'].isoformat(),
-                'active_customers': row['active_customers'],
-                'churned_customers': row['churned_customers'],
-                'churn_rate': float(row['churn_rate'])
-            }
-            for row in rows
-        ]
-    
-    def _calculate_risk_score(
-        self,
-        days_inactive: int,
-        total_purchases: int,
-        lifetime_value: float
-    ) -> int:
-        """
-        Calculate risk score (0-100) for customer churn
-        Higher score = higher risk
-        """
-        # Recency risk (0-40 points)
-        recency_risk = min(40, (days_inactive / 30) * 40)
-        
-        # Frequency risk (0-30 points) - fewer purchases = higher risk
-        frequency_risk = max(0, 30 - (total_purchases * 3))
-        
-        # Monetary risk (0-30 points) - lower value = higher risk
-        monetary_risk = max(0, 30 - (lifetime_value / 100))
-        
-        total_risk = int(recency_risk + frequency_risk + monetary_risk)
-        return min(100, max(0, total_risk))
+        return query, [start_date, end_date, start_date, end_date]
 
 
 # Singleton instance
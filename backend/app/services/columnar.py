@@ -0,0 +1,78 @@
+"""
+Columnar result encoding (Apache Arrow / Parquet)
+pyarrow é opcional: sem ele, /query responde apenas JSON.
+"""
+from typing import List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depende do ambiente
+    pa = None
+    pq = None
+
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+MEDIA_TYPES = {
+    "arrow": ARROW_STREAM_MEDIA_TYPE,
+    "parquet": PARQUET_MEDIA_TYPE,
+}
+
+
+def available() -> bool:
+    """pyarrow instalado?"""
+    return pa is not None
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Columnar format requested in an Accept header ('arrow' | 'parquet')
+
+    Returns None for anything else (JSON stays the default, e.g. for
+    'application/json, */*').
+    """
+    if not accept:
+        return None
+
+    requested = [item.split(";")[0].strip().lower() for item in accept.split(",")]
+    for media_type in requested:
+        for fmt, columnar_type in MEDIA_TYPES.items():
+            if media_type == columnar_type:
+                return fmt
+    return None
+
+
+def _to_array(values: list):
+    array = pa.array(values)
+    # NUMERIC vira float64: Decimal128 não é bem suportado pelos leitores JS
+    if pa.types.is_decimal(array.type):
+        return array.cast(pa.float64())
+    return array
+
+
+def encode(columns: List[str], values: List[list], fmt: str = "arrow") -> bytes:
+    """
+    Encode column-oriented results (see Database.fetch_columns)
+
+    Args:
+        columns: Column names
+        values: One list of values per column
+        fmt: 'arrow' (IPC stream) or 'parquet'
+
+    Returns:
+        Serialized table
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow não está instalado")
+
+    table = pa.Table.from_arrays([_to_array(column) for column in values], names=columns)
+    sink = pa.BufferOutputStream()
+    if fmt == "parquet":
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
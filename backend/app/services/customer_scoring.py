@@ -0,0 +1,415 @@
+"""
+Scored customer frame (RFM quintiles, segments and churn risk)
+
+Loads recency / frequency / monetary of every customer from customer_state
+once, as columns, and scores all of them in a single vectorized pass. The
+scored frame stays in memory (per worker) stamped with the customer_state
+watermark, so the at-risk listing and the RFM segment distribution are
+answered from it - filtering, sorting and pagination included - without
+going back to Postgres until new sales are synced.
+
+numpy é opcional: sem ele o mesmo cálculo roda em Python puro (mais lento).
+"""
+import asyncio
+import bisect
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.config import settings
+from app.db.customer_state import customer_state
+from app.db.database import db
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depende do ambiente
+    np = None
+
+logger = logging.getLogger(__name__)
+
+LOAD_QUERY = """
+WITH dataset_reference AS (
+    SELECT max_sale_at::date AS reference_date
+    FROM customer_state_meta
+)
+SELECT
+    cs.customer_id,
+    COALESCE(c.customer_name, cs.customer_name, 'Cliente #' || cs.customer_id) AS customer_name,
+    cs.frequency,
+    cs.monetary::float8 AS monetary,
+    cs.last_purchase_at,
+    dr.reference_date - cs.last_purchase_at::date AS recency,
+    cs.store_ids
+FROM customer_state cs
+CROSS JOIN dataset_reference dr
+LEFT JOIN customers c ON cs.customer_id = c.id
+"""
+
+STAMP_QUERY = "SELECT last_sale_id, synced_at FROM customer_state_meta WHERE id = 1"
+
+# Mesmas regras (e ordem) do CASE da segmentação RFM original
+SEGMENTS = [
+    'Campeões',
+    'Clientes Fiéis',
+    'Promissores',
+    'Em Risco',
+    'Hibernando',
+    'Perdidos',
+    'Potenciais',
+]
+
+# Colunas aceitas em sort_by do at-risk
+SORT_KEYS = ('days_since_last_purchase', 'risk_score', 'lifetime_value', 'total_purchases')
+
+
+def _segment_index(r: int, f: int) -> int:
+    if r >= 4 and f >= 4:
+        return 0
+    if r >= 3 and f >= 3:
+        return 1
+    if r >= 4 and f <= 2:
+        return 2
+    if r <= 2 and f >= 4:
+        return 3
+    if r <= 2 and f <= 2:
+        return 4
+    if r <= 1:
+        return 5
+    return 6
+
+
+def _risk_score(days_inactive: int, total_purchases: int, lifetime_value: float) -> int:
+    """Risk score (0-100, maior = mais risco) - versão escalar do cálculo vetorizado"""
+    recency_risk = min(40, (days_inactive / 30) * 40)
+    frequency_risk = max(0, 30 - (total_purchases * 3))
+    monetary_risk = max(0, 30 - (lifetime_value / 100))
+    return min(100, max(0, int(recency_risk + frequency_risk + monetary_risk)))
+
+
+def _ntile_of_position(position: int, n: int, buckets: int) -> int:
+    """NTILE(buckets) of the row at `position` (0-based) in an ordered set of n rows"""
+    size, extra = divmod(n, buckets)
+    big = extra * (size + 1)  # os primeiros `extra` grupos têm uma linha a mais
+    if position < big:
+        return position // (size + 1) + 1
+    return extra + (position - big) // max(size, 1) + 1
+
+
+class ScoredFrame:
+    """Per-customer columns plus their RFM scores, segment and risk score"""
+
+    def __init__(self, columns: Dict[str, Sequence], stores: Dict[int, str], stamp: Tuple):
+        self.stamp = stamp
+        self.stores = stores
+        self.size = len(columns['customer_id'])
+        self._orders: Dict[Tuple, Any] = {}
+        self.customer_name = columns['customer_name']
+        self.last_purchase_at = columns['last_purchase_at']
+        self.store_ids = columns['store_ids']
+        # recency NULL só acontece sem referência (meta vazia): trata como 0
+        recency = [value or 0 for value in columns['recency']]
+        frequency = columns['frequency']
+        monetary = columns['monetary']
+
+        if np is not None:
+            self.customer_id = np.asarray(columns['customer_id'], dtype=np.int64)
+            self.recency = np.asarray(recency, dtype=np.int64)
+            self.frequency = np.asarray(frequency, dtype=np.int64)
+            self.monetary = np.asarray(monetary, dtype=np.float64)
+            self._score_numpy()
+        else:
+            self.customer_id = list(columns['customer_id'])
+            self.recency = recency
+            self.frequency = list(frequency)
+            self.monetary = [float(value) for value in monetary]
+            self._score_python()
+
+    # ---- scoring ----
+
+    def _score_numpy(self):
+        n = self.size
+        positions = np.arange(n)
+        size, extra = divmod(n, 5)
+        big = extra * (size + 1)
+        tiles = np.where(
+            positions < big,
+            positions // (size + 1),
+            extra + (positions - big) // max(size, 1)
+        ).astype(np.int8) + 1
+
+        def ntile(keys):
+            scores = np.empty(n, dtype=np.int8)
+            scores[np.argsort(keys, kind='stable')] = tiles
+            return scores
+
+        self.recency_score = ntile(-self.recency)  # ORDER BY recency DESC
+        self.frequency_score = ntile(self.frequency)
+        self.monetary_score = ntile(self.monetary)
+
+        r, f = self.recency_score, self.frequency_score
+        self.segment = np.select(
+            [
+                (r >= 4) & (f >= 4),
+                (r >= 3) & (f >= 3),
+                (r >= 4) & (f <= 2),
+                (r <= 2) & (f >= 4),
+                (r <= 2) & (f <= 2),
+                r <= 1,
+            ],
+            [0, 1, 2, 3, 4, 5],
+            default=6
+        ).astype(np.int8)
+
+        recency_risk = np.minimum(40, (self.recency / 30) * 40)
+        frequency_risk = np.maximum(0, 30 - (self.frequency * 3))
+        monetary_risk = np.maximum(0, 30 - (self.monetary / 100))
+        total = np.trunc(recency_risk + frequency_risk + monetary_risk)
+        self.risk_score = np.clip(total, 0, 100).astype(np.int64)
+
+    def _score_python(self):
+        n = self.size
+
+        def ntile(key):
+            scores = [0] * n
+            for position, index in enumerate(sorted(range(n), key=key)):
+                scores[index] = _ntile_of_position(position, n, 5)
+            return scores
+
+        self.recency_score = ntile(lambda i: -self.recency[i])
+        self.frequency_score = ntile(self.frequency.__getitem__)
+        self.monetary_score = ntile(self.monetary.__getitem__)
+        self.segment = [
+            _segment_index(r, f) for r, f in zip(self.recency_score, self.frequency_score)
+        ]
+        self.risk_score = [
+            _risk_score(*values) for values in zip(self.recency, self.frequency, self.monetary)
+        ]
+
+    # ---- queries ----
+
+    def segments(self) -> List[Dict]:
+        """RFM distribution: one row per (R, F, M) combination, best scores first"""
+        if self.size == 0:
+            return []
+
+        if np is not None:
+            codes = (
+                self.recency_score.astype(np.int64) * 100
+                + self.frequency_score.astype(np.int64) * 10
+                + self.monetary_score
+            )
+            unique, inverse, counts = np.unique(codes, return_inverse=True, return_counts=True)
+            sums = {
+                'recency': np.bincount(inverse, weights=self.recency),
+                'frequency': np.bincount(inverse, weights=self.frequency),
+                'monetary': np.bincount(inverse, weights=self.monetary),
+            }
+            groups = [
+                (int(code), int(count), {key: float(values[i]) for key, values in sums.items()})
+                for i, (code, count) in enumerate(zip(unique, counts))
+            ]
+        else:
+            acc: Dict[int, List[float]] = {}
+            for i in range(self.size):
+                code = self.recency_score[i] * 100 + self.frequency_score[i] * 10 + self.monetary_score[i]
+                entry = acc.setdefault(code, [0, 0.0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += self.recency[i]
+                entry[2] += self.frequency[i]
+                entry[3] += self.monetary[i]
+            groups = [
+                (code, count, {'recency': r, 'frequency': f, 'monetary': m})
+                for code, (count, r, f, m) in acc.items()
+            ]
+
+        result = []
+        for code, count, sums in sorted(groups, key=lambda group: -group[0]):
+            r, f, m = code // 100, code // 10 % 10, code % 10
+            result.append({
+                'recency_score': r,
+                'frequency_score': f,
+                'monetary_score': m,
+                'customer_count': count,
+                'avg_recency': round(sums['recency'] / count, 2),
+                'avg_frequency': round(sums['frequency'] / count, 2),
+                'avg_monetary': round(sums['monetary'] / count, 2),
+                'segment_name': SEGMENTS[_segment_index(r, f)],
+            })
+        return result
+
+    def at_risk(
+        self,
+        min_purchases: int,
+        days_inactive: int,
+        limit: int,
+        offset: int = 0,
+        sort_by: str = 'days_since_last_purchase',
+        descending: bool = True,
+        after: Optional[Sequence] = None
+    ) -> Tuple[List[Dict], int, Optional[Tuple]]:
+        """
+        Customers with >= min_purchases whose last purchase is between
+        days_inactive // 2 and days_inactive days before the reference date
+
+        Sorted by sort_by (ties: lifetime value desc, customer id). Rows are
+        walked in a sort order computed once per frame; with `after` (the sort
+        key of the last row of the previous page) the page starts right after
+        it and offset is ignored.
+
+        Returns:
+            (page of customer records, total matching customers,
+             sort key of the last row when more rows follow)
+        """
+        if sort_by not in SORT_KEYS:
+            raise ValueError(f"Invalid sort_by: {sort_by}. Use one of {', '.join(SORT_KEYS)}")
+        lower = days_inactive // 2
+        order, keys = self._sort_order(sort_by, descending)
+
+        if np is not None:
+            mask = (
+                (self.frequency >= min_purchases)
+                & (self.recency >= lower)
+                & (self.recency <= days_inactive)
+            )
+            total = int(mask.sum())
+            if after is not None:
+                (k1, k2, k3), (a1, a2, a3) = keys, after
+                mask &= (k1 > a1) | ((k1 == a1) & ((k2 > a2) | ((k2 == a2) & (k3 > a3))))
+                offset = 0
+            selected = order[mask[order]]
+            page = selected[offset:offset + limit + 1].tolist()
+        else:
+            def matches(i: int) -> bool:
+                return self.frequency[i] >= min_purchases and lower <= self.recency[i] <= days_inactive
+
+            total = sum(1 for i in range(self.size) if matches(i))
+            start = bisect.bisect_right(keys, tuple(after)) if after is not None else 0
+            skip = 0 if after is not None else offset
+            page = []
+            for i in order[start:]:
+                if not matches(i):
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                page.append(i)
+                if len(page) > limit:
+                    break
+
+        last_key = self.sort_key(page[limit - 1], sort_by, descending) if len(page) > limit else None
+        return [self._record(i) for i in page[:limit]], total, last_key
+
+    def sort_key(self, i: int, sort_by: str, descending: bool) -> Tuple:
+        """Sort key of a row in the at-risk order (ascending tuple comparison)"""
+        sign = -1 if descending else 1
+        key = (sign * self._column(sort_by)[i], -self.monetary[i], self.customer_id[i])
+        return tuple(value.item() if hasattr(value, 'item') else value for value in key)
+
+    def _sort_order(self, sort_by: str, descending: bool):
+        """
+        Row positions in at-risk order, plus the keys they are compared on
+        (numpy: the three signed key columns; Python: sorted key tuples)
+        """
+        cache_key = (sort_by, descending)
+        if cache_key not in self._orders:
+            sign = -1 if descending else 1
+            primary = self._column(sort_by)
+            if np is not None:
+                keys = (sign * primary, -self.monetary, self.customer_id)
+                # lexsort: a última chave é a principal
+                order = np.lexsort(keys[::-1])
+            else:
+                order = sorted(
+                    range(self.size),
+                    key=lambda i: (sign * primary[i], -self.monetary[i], self.customer_id[i])
+                )
+                keys = [(sign * primary[i], -self.monetary[i], self.customer_id[i]) for i in order]
+            self._orders[cache_key] = (order, keys)
+        return self._orders[cache_key]
+
+    def _column(self, name: str):
+        return {
+            'days_since_last_purchase': self.recency,
+            'risk_score': self.risk_score,
+            'lifetime_value': self.monetary,
+            'total_purchases': self.frequency,
+        }[name]
+
+    def _record(self, i: int) -> Dict:
+        frequency = int(self.frequency[i])
+        monetary = float(self.monetary[i])
+        last_purchase = self.last_purchase_at[i]
+        store_names = sorted(
+            self.stores[store_id] for store_id in (self.store_ids[i] or []) if store_id in self.stores
+        )
+        return {
+            'customer_id': int(self.customer_id[i]),
+            'customer_name': self.customer_name[i],
+            'total_purchases': frequency,
+            'lifetime_value': monetary,
+            'avg_order_value': monetary / frequency if frequency else 0.0,
+            'last_purchase_date': last_purchase.isoformat() if last_purchase else None,
+            'days_since_last_purchase': int(self.recency[i]),
+            'favorite_stores': ', '.join(store_names) or None,
+            'risk_score': int(self.risk_score[i]),
+            'segment': SEGMENTS[int(self.segment[i])],
+        }
+
+
+class CustomerScoring:
+    """Keeps the scored frame of this worker fresh"""
+
+    def __init__(self):
+        self._frame: Optional[ScoredFrame] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self.load_ms: Optional[float] = None
+
+    async def get_frame(self) -> ScoredFrame:
+        """
+        The scored frame, reloaded only when customer_state moved
+
+        At most once per CUSTOMER_SCORING_CHECK_INTERVAL the state is synced
+        and its watermark compared with the frame stamp; an unchanged stamp
+        keeps the frame.
+        """
+        if self._frame is not None and time.monotonic() - self._checked_at < settings.CUSTOMER_SCORING_CHECK_INTERVAL:
+            return self._frame
+
+        async with self._lock:
+            if self._frame is not None and time.monotonic() - self._checked_at < settings.CUSTOMER_SCORING_CHECK_INTERVAL:
+                return self._frame
+
+            await customer_state.sync()
+            row = await db.fetch_one(STAMP_QUERY)
+            stamp = (row['last_sale_id'], row['synced_at']) if row else (None, None)
+            if self._frame is None or self._frame.stamp != stamp:
+                self._frame = await self._load(stamp)
+            self._checked_at = time.monotonic()
+            return self._frame
+
+    async def _load(self, stamp: Tuple) -> ScoredFrame:
+        start = time.time()
+        names, values = await db.fetch_columns(LOAD_QUERY)
+        stores = {row['id']: row['name'] for row in await db.fetch_all("SELECT id, name FROM stores")}
+        frame = ScoredFrame(dict(zip(names, values)), stores, stamp)
+        self.load_ms = round((time.time() - start) * 1000, 2)
+        logger.info(
+            f"🧮 Scored frame loaded: {frame.size} customers in {self.load_ms}ms "
+            f"({'numpy' if np is not None else 'python'}, watermark={stamp[0]})"
+        )
+        return frame
+
+    def get_stats(self) -> Dict[str, Any]:
+        frame = self._frame
+        return {
+            "backend": "numpy" if np is not None else "python",
+            "customers": frame.size if frame else 0,
+            "watermark": frame.stamp[0] if frame else None,
+            "synced_at": frame.stamp[1].isoformat() if frame and frame.stamp[1] else None,
+            "load_ms": self.load_ms,
+        }
+
+
+# Instância global
+customer_scoring = CustomerScoring()
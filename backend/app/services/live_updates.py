@@ -0,0 +1,228 @@
+"""
+Live dashboard updates (server push)
+
+Each browser tab opens one stream (POST /live) listing the widgets it shows.
+Subscriptions are keyed by their normalized request, so a distinct query is
+computed once per LIVE_REFRESH_INTERVAL tick however many tabs show it: the
+distinct /query requests of a tick run through one execute_batch (shared
+scans), the KPI cards through get_kpi_dashboard, both behind the usual cache.
+A widget only gets an event when its data changed since the previous tick;
+the result is encoded once and the same bytes go to every subscriber.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.cache.redis_client import redis_cache
+from app.cache.serializers import json_dumps
+from app.config import settings
+from app.db.database import statement_timeout
+from app.models.schemas import AnalyticsQueryRequest, LiveSubscription
+from app.services.analytics_service import analytics_service
+
+logger = logging.getLogger(__name__)
+
+# Eventos pendentes por stream; acima disso o stream é encerrado (None) e o
+# cliente reconecta, recebendo um snapshot em vez de atualizações perdidas
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class LiveQuery:
+    """A distinct query and the streams (with their widget ids) subscribed to it"""
+
+    def __init__(self, kind: str, data: Dict[str, Any]):
+        self.kind = kind
+        self.data = data
+        self.subscribers: Dict[asyncio.Queue, List[str]] = {}
+        self.fingerprint: Optional[str] = None
+        self.payload: Optional[bytes] = None
+        self.error: Optional[str] = None
+
+
+def _frame(widget_id: str, payload: bytes) -> bytes:
+    """SSE event for one widget (the result bytes are shared, only the id differs)"""
+    return b"event: update\ndata: {\"id\":" + json_dumps(widget_id) + b",\"result\":" + payload + b"}\n\n"
+
+
+def _error_frame(widget_id: str, detail: str) -> bytes:
+    """SSE event for a widget whose query failed (the others keep updating)"""
+    return b"event: error\ndata: " + json_dumps({"id": widget_id, "detail": detail}) + b"\n\n"
+
+
+class LiveHub:
+    """Computes each distinct subscribed query once per tick and fans out changes"""
+
+    def __init__(self):
+        self._queries: Dict[str, LiveQuery] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.ticks = 0
+        self.computed = 0
+        self.events = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None and settings.LIVE_REFRESH_INTERVAL > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.LIVE_REFRESH_INTERVAL)
+            if not self._queries:
+                continue
+            try:
+                await self.refresh()
+                self.ticks += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"⚠️ Live refresh failed: {e}")
+
+    def subscribe(self, subscriptions: List[LiveSubscription]) -> Tuple[asyncio.Queue, List[str]]:
+        """Register a stream; returns its queue and the keys it subscribed to"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        keys = []
+        for subscription in subscriptions:
+            if subscription.query is not None:
+                kind, data = "query", subscription.query.model_dump(exclude_none=True)
+            else:
+                kind, data = "kpis", subscription.kpis.model_dump(exclude_none=True)
+            key = redis_cache.key_for(f"live:{kind}", data)
+            live = self._queries.setdefault(key, LiveQuery(kind, data))
+            live.subscribers.setdefault(queue, []).append(subscription.id)
+            if key not in keys:
+                keys.append(key)
+        return queue, keys
+
+    def unsubscribe(self, queue: asyncio.Queue, keys: List[str]):
+        for key in keys:
+            live = self._queries.get(key)
+            if live is None:
+                continue
+            live.subscribers.pop(queue, None)
+            if not live.subscribers:
+                del self._queries[key]
+
+    async def snapshot(self, queue: asyncio.Queue, keys: List[str]):
+        """Send a new stream the current data of its widgets (computing what is missing)"""
+        missing = [key for key in keys if key in self._queries and self._queries[key].payload is None]
+        for key in missing:
+            # Reenviar um erro já conhecido também para este stream
+            self._queries[key].error = None
+        if missing:
+            await self.refresh(missing)
+        for key in keys:
+            live = self._queries.get(key)
+            if live and live.payload is not None and key not in missing:
+                self._put(queue, [_frame(widget_id, live.payload) for widget_id in live.subscribers.get(queue, [])])
+
+    async def _compute_one(self, live: LiveQuery) -> Any:
+        """Result of one query, or the exception it raised"""
+        try:
+            if live.kind == "query":
+                with statement_timeout(settings.DB_TIMEOUT_QUERY_MS):
+                    return await analytics_service.execute_query(AnalyticsQueryRequest(**live.data))
+            with statement_timeout(settings.DB_TIMEOUT_KPIS_MS):
+                return await analytics_service.get_kpi_dashboard(
+                    live.data.get("start_date"), live.data.get("end_date"), live.data.get("filters") or {},
+                    live.data.get("hours")
+                )
+        except Exception as e:
+            return e
+
+    async def _compute(self, targets: List[Tuple[str, LiveQuery]]) -> Dict[str, Any]:
+        """Results per key; a failed query maps to its exception instead of failing the tick"""
+        results: Dict[str, Any] = {}
+        queries = [(key, live) for key, live in targets if live.kind == "query"]
+        individual = [(key, live) for key, live in targets if live.kind == "kpis"]
+        if queries:
+            try:
+                # Requests novos a cada tick: execute_batch normaliza as datas in place
+                with statement_timeout(settings.DB_TIMEOUT_QUERY_MS):
+                    responses = await analytics_service.execute_batch(
+                        [AnalyticsQueryRequest(**live.data) for _, live in queries]
+                    )
+                results.update({key: response for (key, _), response in zip(queries, responses)})
+            except Exception as e:
+                # Uma query com erro derruba o lote: recalcular uma a uma para isolar a que falhou
+                logger.warning(f"⚠️ Live batch failed, computing its queries one by one: {e}")
+                individual += queries
+        if individual:
+            computed = await asyncio.gather(*[self._compute_one(live) for _, live in individual])
+            results.update({key: result for (key, _), result in zip(individual, computed)})
+        self.computed += len(targets)
+        return results
+
+    async def refresh(self, keys: Optional[List[str]] = None):
+        """Recompute the subscribed queries (or only `keys`) and push the ones that changed"""
+        async with self._lock:
+            targets = [
+                (key, self._queries[key]) for key in (keys if keys is not None else list(self._queries))
+                if key in self._queries
+            ]
+            if not targets:
+                return
+            results = await self._compute(targets)
+
+            for key, live in targets:
+                result = results[key]
+                if isinstance(result, Exception):
+                    self.failures += 1
+                    detail = str(result) or type(result).__name__
+                    # Mantém o último resultado; o erro só é enviado quando muda
+                    if detail != live.error:
+                        live.error = detail
+                        logger.warning(f"⚠️ Live query failed: {detail}")
+                        for queue, widget_ids in list(live.subscribers.items()):
+                            self._put(queue, [_error_frame(widget_id, detail) for widget_id in widget_ids])
+                    continue
+                live.error = None
+                # Só os dados entram na comparação (metadata muda a cada execução)
+                content = result.data if live.kind == "query" else [kpi.model_dump() for kpi in result.kpis]
+                fingerprint = hashlib.sha1(json_dumps(content)).hexdigest()
+                if fingerprint == live.fingerprint:
+                    continue
+                live.fingerprint = fingerprint
+                live.payload = json_dumps(result.model_dump(mode="json"))
+                for queue, widget_ids in list(live.subscribers.items()):
+                    self._put(queue, [_frame(widget_id, live.payload) for widget_id in widget_ids])
+
+    def _put(self, queue: asyncio.Queue, frames: List[bytes]):
+        for frame in frames:
+            try:
+                queue.put_nowait(frame)
+                self.events += 1
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        streams: Set[asyncio.Queue] = set()
+        for live in self._queries.values():
+            streams.update(live.subscribers)
+        return {
+            "interval_seconds": settings.LIVE_REFRESH_INTERVAL,
+            "distinct_queries": len(self._queries),
+            "streams": len(streams),
+            "ticks": self.ticks,
+            "computed": self.computed,
+            "events": self.events,
+            "failures": self.failures,
+        }
+
+
+# Instância global
+live_hub = LiveHub()
@@ -0,0 +1,76 @@
+"""
+Opaque continuation tokens for keyset (cursor) pagination
+
+A cursor carries the sort key of the last row of a page plus a scope hash of
+the query it belongs to, so the next page starts right after that row
+(`WHERE key > last`) instead of skipping OFFSET rows. Clients treat it as an
+opaque string.
+"""
+import base64
+import hashlib
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, List
+
+
+class InvalidCursor(ValueError):
+    """Malformed cursor, or cursor issued for a different query / sort"""
+
+
+def cursor_scope(data: Any) -> str:
+    """Short hash identifying a query shape (filters, sort...) a cursor is valid for"""
+    raw = json.dumps(data, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def _encode_value(value: Any) -> Any:
+    # Tipos que o JSON não preserva vão marcados, para voltar como parâmetro do mesmo tipo
+    if isinstance(value, Decimal):
+        return {"n": str(value)}
+    if isinstance(value, datetime):
+        return {"t": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if hasattr(value, "item"):  # escalares numpy
+        return value.item()
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "n" in value:
+            return Decimal(value["n"])
+        if "t" in value:
+            return datetime.fromisoformat(value["t"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        raise InvalidCursor("Invalid cursor")
+    return value
+
+
+def encode_cursor(values: List[Any], scope: str) -> str:
+    """Token for the page after the row whose sort key is `values`"""
+    raw = json.dumps({"s": scope, "k": [_encode_value(v) for v in values]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, scope: str) -> List[Any]:
+    """
+    Sort key stored in a cursor
+
+    Raises:
+        InvalidCursor: malformed token or issued for another scope
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        values = [_decode_value(v) for v in payload["k"]]
+    except InvalidCursor:
+        raise
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+    if payload.get("s") != scope:
+        raise InvalidCursor("Cursor does not match this query (filters or sort changed)")
+    return values
@@ -0,0 +1,268 @@
+"""
+Aggregate-aware Query Router
+Redireciona queries do /query para as tabelas de resumo (app/db/summaries.py)
+e materialized views de create_views.py quando métricas, dimensões e filtros podem ser respondidos a partir delas
+"""
+from typing import Dict, List, Optional, Set, Tuple
+import logging
+
+from app.db.database import db
+from app.config import settings
+from app.models.schemas import AnalyticsQueryRequest
+from app.services.sql_builder import build_filter_conditions, build_order_limit_clauses
+
+logger = logging.getLogger(__name__)
+
+
+class AggregateView:
+    """
+    Capabilities of one pre-aggregated relation
+
+    dimensions: request dimension -> (SQL expression, columns used)
+    metrics: request metric -> (re-aggregation expression, columns used, requires_any)
+        requires_any lists dimensions of which at least one must be grouped for the
+        re-aggregation to be exact (empty = always exact)
+    requires_any: dimensions of which at least one must be present for the view's
+        row filters to match the raw query semantics
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dimensions: Dict[str, Tuple[str, Set[str]]],
+        metrics: Dict[str, Tuple[str, Set[str], Set[str]]],
+        requires_any: Optional[Set[str]] = None
+    ):
+        self.name = name
+        self.dimensions = dimensions
+        self.metrics = metrics
+        self.requires_any = requires_any or set()
+
+
+# Time dimensions derivable from a data_venda column
+_DATE_DIMENSIONS = {
+    "data": ("data_venda", {"data_venda"}),
+    "semana": ("TO_CHAR(data_venda, 'IYYY-IW')", {"data_venda"}),
+    "mes": ("TO_CHAR(data_venda, 'YYYY-MM')", {"data_venda"}),
+}
+
+_CHANNEL_DIMENSIONS = {
+    "channel": ("channel_name", {"channel_name"}),
+    "canal_venda": ("channel_name", {"channel_name"}),
+    "channel_id": ("channel_id", {"channel_id"}),
+}
+
+_PRODUCT_DIMENSIONS = {"produto", "nome_produto"}
+
+
+# Ordered from the most to the least selective view. Only metrics whose
+# re-aggregation gives exactly the raw-table result are declared here:
+# COUNT(DISTINCT customer_id) and percentiles can't be rebuilt from buckets,
+# so requests using them always fall back to the raw tables.
+AGGREGATE_VIEWS = [
+    AggregateView(
+        name="vendas_agregadas",
+        dimensions={
+            **_DATE_DIMENSIONS,
+            **_CHANNEL_DIMENSIONS,
+            "store": ("store_name", {"store_name"}),
+            "nome_loja": ("store_name", {"store_name"}),
+            "store_id": ("store_id", {"store_id"}),
+            "hora": ("hora", {"hora"}),
+            "dia_semana": ("dia_semana", {"dia_semana"}),
+            "periodo_dia": ("periodo_dia", {"periodo_dia"}),
+        },
+        metrics={
+            "faturamento": ("SUM(faturamento)", {"faturamento"}, set()),
+            "qtd_vendas": ("SUM(qtd_vendas)", {"qtd_vendas"}, set()),
+            # AVG(total_amount) = SUM / COUNT sobre os buckets
+            "ticket_medio": (
+                "SUM(faturamento) / NULLIF(SUM(qtd_vendas), 0)",
+                {"faturamento", "qtd_vendas"},
+                set()
+            ),
+            "valor_total_desconto": ("SUM(total_descontos)", {"total_descontos"}, set()),
+            "tempo_medio_entrega": (
+                "SUM(soma_entrega_seg) / 60.0 / NULLIF(SUM(qtd_entregas), 0)",
+                {"soma_entrega_seg", "qtd_entregas"},
+                set()
+            ),
+            "tempo_medio_preparo": (
+                "SUM(soma_preparo_seg) / 60.0 / NULLIF(SUM(qtd_preparos), 0)",
+                {"soma_preparo_seg", "qtd_preparos"},
+                set()
+            ),
+        },
+    ),
+    AggregateView(
+        name="produtos_analytics",
+        dimensions={
+            **_DATE_DIMENSIONS,
+            **_CHANNEL_DIMENSIONS,
+            "produto": ("produto_nome", {"produto_nome"}),
+            "nome_produto": ("produto_nome", {"produto_nome"}),
+            "categoria": ("categoria", {"categoria"}),
+            "dia_semana": ("dia_semana", {"dia_semana"}),
+            "periodo_dia": ("periodo_dia", {"periodo_dia"}),
+        },
+        # faturamento não é roteado: no raw é SUM(s.total_amount) por linha de
+        # produto, enquanto a view guarda SUM(ps.total_price)
+        metrics={
+            "qtd_produtos": ("SUM(quantidade_vendida)", {"quantidade_vendida"}, set()),
+            # Uma venda com vários produtos da mesma categoria seria contada
+            # mais de uma vez: só é exato agrupando por produto
+            "qtd_vendas": ("SUM(num_vendas)", {"num_vendas"}, _PRODUCT_DIMENSIONS),
+        },
+        requires_any=_PRODUCT_DIMENSIONS | {"categoria"},
+    ),
+    AggregateView(
+        name="delivery_metrics",
+        dimensions={
+            **_DATE_DIMENSIONS,
+            **_CHANNEL_DIMENSIONS,
+            "bairro": ("bairro", {"bairro"}),
+            "cidade": ("cidade", {"cidade"}),
+        },
+        metrics={
+            # Média ponderada pelo número de entregas de cada bucket
+            "tempo_medio_entrega": (
+                "SUM(tempo_medio_entrega_min * total_entregas) / NULLIF(SUM(total_entregas), 0)",
+                {"tempo_medio_entrega_min", "total_entregas"},
+                set()
+            ),
+        },
+        # A view só contém vendas com endereço: equivale ao raw apenas
+        # quando a query agrupa por bairro/cidade
+        requires_any={"bairro", "cidade"},
+    ),
+]
+
+
+class QueryRouter:
+    """Rewrites analytics requests against pre-aggregated views when possible"""
+
+    def __init__(self, views: List[AggregateView]):
+        self.views = views
+        # relation name -> available columns (None until the catalog is loaded)
+        self.catalog: Optional[Dict[str, Set[str]]] = None
+
+    async def load_catalog(self):
+        """Discover which aggregate relations (and columns) exist in the database"""
+        query = """
+        SELECT c.relname, a.attname
+        FROM pg_class c
+        JOIN pg_attribute a ON a.attrelid = c.oid
+        WHERE c.relname = ANY(%s)
+          AND c.relkind IN ('r', 'm', 'v', 'p')
+          AND a.attnum > 0
+          AND NOT a.attisdropped
+        """
+        try:
+            rows = await db.fetch_all(query, [view.name for view in self.views])
+        except Exception as e:
+            logger.warning(f"⚠️ Query router disabled, could not load catalog: {e}")
+            self.catalog = None
+            return
+
+        catalog: Dict[str, Set[str]] = {}
+        for row in rows:
+            catalog.setdefault(row['relname'], set()).add(row['attname'])
+        self.catalog = catalog
+        logger.info(f"✓ Query router loaded aggregate views: {sorted(catalog) or 'none'}")
+
+    def route(self, request: AnalyticsQueryRequest) -> Optional[Tuple[str, list, str]]:
+        """
+        Try to answer the request from an aggregate view
+
+        Returns:
+            (query, params, relation name) or None when the raw tables are needed
+        """
+        if not settings.QUERY_ROUTER_ENABLED or not self.catalog:
+            return None
+
+        for view in self.views:
+            columns = self.catalog.get(view.name)
+            if columns and self._can_answer(view, columns, request):
+                query, params = self._build_view_query(view, request)
+                logger.debug(f"🔀 Query routed to {view.name}")
+                return query, params, view.name
+
+        return None
+
+    def _can_answer(self, view: AggregateView, columns: Set[str], request: AnalyticsQueryRequest) -> bool:
+        """Check whether the view holds every metric, dimension and filter of the request"""
+        if not request.metrics and not request.dimensions:
+            return False
+
+        dimensions = set(request.dimensions)
+        needed_columns: Set[str] = {"data_venda"} if request.date_range else set()
+
+        if view.requires_any and not dimensions & view.requires_any:
+            return False
+
+        for metric in request.metrics:
+            if metric not in view.metrics:
+                return False
+            _, metric_columns, requires_any = view.metrics[metric]
+            if requires_any and not dimensions & requires_any:
+                return False
+            needed_columns |= metric_columns
+
+        for field in list(request.dimensions) + list(request.filters.keys()):
+            if field not in view.dimensions:
+                return False
+            needed_columns |= view.dimensions[field][1]
+
+        return needed_columns <= columns
+
+    def _build_view_query(self, view: AggregateView, request: AnalyticsQueryRequest) -> Tuple[str, list]:
+        """Build the SQL against the view, mirroring AnalyticsService._build_query"""
+        params = []
+
+        select_parts = []
+        for dim in request.dimensions:
+            select_parts.append(f"{view.dimensions[dim][0]} as {dim}")
+        for metric in request.metrics:
+            select_parts.append(f"{view.metrics[metric][0]} as {metric}")
+        select_clause = ",\n    ".join(select_parts)
+
+        where_conditions = []
+        if request.date_range:
+            if request.date_range.start_date:
+                params.append(request.date_range.start_date)
+                where_conditions.append("data_venda >= %s")
+            if request.date_range.end_date:
+                params.append(request.date_range.end_date)
+                where_conditions.append("data_venda <= %s")
+
+        for field, filter_value in request.filters.items():
+            field_expr = view.dimensions[field][0]
+            where_conditions.extend(build_filter_conditions(field_expr, filter_value, params))
+
+        where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
+
+        group_by_clause = ""
+        if request.dimensions:
+            positions = [str(i) for i in range(1, len(request.dimensions) + 1)]
+            group_by_clause = f"GROUP BY {', '.join(positions)}"
+
+        order_by_clause, limit_clause, offset_clause = build_order_limit_clauses(
+            request.order_by, request.limit, request.offset, params
+        )
+
+        query = f"""
+SELECT
+    {select_clause}
+FROM {view.name}
+{where_clause}
+{group_by_clause}
+{order_by_clause}
+{limit_clause}
+{offset_clause}
+        """.strip()
+
+        return query, params
+
+
+# Global router instance
+query_router = QueryRouter(AGGREGATE_VIEWS)
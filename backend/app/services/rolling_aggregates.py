@@ -0,0 +1,465 @@
+"""
+Rolling in-memory aggregates for recent KPIs ("today", "last N hours")
+
+Every ROLLING_POLL_INTERVAL seconds each worker reads the completed sales
+inserted after its watermark (sales.id) and adds them to per-minute, per-hour
+and per-day buckets, per (store, channel) plus an all-stores total. The KPI
+cards of a date range inside the last ROLLING_DAYS days, or of the last N
+hours (N <= ROLLING_WINDOW_HOURS), are then summed from a handful of buckets
+instead of scanning sales. Unique customers use a HyperLogLog sketch per
+bucket (mergeable, ~2% error) instead of COUNT(DISTINCT).
+
+The id watermark misses sales whose status changes after they were read and
+rows committed late with a lower id, so the buckets are rebuilt from sales
+every ROLLING_REBUILD_INTERVAL seconds (same caveat as customer_state).
+"""
+import asyncio
+import logging
+import math
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from app.config import settings
+from app.db.database import db, use_lane, HEAVY
+
+logger = logging.getLogger(__name__)
+
+# HyperLogLog: 2^11 registradores (erro padrão ~1.04/sqrt(m) = 2.3%)
+HLL_PRECISION = 11
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+# Esparso (dict) até m/8 registradores ocupados: buckets por minuto têm poucos clientes
+HLL_SPARSE_LIMIT = HLL_REGISTERS // 8
+MASK_64 = (1 << 64) - 1
+# Bit alto de cada registrador (1 byte por registrador, ranks < 128)
+HLL_LANE_HIGH = int.from_bytes(b"\x80" * HLL_REGISTERS, "big")
+
+MINUTE, HOUR, DAY = "minute", "hour", "day"
+GRANULARITIES = (MINUTE, HOUR, DAY)
+
+# Série com todas as lojas e canais (consultas sem filtro)
+ALL = None
+
+INGEST_COLUMNS = """
+    id, created_at, store_id, channel_id, customer_id, total_amount::float8,
+    delivery_seconds::float8, production_seconds::float8
+"""
+
+POLL_QUERY = f"""
+SELECT {INGEST_COLUMNS}
+FROM sales
+WHERE id > %s AND created_at >= %s AND sale_status_desc = 'COMPLETED'
+ORDER BY id
+LIMIT %s
+"""
+
+REBUILD_QUERY = f"""
+SELECT {INGEST_COLUMNS}
+FROM sales
+WHERE id > %s AND id <= %s AND created_at >= %s AND sale_status_desc = 'COMPLETED'
+ORDER BY id
+LIMIT %s
+"""
+
+
+def _hash64(value: int) -> int:
+    """splitmix64: spreads sequential ids over all 64 bits"""
+    value = (value + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+
+def _max_registers(a: bytes, b: bytes) -> bytearray:
+    """Register-wise max of two dense sketches, on whole ints (SWAR) instead of per byte"""
+    x = int.from_bytes(a, "big")
+    y = int.from_bytes(b, "big")
+    # Por byte: (x + 128 - y) tem o bit alto ligado sse x >= y, sem empréstimo entre bytes
+    mask = ((((x | HLL_LANE_HIGH) - y) & HLL_LANE_HIGH) >> 7) * 0xFF
+    return bytearray(((x & mask) | (y & ~mask)).to_bytes(HLL_REGISTERS, "big"))
+
+
+class HyperLogLog:
+    """Distinct-count sketch; sparse until enough registers are set"""
+
+    __slots__ = ("registers",)
+
+    def __init__(self):
+        self.registers: Union[Dict[int, int], bytearray] = {}
+
+    def add(self, value: int):
+        hashed = _hash64(value)
+        index = hashed >> (64 - HLL_PRECISION)
+        rest = hashed & ((1 << (64 - HLL_PRECISION)) - 1)
+        self._set(index, 64 - HLL_PRECISION - rest.bit_length() + 1)
+
+    def _set(self, index: int, rank: int):
+        registers = self.registers
+        if isinstance(registers, bytearray):
+            if rank > registers[index]:
+                registers[index] = rank
+        elif rank > registers.get(index, 0):
+            registers[index] = rank
+            if len(registers) > HLL_SPARSE_LIMIT:
+                self._densify()
+
+    def _densify(self):
+        dense = bytearray(HLL_REGISTERS)
+        for index, rank in self.registers.items():
+            dense[index] = rank
+        self.registers = dense
+
+    def merge(self, other: "HyperLogLog"):
+        if isinstance(other.registers, dict):
+            for index, rank in other.registers.items():
+                self._set(index, rank)
+            return
+        if isinstance(self.registers, dict):
+            sparse = self.registers
+            self.registers = bytearray(other.registers)
+            for index, rank in sparse.items():
+                self._set(index, rank)
+        else:
+            self.registers = _max_registers(self.registers, other.registers)
+
+    def estimate(self) -> int:
+        registers = self.registers
+        if isinstance(registers, dict):
+            zeros = HLL_REGISTERS - len(registers)
+            total = zeros + sum(2.0 ** -rank for rank in registers.values())
+        else:
+            zeros = registers.count(0)
+            # Por valor de rank (poucos distintos) em vez de por registrador
+            total = sum(registers.count(rank) * 2.0 ** -rank for rank in set(registers))
+        estimate = HLL_ALPHA * HLL_REGISTERS * HLL_REGISTERS / total
+        # Linear counting para cardinalidades pequenas
+        if estimate <= 2.5 * HLL_REGISTERS and zeros:
+            estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+        return int(round(estimate))
+
+
+class Bucket:
+    """Sums behind the KPI cards for one period of one series"""
+
+    __slots__ = (
+        "revenue", "revenue_n", "sales", "delivery_sum", "delivery_n",
+        "production_sum", "production_n", "customers"
+    )
+
+    def __init__(self):
+        self.revenue = 0.0
+        self.revenue_n = 0
+        self.sales = 0
+        self.delivery_sum = 0.0
+        self.delivery_n = 0
+        self.production_sum = 0.0
+        self.production_n = 0
+        self.customers = HyperLogLog()
+
+    def add(self, customer_id, amount, delivery_seconds, production_seconds):
+        self.sales += 1
+        if amount is not None:
+            self.revenue += amount
+            self.revenue_n += 1
+        if delivery_seconds is not None:
+            self.delivery_sum += delivery_seconds
+            self.delivery_n += 1
+        if production_seconds is not None:
+            self.production_sum += production_seconds
+            self.production_n += 1
+        if customer_id is not None:
+            self.customers.add(customer_id)
+
+    def merge(self, other: "Bucket"):
+        self.revenue += other.revenue
+        self.revenue_n += other.revenue_n
+        self.sales += other.sales
+        self.delivery_sum += other.delivery_sum
+        self.delivery_n += other.delivery_n
+        self.production_sum += other.production_sum
+        self.production_n += other.production_n
+        self.customers.merge(other.customers)
+
+    def kpi_row(self) -> Dict[str, Any]:
+        """Same columns as AnalyticsService._build_kpi_query"""
+        return {
+            "faturamento_total": self.revenue if self.revenue_n else None,
+            "ticket_medio": self.revenue / self.revenue_n if self.revenue_n else None,
+            "total_vendas": self.sales,
+            "clientes_unicos": self.customers.estimate(),
+            "tempo_medio_entrega_min": self.delivery_sum / self.delivery_n / 60.0 if self.delivery_n else None,
+            "tempo_medio_preparo_min": self.production_sum / self.production_n / 60.0 if self.production_n else None,
+        }
+
+
+SeriesKey = Optional[Tuple[Any, Any]]
+
+
+def _floor(moment: datetime, granularity: str) -> datetime:
+    if granularity == MINUTE:
+        return moment.replace(second=0, microsecond=0)
+    if granularity == HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class RollingState:
+    """Buckets of one build (swapped as a whole on rebuild)"""
+
+    def __init__(self, store_ids: Dict[str, Set[int]], channel_ids: Dict[str, Set[int]]):
+        self.buckets: Dict[str, Dict[datetime, Dict[SeriesKey, Bucket]]] = {g: {} for g in GRANULARITIES}
+        self.store_ids = store_ids
+        self.channel_ids = channel_ids
+        self.watermark = 0
+        self.sales = 0
+
+    def ingest(self, rows: Iterable[tuple], horizons: Dict[str, datetime]):
+        for sale_id, created_at, store_id, channel_id, customer_id, amount, delivery, production in rows:
+            self.watermark = max(self.watermark, sale_id)
+            self.sales += 1
+            for granularity in GRANULARITIES:
+                start = _floor(created_at, granularity)
+                if start < horizons[granularity]:
+                    continue
+                series = self.buckets[granularity].setdefault(start, {})
+                for key in (ALL, (store_id, channel_id)):
+                    bucket = series.get(key)
+                    if bucket is None:
+                        bucket = series[key] = Bucket()
+                    bucket.add(customer_id, amount, delivery, production)
+
+    def prune(self, horizons: Dict[str, datetime]):
+        for granularity in GRANULARITIES:
+            buckets = self.buckets[granularity]
+            for start in [start for start in buckets if start < horizons[granularity]]:
+                del buckets[start]
+
+    def series_filter(self, filters: Dict[str, Any]) -> Optional[Tuple[Optional[Set], Optional[Set]]]:
+        """(store ids, channel ids) of the filters; None if a name is unknown"""
+        selected = []
+        for name, ids_by_name in (("nome_loja", self.store_ids), ("canal_venda", self.channel_ids)):
+            names = filters.get(name)
+            if not names:
+                selected.append(None)
+                continue
+            if any(value not in ids_by_name for value in names):
+                # Loja/canal criado depois do último rebuild
+                return None
+            selected.append(set().union(*(ids_by_name[value] for value in names)))
+        return selected[0], selected[1]
+
+    def total(
+        self,
+        spans: List[Tuple[str, datetime, Optional[datetime]]],
+        stores: Optional[Set],
+        channels: Optional[Set]
+    ) -> Bucket:
+        """Merge the buckets of each (granularity, start, end) span"""
+        result = Bucket()
+        for granularity, start, end in spans:
+            for bucket_start, series in self.buckets[granularity].items():
+                if bucket_start < start or (end is not None and bucket_start >= end):
+                    continue
+                if stores is None and channels is None:
+                    bucket = series.get(ALL)
+                    if bucket is not None:
+                        result.merge(bucket)
+                    continue
+                for key, bucket in series.items():
+                    if key is ALL:
+                        continue
+                    if (stores is None or key[0] in stores) and (channels is None or key[1] in channels):
+                        result.merge(bucket)
+        return result
+
+
+class RollingAggregates:
+    """Keeps the buckets up to date and answers recent KPI requests from them"""
+
+    def __init__(self):
+        self._state: Optional[RollingState] = None
+        self._task: Optional[asyncio.Task] = None
+        # Relógio do banco (LOCALTIMESTAMP) na última leitura, avançado pelo monotonic
+        self._db_now: Optional[datetime] = None
+        self._clock_at = 0.0
+        self._built_at = 0.0
+        self._polled_at = 0.0
+        self.rebuilds = 0
+        self.polls = 0
+        self.failures = 0
+        self.answered = 0
+        self.last_rebuild_ms: Optional[float] = None
+
+    def start(self):
+        if self._task is None and settings.ROLLING_POLL_INTERVAL > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self._state is None or time.monotonic() - self._built_at >= settings.ROLLING_REBUILD_INTERVAL:
+                    await self.rebuild()
+                else:
+                    await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"⚠️ Rolling aggregates update failed: {e}")
+            await asyncio.sleep(settings.ROLLING_POLL_INTERVAL)
+
+    def now(self) -> datetime:
+        return self._db_now + timedelta(seconds=time.monotonic() - self._clock_at)
+
+    async def _sync_clock(self):
+        row = await db.fetch_one("SELECT LOCALTIMESTAMP AS now")
+        self._db_now, self._clock_at = row['now'], time.monotonic()
+
+    def _horizons(self) -> Dict[str, datetime]:
+        """Oldest bucket start kept per granularity"""
+        window_start = _floor(self.now(), MINUTE) - timedelta(hours=settings.ROLLING_WINDOW_HOURS)
+        return {
+            MINUTE: window_start,
+            HOUR: _floor(window_start, HOUR),
+            DAY: _floor(self.now(), DAY) - timedelta(days=settings.ROLLING_DAYS - 1),
+        }
+
+    @use_lane(HEAVY)
+    async def rebuild(self):
+        """Recompute every bucket from sales and swap them in"""
+        start = time.time()
+        await self._sync_clock()
+        horizons = self._horizons()
+        oldest = min(horizons.values())
+
+        store_ids: Dict[str, Set[int]] = {}
+        channel_ids: Dict[str, Set[int]] = {}
+        for table, ids_by_name in (("stores", store_ids), ("channels", channel_ids)):
+            for row_id, name in (await db.fetch_tuples(f"SELECT id, name FROM {table}"))[1]:
+                ids_by_name.setdefault(name, set()).add(row_id)
+        state = RollingState(store_ids, channel_ids)
+
+        bounds = await db.fetch_one(
+            "SELECT (SELECT MAX(id) FROM sales) AS top, "
+            "(SELECT MIN(id) FROM sales WHERE created_at >= %s) AS first",
+            oldest
+        )
+        top = bounds['top'] or 0
+        since = (bounds['first'] or top + 1) - 1
+        while since < top:
+            columns, rows = await db.fetch_tuples(
+                REBUILD_QUERY, since, top, oldest, settings.ROLLING_BATCH_SIZE
+            )
+            if not rows:
+                break
+            state.ingest(rows, horizons)
+            since = rows[-1][0]
+            # Libera o event loop entre lotes
+            await asyncio.sleep(0)
+        state.watermark = max(state.watermark, top)
+
+        self._state = state
+        self._built_at = self._polled_at = time.monotonic()
+        self.rebuilds += 1
+        self.last_rebuild_ms = round((time.time() - start) * 1000, 2)
+        logger.info(
+            f"📈 Rolling aggregates rebuilt: {state.sales} sales since {oldest} ({self.last_rebuild_ms}ms)"
+        )
+
+    async def poll(self):
+        """Add the sales inserted since the watermark"""
+        state = self._state
+        await self._sync_clock()
+        horizons = self._horizons()
+        while True:
+            columns, rows = await db.fetch_tuples(
+                POLL_QUERY, state.watermark, min(horizons.values()), settings.ROLLING_BATCH_SIZE
+            )
+            state.ingest(rows, horizons)
+            if len(rows) < settings.ROLLING_BATCH_SIZE:
+                break
+            await asyncio.sleep(0)
+        state.prune(horizons)
+        self._polled_at = time.monotonic()
+        self.polls += 1
+
+    def _is_current(self) -> bool:
+        # Sem leituras recentes (banco fora, loop parado) as consultas voltam ao SQL
+        return (
+            self._state is not None
+            and time.monotonic() - self._polled_at < max(3 * settings.ROLLING_POLL_INTERVAL, 30.0)
+        )
+
+    def kpi_row(
+        self,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        hours: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        KPI values of a request when the buckets cover it, None otherwise
+
+        Covered: `hours` up to ROLLING_WINDOW_HOURS (window starting at the
+        current minute minus `hours`), or a date range starting within the last
+        ROLLING_DAYS days; filters on store and channel only.
+        """
+        filters = filters or {}
+        if not self._is_current() or filters.get('nome_produto'):
+            return None
+        state = self._state
+        selected = state.series_filter(filters)
+        if selected is None:
+            return None
+
+        if hours is not None:
+            # Janela combinada com datas, ou maior que a retida: fica com o SQL
+            if start_date is not None or end_date is not None or hours > settings.ROLLING_WINDOW_HOURS:
+                return None
+            window_start = _floor(self.now(), MINUTE) - timedelta(hours=hours)
+            first_hour = _floor(window_start, HOUR)
+            if first_hour < window_start:
+                first_hour += timedelta(hours=1)
+            # Minutos até a primeira hora cheia, depois horas (abertas no fim)
+            spans = [(MINUTE, window_start, first_hour), (HOUR, first_hour, None)]
+        else:
+            if start_date is None:
+                return None
+            first_day = datetime.combine(start_date, datetime.min.time())
+            if first_day < self._horizons()[DAY]:
+                return None
+            last_day = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1) if end_date else None
+            spans = [(DAY, first_day, last_day)]
+
+        self.answered += 1
+        return state.total(spans, *selected).kpi_row()
+
+    def stats(self) -> Dict[str, Any]:
+        state = self._state
+        return {
+            "poll_interval_seconds": settings.ROLLING_POLL_INTERVAL,
+            "current": self._is_current(),
+            "watermark": state.watermark if state else None,
+            "sales": state.sales if state else 0,
+            "buckets": {g: len(state.buckets[g]) for g in GRANULARITIES} if state else {},
+            "rebuilds": self.rebuilds,
+            "polls": self.polls,
+            "failures": self.failures,
+            "answered": self.answered,
+            "last_rebuild_ms": self.last_rebuild_ms,
+            "seconds_since_poll": round(time.monotonic() - self._polled_at, 1) if state else None,
+        }
+
+
+# Instância global
+rolling_aggregates = RollingAggregates()
@@ -0,0 +1,159 @@
+"""
+SQL fragment helpers shared by the analytics query builders
+"""
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Mapping of filter operators to SQL comparison operators
+COMPARISON_OPERATORS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def build_filter_conditions(field_expr: str, filter_value: Any, params: list) -> List[str]:
+    """
+    Translate a request filter into parameterized WHERE conditions
+
+    Lists are passed as a single array parameter (`= ANY(%s)`) instead of one
+    placeholder per value, so the SQL text (and the prepared statement) is the
+    same whatever the list length.
+
+    Args:
+        field_expr: SQL expression the filter applies to
+        filter_value: Raw filter value ({operator: value}, list or scalar)
+        params: Parameter list, extended in place with the filter values
+
+    Returns:
+        List of SQL conditions (to be joined with AND)
+    """
+    conditions = []
+
+    if isinstance(filter_value, dict):
+        # Complex filter with operator
+        for operator, value in filter_value.items():
+            if operator == "eq":
+                params.append(value)
+                conditions.append(f"{field_expr} = %s")
+            elif operator == "in" and isinstance(value, list):
+                params.append(list(value))
+                conditions.append(f"{field_expr} = ANY(%s)")
+            elif operator in COMPARISON_OPERATORS:
+                params.append(value)
+                conditions.append(f"{field_expr} {COMPARISON_OPERATORS[operator]} %s")
+    else:
+        # Simple equality filter (list = ANY(array), single value = equality)
+        if isinstance(filter_value, list):
+            params.append(list(filter_value))
+            conditions.append(f"{field_expr} = ANY(%s)")
+        else:
+            params.append(filter_value)
+            conditions.append(f"{field_expr} = %s")
+
+    return conditions
+
+
+def build_date_range_conditions(
+    column: str,
+    start_date: Optional[date],
+    end_date: Optional[date],
+    params: list
+) -> List[str]:
+    """
+    Build sargable half-open date range conditions on a timestamp column
+    
+    `column >= start AND column < end + 1 day` selects the same rows as
+    `DATE(column) BETWEEN start AND end`, but lets Postgres use btree
+    indexes on the column and prune range partitions.
+    """
+    conditions = []
+    if start_date:
+        params.append(start_date)
+        conditions.append(f"{column} >= %s")
+    if end_date:
+        params.append(end_date + timedelta(days=1))
+        conditions.append(f"{column} < %s")
+    return conditions
+
+
+def build_order_limit_clauses(
+    order_by: Optional[List[Dict[str, str]]],
+    limit: Optional[int],
+    offset: Optional[int],
+    params: Optional[list] = None
+) -> tuple[str, str, str]:
+    """
+    Build ORDER BY, LIMIT and OFFSET clauses from request fields
+
+    When `params` is given, LIMIT/OFFSET values are appended to it as
+    parameters (the clauses must then come after every other placeholder),
+    so pages of the same query share one statement shape.
+    """
+    order_by_clause = ""
+    if order_by:
+        order_parts = []
+        for order_spec in order_by:
+            field = order_spec.get("field")
+            direction = order_spec.get("direction", "desc").upper()
+            order_parts.append(f"{field} {direction}")
+        order_by_clause = "ORDER BY " + ", ".join(order_parts)
+    
+    if params is None:
+        limit_clause = f"LIMIT {limit}" if limit else ""
+        offset_clause = f"OFFSET {offset}" if offset else ""
+        return order_by_clause, limit_clause, offset_clause
+    
+    limit_clause = offset_clause = ""
+    if limit:
+        params.append(limit)
+        limit_clause = "LIMIT %s"
+    if offset:
+        params.append(offset)
+        offset_clause = "OFFSET %s"
+    
+    return order_by_clause, limit_clause, offset_clause
+
+
+def build_keyset_condition(
+    sort_keys: List[Tuple[str, str]],
+    values: List[Any],
+    params: list
+) -> str:
+    """
+    WHERE condition selecting the rows that come after `values` in sort order
+
+    Expanded form `(a after x) OR (a = x AND b after y) OR ...` so columns
+    may mix directions. NULLs follow Postgres defaults (last in ASC, first in
+    DESC), so the condition matches a plain ORDER BY on the same keys.
+
+    Args:
+        sort_keys: (column, 'asc' | 'desc') pairs - must be a total order
+        values: Sort key of the last row of the previous page
+        params: Parameter list, extended in place
+    """
+    terms = []
+    for i, (column, direction) in enumerate(sort_keys):
+        parts = []
+        term_params = []
+        for (prev_column, _), prev_value in zip(sort_keys[:i], values[:i]):
+            if prev_value is None:
+                parts.append(f"{prev_column} IS NULL")
+            else:
+                parts.append(f"{prev_column} = %s")
+                term_params.append(prev_value)
+        
+        value = values[i]
+        if direction == "desc":
+            if value is None:
+                parts.append(f"{column} IS NOT NULL")
+            else:
+                parts.append(f"{column} < %s")
+                term_params.append(value)
+        else:
+            if value is None:
+                continue  # nada vem depois de NULL em ASC
+            parts.append(f"({column} > %s OR {column} IS NULL)")
+            term_params.append(value)
+        
+        terms.append("(" + " AND ".join(parts) + ")")
+        params.extend(term_params)
+    
+    return "(" + " OR ".join(terms) + ")" if terms else "FALSE"
@@ -0,0 +1,50 @@
+"""
+Benchmark do churn trend: tempo da query por número de períodos
+Roda a query diária sobre janelas crescentes; com a varredura linear o tempo
+por período deve ficar aproximadamente constante.
+"""
+import asyncio
+import sys
+import time
+from datetime import timedelta
+
+# Fix for Windows psycopg3
+if sys.platform == 'win32':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+from app.db.database import db
+from app.services.churn_service import churn_service
+
+SPANS_DAYS = [30, 90, 180, 365]
+RUNS = 3
+
+
+async def benchmark():
+    await db.connect()
+
+    row = await db.fetch_one("SELECT MAX(created_at::date) as max_date FROM sales")
+    end_date = row['max_date']
+
+    print("=" * 70)
+    print(f"CHURN TREND BENCHMARK (granularity=day, end={end_date})")
+    print("=" * 70)
+    print(f"{'periods':>8} {'best ms':>10} {'ms/period':>10}")
+
+    for span in SPANS_DAYS:
+        start_date = end_date - timedelta(days=span - 1)
+        query, params = churn_service._build_churn_trend_query(start_date, end_date, 'day')
+
+        timings = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            rows = await db.fetch_all(query, *params)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        best = min(timings)
+        print(f"{len(rows):>8} {best:>10.1f} {best / max(len(rows), 1):>10.2f}")
+
+    await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
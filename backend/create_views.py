@@ -53,7 +53,12 @@ async def create_materialized_views():
                 COUNT(DISTINCT s.customer_id) FILTER (WHERE s.customer_id IS NOT NULL) as clientes_unicos,
                 SUM(s.total_discount) as total_descontos,
                 AVG(s.production_seconds) FILTER (WHERE s.production_seconds IS NOT NULL) as tempo_medio_preparo_seg,
-                AVG(s.delivery_seconds) FILTER (WHERE s.delivery_seconds IS NOT NULL) as tempo_medio_entrega_seg
+                AVG(s.delivery_seconds) FILTER (WHERE s.delivery_seconds IS NOT NULL) as tempo_medio_entrega_seg,
+                -- Componentes aditivos para re-agregar médias no query router
+                SUM(s.production_seconds) as soma_preparo_seg,
+                COUNT(s.production_seconds) as qtd_preparos,
+                SUM(s.delivery_seconds) as soma_entrega_seg,
+                COUNT(s.delivery_seconds) as qtd_entregas
             FROM sales s
             JOIN stores st ON s.store_id = st.id
             JOIN channels ch ON s.channel_id = ch.id
@@ -195,8 +200,8 @@ async def create_materialized_views():
         print(f"  customer_rfm: {row[0]:,} rows")
         
         print()
-        print("⚡ To refresh views later, run:")
-        print("   REFRESH MATERIALIZED VIEW CONCURRENTLY vendas_agregadas;")
+        print("⚡ To keep the aggregates fresh incrementally, convert them once:")
+        print("   python -m app.db.summaries --init")
         print()
         
     except Exception as e:
@@ -0,0 +1,195 @@
+"""
+Check the churn trend query against a brute-force model of its definition
+
+For every period P of the series:
+- active: customers with a purchase in the range, in a period <= P
+- churned: active customers whose last purchase in a period <= P is more
+  than 30 days before the start of P (a customer who buys again stops
+  counting as churned)
+
+First runs the query over fixed fixtures in a temporary `sales` table (which
+shadows the real one inside the transaction): a customer who comes back, last
+purchases exactly 30 days / 30 days + 1 second before a period start, plus
+random customers. Then compares it with the model over the last 90 days of
+the real sales. Every granularity (day, week, month) is checked.
+"""
+import asyncio
+import random
+import sys
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+# Fix for Windows psycopg3
+if sys.platform == 'win32':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+from app.db.database import db
+from app.services.churn_service import churn_service
+
+GRANULARITIES = ['day', 'week', 'month']
+FIXTURE_START = date(2024, 1, 1)  # segunda-feira
+FIXTURE_END = date(2024, 6, 30)
+
+
+def trunc(day: date, granularity: str) -> date:
+    """Same as DATE_TRUNC (weeks start on Monday)"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_period(period: date, granularity: str) -> date:
+    if granularity == 'week':
+        return period + timedelta(days=7)
+    if granularity == 'month':
+        return (period.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return period + timedelta(days=1)
+
+
+def brute_force(purchases, start_date: date, end_date: date, granularity: str):
+    """(period, active, churned, churn_rate) per period, straight from the definition"""
+    in_range = [
+        (customer_id, created_at) for customer_id, created_at in purchases
+        if start_date <= created_at.date() <= end_date
+    ]
+    result = []
+    period = trunc(start_date, granularity)
+    while period <= trunc(end_date, granularity):
+        last_purchase = {}
+        for customer_id, created_at in in_range:
+            if trunc(created_at.date(), granularity) <= period:
+                last_purchase[customer_id] = max(created_at, last_purchase.get(customer_id, created_at))
+        period_start = datetime.combine(period, datetime.min.time())
+        active = len(last_purchase)
+        churned = sum(1 for last in last_purchase.values() if last < period_start - timedelta(days=30))
+        rate = round(Decimal(churned) / active * 100, 2) if active else Decimal(0)
+        result.append((period, active, churned, rate))
+        period = next_period(period, granularity)
+    return result
+
+
+def fixtures():
+    """(customer_id, created_at) of the hand-picked cases plus random customers"""
+    purchases = [
+        # 1: compra, some por mais de 30 dias e volta
+        (1, datetime(2024, 1, 2, 10)),
+        (1, datetime(2024, 3, 15, 18)),
+        # 2: compra uma vez só
+        (2, datetime(2024, 1, 10, 12)),
+        # 3 / 4: última compra exatamente 30 dias / 30 dias + 1s antes de 01/04 (início de mês)
+        (3, datetime(2024, 1, 5, 9)),
+        (3, datetime(2024, 3, 2)),
+        (4, datetime(2024, 1, 5, 9)),
+        (4, datetime(2024, 3, 1, 23, 59, 59)),
+        # 5 / 6: o mesmo para 08/04 (início de semana)
+        (5, datetime(2024, 3, 9)),
+        (6, datetime(2024, 3, 8, 23, 59, 59)),
+        # 7: volta dentro do próprio período em que viraria churned
+        (7, datetime(2024, 2, 1, 8)),
+        (7, datetime(2024, 3, 20, 8)),
+        # 8: compra toda semana, nunca churned
+        *[(8, datetime(2024, 1, 1, 12) + timedelta(days=7 * week)) for week in range(26)],
+        # 9: primeira compra fora do intervalo (ignorada)
+        (9, datetime(2023, 12, 20)),
+        (9, datetime(2024, 5, 10)),
+    ]
+    rng = random.Random(18)
+    for customer_id in range(100, 300):
+        for _ in range(rng.randint(1, 6)):
+            purchases.append((customer_id, datetime(2023, 12, 1) + timedelta(seconds=rng.randint(0, 220 * 86400))))
+    return purchases
+
+
+def check_model():
+    """Sanity check of the model itself on the returning customer and the 30-day boundary"""
+    purchases = fixtures()
+
+    def churned(customer_id: int, day: date) -> bool:
+        own = [purchase for purchase in purchases if purchase[0] == customer_id]
+        return brute_force(own, FIXTURE_START, day, 'day')[-1][2] == 1
+
+    assert churned(1, date(2024, 3, 14)) and not churned(1, date(2024, 3, 15))
+    assert not churned(3, date(2024, 4, 1)) and churned(4, date(2024, 4, 1))
+    assert not churned(5, date(2024, 4, 8)) and churned(6, date(2024, 4, 8))
+    assert not churned(8, FIXTURE_END)
+
+
+def compare(label: str, rows, expected) -> bool:
+    actual = [
+        (row['date'], row['active_customers'], row['churned_customers'], Decimal(row['churn_rate']))
+        for row in rows
+    ]
+    mismatches = [(a, e) for a, e in zip(actual, expected) if a != e]
+    if len(actual) != len(expected):
+        mismatches.append((f"{len(actual)} periods", f"{len(expected)} periods"))
+    print(f"{'✅' if not mismatches else '❌'} {label}: {len(expected)} periods, {len(mismatches)} mismatches")
+    for a, e in mismatches[:5]:
+        print(f"     query={a}\n     model={e}")
+    return not mismatches
+
+
+async def fetch(conn, query, params):
+    cur = await conn.execute(query, params)
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in await cur.fetchall()]
+
+
+async def test_fixtures() -> bool:
+    purchases = fixtures()
+    ok = True
+    async with db.connection() as conn:
+        async with conn.transaction():
+            # Temporária: tem precedência sobre public.sales nesta conexão e some no fim da transação
+            await conn.execute(
+                "CREATE TEMP TABLE sales (id SERIAL, customer_id INTEGER, created_at TIMESTAMP) ON COMMIT DROP"
+            )
+            async with conn.cursor() as cur:
+                await cur.executemany("INSERT INTO sales (customer_id, created_at) VALUES (%s, %s)", purchases)
+            for granularity in GRANULARITIES:
+                query, params = churn_service._build_churn_trend_query(FIXTURE_START, FIXTURE_END, granularity)
+                rows = await fetch(conn, query, params)
+                expected = brute_force(purchases, FIXTURE_START, FIXTURE_END, granularity)
+                ok &= compare(f"fixtures / {granularity}", rows, expected)
+    return ok
+
+
+async def test_real_data() -> bool:
+    row = await db.fetch_one("SELECT MAX(created_at::date) as max_date FROM sales")
+    end_date = row['max_date']
+    start_date = end_date - timedelta(days=89)
+    purchases = [
+        (r['customer_id'], r['created_at'])
+        for r in await db.fetch_all(
+            "SELECT customer_id, created_at FROM sales "
+            "WHERE created_at >= %s::date AND created_at < %s::date + 1 AND customer_id IS NOT NULL",
+            start_date, end_date
+        )
+    ]
+    ok = True
+    for granularity in GRANULARITIES:
+        query, params = churn_service._build_churn_trend_query(start_date, end_date, granularity)
+        rows = await db.fetch_all(query, *params)
+        expected = brute_force(purchases, start_date, end_date, granularity)
+        ok &= compare(f"sales {start_date}..{end_date} / {granularity}", rows, expected)
+    return ok
+
+
+async def main():
+    print("=" * 80)
+    print("CHURN TREND vs BRUTE-FORCE MODEL")
+    print("=" * 80)
+    check_model()
+    await db.connect()
+    try:
+        ok = await test_fixtures()
+        ok &= await test_real_data()
+    finally:
+        await db.disconnect()
+    print("\n✅ All periods match" if ok else "\n❌ Mismatches found")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
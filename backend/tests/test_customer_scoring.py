@@ -0,0 +1,85 @@
+"""
+At-risk listing of the scored customer frame: cursor paging in both the numpy
+and the pure Python implementation
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services import customer_scoring
+from app.services.customer_scoring import SORT_KEYS, ScoredFrame
+
+BACKENDS = ["python"] + (["numpy"] if customer_scoring.np is not None else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def frame(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(customer_scoring, "np", None)
+    rng = random.Random(19)
+    n = 300
+    recency = [rng.randint(0, 60) for _ in range(n)]
+    columns = {
+        "customer_id": list(range(1, n + 1)),
+        "customer_name": [f"Cliente #{i}" for i in range(1, n + 1)],
+        # Poucos valores distintos: muitos empates resolvidos pelo customer_id
+        "frequency": [rng.randint(1, 6) for _ in range(n)],
+        "monetary": [float(rng.choice([50, 120, 300])) for _ in range(n)],
+        "last_purchase_at": [datetime(2024, 6, 30) - timedelta(days=days) for days in recency],
+        "recency": recency,
+        "store_ids": [[rng.randint(1, 3)] for _ in range(n)],
+    }
+    return ScoredFrame(columns, {1: "Loja A", 2: "Loja B", 3: "Loja C"}, (n, None))
+
+
+def _ids(records):
+    return [record["customer_id"] for record in records]
+
+
+def _walk(frame, page_size, **kwargs):
+    ids, after = [], None
+    while True:
+        page, total, after = frame.at_risk(limit=page_size, after=after, **kwargs)
+        ids.extend(_ids(page))
+        if after is None:
+            return ids, total
+
+
+@pytest.mark.parametrize("sort_by", SORT_KEYS)
+@pytest.mark.parametrize("descending", [True, False])
+def test_cursor_walk_matches_single_page(frame, sort_by, descending):
+    options = dict(min_purchases=2, days_inactive=30, sort_by=sort_by, descending=descending)
+    everything, total, after = frame.at_risk(limit=frame.size, **options)
+
+    walked, walked_total = _walk(frame, 7, **options)
+
+    assert after is None
+    assert walked == _ids(everything)
+    assert len(walked) == len(set(walked)) == total == walked_total
+
+
+def test_order_and_filter(frame):
+    records, _, _ = frame.at_risk(min_purchases=3, days_inactive=40, limit=frame.size, sort_by="lifetime_value")
+
+    assert records
+    assert all(r["total_purchases"] >= 3 and 20 <= r["days_since_last_purchase"] <= 40 for r in records)
+    keys = [(-r["lifetime_value"], r["customer_id"]) for r in records]
+    assert keys == sorted(keys)
+
+
+def test_offset_pages_match_cursor_pages(frame):
+    options = dict(min_purchases=1, days_inactive=60, sort_by="risk_score", descending=True)
+    walked, total = _walk(frame, 10, **options)
+
+    by_offset = []
+    for offset in range(0, total, 10):
+        page, _, _ = frame.at_risk(limit=10, offset=offset, **options)
+        by_offset.extend(_ids(page))
+
+    assert by_offset == walked
+
+
+def test_invalid_sort_key(frame):
+    with pytest.raises(ValueError):
+        frame.at_risk(min_purchases=1, days_inactive=30, limit=10, sort_by="customer_name")
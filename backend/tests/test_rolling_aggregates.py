@@ -0,0 +1,101 @@
+"""
+HyperLogLog sketch of the rolling aggregates: estimate bounds, sparse / dense
+merges and the SWAR register max
+"""
+import random
+
+import pytest
+
+from app.services.rolling_aggregates import (
+    HLL_REGISTERS,
+    HLL_SPARSE_LIMIT,
+    HyperLogLog,
+    _max_registers,
+)
+
+
+def _sketch(values):
+    sketch = HyperLogLog()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def _dense(sketch):
+    """Registers as bytes, whatever the representation"""
+    if isinstance(sketch.registers, dict):
+        dense = bytearray(HLL_REGISTERS)
+        for index, rank in sketch.registers.items():
+            dense[index] = rank
+        return bytes(dense)
+    return bytes(sketch.registers)
+
+
+def _ids(seed, n):
+    return random.Random(seed).sample(range(10 ** 9), n)
+
+
+@pytest.mark.parametrize("n", [1, 10, 100, 1000, 5000, 20000, 100000])
+def test_estimate_bounds(n):
+    # Erro padrão ~2.3%: cada sketch fica em ~3.5 desvios, a média em ~1.5
+    errors = [abs(_sketch(_ids(seed, n)).estimate() - n) / n for seed in range(5)]
+
+    assert max(errors) < 0.08
+    assert sum(errors) / len(errors) < 0.035
+
+
+def test_empty_and_duplicates():
+    assert HyperLogLog().estimate() == 0
+
+    values = _ids(0, 500)
+    assert _sketch(values * 3).estimate() == _sketch(values).estimate()
+
+
+def test_densifies_past_sparse_limit():
+    assert isinstance(_sketch(range(HLL_SPARSE_LIMIT // 2)).registers, dict)
+    assert isinstance(_sketch(range(HLL_SPARSE_LIMIT * 4)).registers, bytearray)
+
+
+@pytest.mark.parametrize("sizes", [(50, 80), (50, 20000), (20000, 50), (20000, 30000)])
+def test_merge_equals_sketch_of_union(sizes):
+    a_values, b_values = _ids(1, sizes[0]), _ids(2, sizes[1])
+    union = _sketch(a_values + b_values)
+
+    merged = _sketch(a_values)
+    merged.merge(_sketch(b_values))
+    reverse = _sketch(b_values)
+    reverse.merge(_sketch(a_values))
+
+    assert _dense(merged) == _dense(reverse) == _dense(union)
+    assert merged.estimate() == union.estimate()
+
+
+def test_merge_is_idempotent_and_keeps_other_untouched():
+    a, b = _sketch(_ids(3, 20000)), _sketch(_ids(4, 20000))
+    b_before = _dense(b)
+
+    a.merge(b)
+    once = _dense(a)
+    a.merge(b)
+
+    assert _dense(a) == once
+    assert _dense(b) == b_before
+
+
+def test_merge_sparse_into_dense_keeps_representation():
+    dense, sparse = _sketch(_ids(5, 20000)), _sketch(_ids(6, 30))
+    dense.merge(sparse)
+
+    assert isinstance(dense.registers, bytearray)
+    assert isinstance(sparse.registers, dict)
+
+
+def test_max_registers_matches_bytewise_max():
+    rng = random.Random(25)
+    # Ranks reais vão até 54; cobre também 0 e o maior valor sem o bit alto
+    choices = [0, 1, 2, 53, 54, 127] + list(range(3, 20))
+    for _ in range(20):
+        a = bytes(rng.choice(choices) for _ in range(HLL_REGISTERS))
+        b = bytes(rng.choice(choices) for _ in range(HLL_REGISTERS))
+
+        assert bytes(_max_registers(a, b)) == bytes(map(max, a, b))
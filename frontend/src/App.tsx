@@ -77,7 +77,7 @@ function AppContent() {
       
       <Content style={{ padding: '0', flex: 1, overflow: 'hidden' }}>
         {/* Sistema de notificação automática de alertas */}
-        <AlertNotification checkInterval={60000} enabled={true} />
+        <AlertNotification enabled={true} />
         
         <Routes>
           <Route path="/" element={<Dashboard />} />
@@ -15,6 +15,8 @@ export interface AlertCreate {
   name: string;
   description?: string;
   condition: AlertCondition;
+  filters?: Record<string, any>;
+  window_minutes?: number | null;
   enabled: boolean;
   notification_channels: ('toast' | 'email' | 'webhook')[];
 }
@@ -37,6 +39,11 @@ export interface AlertCheckResult {
   timestamp: string;
 }
 
+export interface AlertEvaluation {
+  checked_at: string;
+  results: AlertCheckResult[];
+}
+
 export const alertsAPI = {
   /**
    * Cria um novo alerta
@@ -93,5 +100,18 @@ export const alertsAPI = {
   checkCurrent: async (): Promise<AlertCheckResult[]> => {
     const response = await axios.post(`${API_BASE_URL}/api/v1/alerts/check-current`);
     return response.data;
+  },
+
+  /**
+   * Assina as avaliações do agendador do servidor (Server-Sent Events).
+   * Retorna a função que fecha a conexão.
+   */
+  subscribe: (onEvaluation: (evaluation: AlertEvaluation) => void): (() => void) => {
+    const source = new EventSource(`${API_BASE_URL}/api/v1/alerts/stream`);
+    source.addEventListener('alerts', (event) => {
+      onEvaluation(JSON.parse((event as MessageEvent).data));
+    });
+    // EventSource reconecta sozinho se a conexão cair
+    return () => source.close();
   }
 };
@@ -3,32 +3,46 @@ import type {
   KPIDashboard,
   AnalyticsQueryRequest,
   AnalyticsQueryResponse,
+  AnalyticsBatchResponse,
+  AnalyticsExportFormat,
   DimensionValuesResponse,
+  DataFreshness,
+  LiveKPIRequest,
 } from '../types/analytics';
 
+// Convert filters to /kpis parameters (matching backend parameter names)
+export const kpiParams = (filters?: Record<string, any>): Record<string, any> => {
+  const params: any = {};
+  
+  if (filters) {
+    if (filters.data_venda_gte) params.start_date = filters.data_venda_gte;
+    if (filters.data_venda_lte) params.end_date = filters.data_venda_lte;
+    
+    // Send as arrays to match backend List[str] expectations
+    if (filters.canal_venda && filters.canal_venda.length > 0) {
+      params.canal_venda = filters.canal_venda;
+    }
+    if (filters.nome_loja && filters.nome_loja.length > 0) {
+      params.nome_loja = filters.nome_loja;
+    }
+    if (filters.nome_produto && filters.nome_produto.length > 0) {
+      params.nome_produto = filters.nome_produto;
+    }
+  }
+  
+  return params;
+};
+
+// Same parameters in the body of a live KPI subscription
+export const liveKPIRequest = (filters?: Record<string, any>): LiveKPIRequest => {
+  const { start_date, end_date, ...dimensionFilters } = kpiParams(filters);
+  return { start_date, end_date, filters: dimensionFilters };
+};
+
 export const analyticsAPI = {
   // Get KPI Dashboard
   getKPIs: async (filters?: Record<string, any>): Promise<KPIDashboard> => {
-    const params: any = {};
-    
-    // Convert filters to query params (matching backend parameter names)
-    if (filters) {
-      if (filters.data_venda_gte) params.start_date = filters.data_venda_gte;
-      if (filters.data_venda_lte) params.end_date = filters.data_venda_lte;
-      
-      // Send as arrays to match backend List[str] expectations
-      if (filters.canal_venda && filters.canal_venda.length > 0) {
-        params.canal_venda = filters.canal_venda;
-      }
-      if (filters.nome_loja && filters.nome_loja.length > 0) {
-        params.nome_loja = filters.nome_loja;
-      }
-      if (filters.nome_produto && filters.nome_produto.length > 0) {
-        params.nome_produto = filters.nome_produto;
-      }
-    }
-    
-    const response = await apiClient.get('/api/v1/analytics/kpis', { params });
+    const response = await apiClient.get('/api/v1/analytics/kpis', { params: kpiParams(filters) });
     return response.data;
   },
 
@@ -38,12 +52,34 @@ export const analyticsAPI = {
     return response.data;
   },
 
+  // Execute several queries in one request (shared scans on the backend)
+  queryBatch: async (requests: AnalyticsQueryRequest[]): Promise<AnalyticsBatchResponse> => {
+    const response = await apiClient.post('/api/v1/analytics/query/batch', { queries: requests });
+    return response.data;
+  },
+
+  // Export every row of a query (streamed by the backend, no row limit)
+  exportQuery: async (request: AnalyticsQueryRequest, format: AnalyticsExportFormat = 'csv'): Promise<Blob> => {
+    const exportRequest = { ...request, limit: undefined, offset: undefined };
+    const response = await apiClient.post('/api/v1/analytics/query/export', exportRequest, {
+      params: { format },
+      responseType: 'blob',
+    });
+    return response.data;
+  },
+
   // Get dimension values
   getDimensionValues: async (dimension: string): Promise<DimensionValuesResponse> => {
     const response = await apiClient.get(`/api/v1/analytics/dimensions/${dimension}`);
     return response.data;
   },
 
+  // Freshness of the summary tables (last refresh, pending sales)
+  getFreshness: async (): Promise<DataFreshness> => {
+    const response = await apiClient.get('/api/v1/analytics/db/freshness');
+    return response.data;
+  },
+
   // Convenience methods for specific dimensions
   getStores: () => analyticsAPI.getDimensionValues('stores'),
   getChannels: () => analyticsAPI.getDimensionValues('channels'),
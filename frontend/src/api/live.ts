@@ -0,0 +1,106 @@
+/**
+ * Live dashboard updates (POST /api/v1/analytics/live)
+ *
+ * Uma única conexão por aba com todos os widgets inscritos: o servidor envia
+ * um snapshot ao conectar e depois só os widgets cujos dados mudaram. Quando a
+ * lista de widgets muda, a conexão é reaberta (agrupando as mudanças do mesmo
+ * render); se cair, reconecta com backoff.
+ */
+import type { LiveSubscription } from '../types/analytics';
+
+const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
+type Listener = (result: any) => void;
+
+interface Widget {
+  subscription: LiveSubscription;
+  listener: Listener;
+}
+
+const widgets = new Map<string, Widget>();
+let nextId = 0;
+let controller: AbortController | null = null;
+let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+let retryDelay = 1000;
+
+const scheduleConnect = (delay: number) => {
+  if (reconnectTimer) clearTimeout(reconnectTimer);
+  reconnectTimer = setTimeout(connect, delay);
+};
+
+const dispatch = (event: string, data: string) => {
+  if (event === 'update') {
+    const { id, result } = JSON.parse(data);
+    widgets.get(id)?.listener(result);
+  } else if (event === 'error') {
+    console.error('Live updates error:', data);
+  }
+};
+
+const connect = async () => {
+  reconnectTimer = null;
+  controller?.abort();
+  controller = null;
+  if (widgets.size === 0) return;
+
+  const current = new AbortController();
+  controller = current;
+  const subscriptions = Array.from(widgets, ([id, widget]) => ({ id, ...widget.subscription }));
+
+  try {
+    const response = await fetch(`${API_BASE_URL}/api/v1/analytics/live`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+      body: JSON.stringify({ subscriptions }),
+      signal: current.signal,
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+    retryDelay = 1000;
+
+    // EventSource não faz POST: os eventos SSE são lidos do corpo da resposta
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += value;
+      let end;
+      while ((end = buffer.indexOf('\n\n')) >= 0) {
+        const block = buffer.slice(0, end);
+        buffer = buffer.slice(end + 2);
+        let event = 'message';
+        const data: string[] = [];
+        for (const line of block.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim();
+          else if (line.startsWith('data:')) data.push(line.slice(5).trimStart());
+        }
+        if (data.length > 0) dispatch(event, data.join('\n'));
+      }
+    }
+  } catch (error) {
+    if (current.signal.aborted) return;
+    console.error('Live updates disconnected:', error);
+  }
+
+  // Stream encerrado pelo servidor (ou erro): reconectar, a menos que tenha sido substituído
+  if (controller === current) {
+    controller = null;
+    scheduleConnect(retryDelay);
+    retryDelay = Math.min(retryDelay * 2, 30000);
+  }
+};
+
+export const liveAPI = {
+  // Receive the data of a widget whenever it changes; returns the unsubscribe function
+  subscribe: (subscription: LiveSubscription, listener: Listener): (() => void) => {
+    const id = `w${nextId++}`;
+    widgets.set(id, { subscription, listener });
+    scheduleConnect(50);
+    return () => {
+      widgets.delete(id);
+      scheduleConnect(50);
+    };
+  },
+};
@@ -93,6 +93,7 @@ export const AlertManager = () => {
       render: (_: any, record: Alert) => (
         <Tag color="blue">
           {record.condition.metric} {operatorLabels[record.condition.operator]} {record.condition.threshold}
+          {record.window_minutes ? ` (últimos ${record.window_minutes} min)` : ''}
         </Tag>
       ),
     },
@@ -1,38 +1,29 @@
 import { useEffect } from 'react';
 import { notification } from 'antd';
 import { BellOutlined, WarningOutlined } from '@ant-design/icons';
-import { useQuery } from '@tanstack/react-query';
+import { useQueryClient } from '@tanstack/react-query';
 import { alertsAPI } from '../../api/alerts';
 import type { AlertCheckResult } from '../../api/alerts';
 
 interface AlertNotificationProps {
   /**
-   * Intervalo de verificação em milissegundos (padrão: 60000 = 1 minuto)
-   */
-  checkInterval?: number;
-  /**
-   * Se deve verificar automaticamente
+   * Se deve receber as avaliações do servidor
    */
   enabled?: boolean;
 }
 
 export const AlertNotification = ({ 
-  checkInterval = 60000, 
   enabled = true 
 }: AlertNotificationProps) => {
-  
-  // Query para verificar alertas automaticamente
-  const { data: triggeredAlerts } = useQuery({
-    queryKey: ['check-alerts'],
-    queryFn: () => alertsAPI.checkCurrent(),
-    refetchInterval: enabled ? checkInterval : false,
-    enabled: enabled,
-  });
+  const queryClient = useQueryClient();
 
-  // Mostrar notificações quando alertas forem disparados
+  // Os alertas são avaliados pelo agendador do backend e chegam por SSE
   useEffect(() => {
-    if (triggeredAlerts && triggeredAlerts.length > 0) {
-      triggeredAlerts.forEach((result: AlertCheckResult) => {
+    if (!enabled) return;
+
+    return alertsAPI.subscribe((evaluation) => {
+      const triggered = evaluation.results.filter((result) => result.triggered);
+      triggered.forEach((result: AlertCheckResult) => {
         notification.warning({
           message: `⚠️ ${result.alert_name}`,
           description: result.message,
@@ -41,8 +32,12 @@ export const AlertNotification = ({
           duration: 8,
         });
       });
-    }
-  }, [triggeredAlerts]);
+      if (triggered.length > 0) {
+        // Atualiza trigger_count / last_triggered_at na lista de alertas
+        queryClient.invalidateQueries({ queryKey: ['alerts'] });
+      }
+    });
+  }, [enabled, queryClient]);
 
   // Componente não renderiza nada visualmente
   return null;
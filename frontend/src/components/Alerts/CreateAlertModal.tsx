@@ -24,6 +24,7 @@ export const CreateAlertModal = ({ visible, alert, onClose }: CreateAlertModalPr
         metric: alert.condition.metric,
         operator: alert.condition.operator,
         threshold: alert.condition.threshold,
+        window_minutes: alert.window_minutes ?? undefined,
         enabled: alert.enabled,
         notification_channels: alert.notification_channels,
       });
@@ -49,6 +50,7 @@ export const CreateAlertModal = ({ visible, alert, onClose }: CreateAlertModalPr
           operator: values.operator,
           threshold: values.threshold,
         } as AlertCondition,
+        window_minutes: values.window_minutes ?? null,
         enabled: values.enabled,
         notification_channels: values.notification_channels,
       };
@@ -168,6 +170,19 @@ export const CreateAlertModal = ({ visible, alert, onClose }: CreateAlertModalPr
           />
         </Form.Item>
 
+        <Form.Item
+          name="window_minutes"
+          label="Janela (minutos)"
+          tooltip="Avalia a métrica nos últimos N minutos; vazio considera todo o histórico"
+        >
+          <InputNumber
+            style={{ width: '100%' }}
+            placeholder="Ex: 60"
+            min={1}
+            precision={0}
+          />
+        </Form.Item>
+
         <Form.Item
           name="notification_channels"
           label="Canais de Notificação"
@@ -2,6 +2,8 @@ import { useEffect, useRef, useState } from 'react';
 import * as echarts from 'echarts';
 import { useQuery } from '@tanstack/react-query';
 import { analyticsAPI } from '../../api/analytics';
+import { useLiveQuery } from '../../hooks/useLiveQuery';
+import type { AnalyticsQueryRequest } from '../../types/analytics';
 import { useTheme } from '../../hooks/useTheme';
 import { getEChartsTheme } from '../../styles/theme';
 import { DrillDownModal, type DrillDownContext } from '../DrillDown';
@@ -17,17 +19,18 @@ export const DeliveryMetricsChart = ({ filters = {} }: DeliveryMetricsChartProps
   const [drillDownContext, setDrillDownContext] = useState<DrillDownContext | null>(null);
   const [modalVisible, setModalVisible] = useState(false);
 
+  const request: AnalyticsQueryRequest = {
+    metrics: ['tempo_medio_entrega', 'qtd_vendas'],
+    dimensions: ['bairro'],
+    filters: filters,
+    order_by: [{ field: 'qtd_vendas', direction: 'desc' }], // Order by volume, not time
+    limit: 50 // Get more to aggregate "Others"
+  };
   const { data, isLoading, error } = useQuery({
     queryKey: ['delivery-metrics', filters],
-    queryFn: () => analyticsAPI.query({
-      metrics: ['tempo_medio_entrega', 'qtd_vendas'],
-      dimensions: ['bairro'],
-      filters: filters,
-      order_by: [{ field: 'qtd_vendas', direction: 'desc' }], // Order by volume, not time
-      limit: 50 // Get more to aggregate "Others"
-    }),
-    refetchInterval: 60000,
+    queryFn: () => analyticsAPI.query(request),
   });
+  useLiveQuery(['delivery-metrics', filters], { query: request });
 
   useEffect(() => {
     if (!chartRef.current) return;
@@ -2,6 +2,8 @@ import { useEffect, useRef } from 'react';
 import * as echarts from 'echarts';
 import { useQuery } from '@tanstack/react-query';
 import { analyticsAPI } from '../../api/analytics';
+import { useLiveQuery } from '../../hooks/useLiveQuery';
+import type { AnalyticsQueryRequest } from '../../types/analytics';
 
 interface HourlyHeatmapProps {
   filters?: Record<string, any>;
@@ -11,17 +13,18 @@ export const HourlyHeatmap = ({ filters = {} }: HourlyHeatmapProps) => {
   const chartRef = useRef<HTMLDivElement>(null);
   const chartInstance = useRef<echarts.ECharts | null>(null);
 
+  const request: AnalyticsQueryRequest = {
+    metrics: ['qtd_vendas'],
+    dimensions: ['hora', 'dia_semana'],
+    filters: filters,
+    order_by: [{ field: 'hora', direction: 'asc' }],
+    limit: 200
+  };
   const { data, isLoading, error } = useQuery({
     queryKey: ['hourly-heatmap', filters],
-    queryFn: () => analyticsAPI.query({
-      metrics: ['qtd_vendas'],
-      dimensions: ['hora', 'dia_semana'],
-      filters: filters,
-      order_by: [{ field: 'hora', direction: 'asc' }],
-      limit: 200
-    }),
-    refetchInterval: 60000,
+    queryFn: () => analyticsAPI.query(request),
   });
+  useLiveQuery(['hourly-heatmap', filters], { query: request });
 
   useEffect(() => {
     if (!chartRef.current) return;
@@ -2,6 +2,8 @@ import { useEffect, useRef, useState } from 'react';
 import * as echarts from 'echarts';
 import { useQuery } from '@tanstack/react-query';
 import { analyticsAPI } from '../../api/analytics';
+import { useLiveQuery } from '../../hooks/useLiveQuery';
+import type { AnalyticsQueryRequest } from '../../types/analytics';
 import { useTheme } from '../../hooks/useTheme';
 import { getEChartsTheme } from '../../styles/theme';
 import { DrillDownModal } from '../DrillDown';
@@ -18,17 +20,18 @@ export const SalesChannelChart = ({ filters = {} }: SalesChannelChartProps) => {
   const [drillDownContext, setDrillDownContext] = useState<DrillDownContext | null>(null);
   const [modalVisible, setModalVisible] = useState(false);
 
+  const request: AnalyticsQueryRequest = {
+    metrics: ['faturamento', 'qtd_vendas'],
+    dimensions: ['canal_venda'],
+    filters: filters,
+    order_by: [{ field: 'faturamento', direction: 'desc' }],
+    limit: 10
+  };
   const { data, isLoading, error } = useQuery({
     queryKey: ['sales-by-channel', filters],
-    queryFn: () => analyticsAPI.query({
-      metrics: ['faturamento', 'qtd_vendas'],
-      dimensions: ['canal_venda'],
-      filters: filters,
-      order_by: [{ field: 'faturamento', direction: 'desc' }],
-      limit: 10
-    }),
-    refetchInterval: 60000, // Atualiza a cada 60s
+    queryFn: () => analyticsAPI.query(request),
   });
+  useLiveQuery(['sales-by-channel', filters], { query: request });
 
   useEffect(() => {
     if (!chartRef.current) return;
@@ -2,6 +2,8 @@ import { useEffect, useRef, useState } from 'react';
 import * as echarts from 'echarts';
 import { useQuery } from '@tanstack/react-query';
 import { analyticsAPI } from '../../api/analytics';
+import { useLiveQuery } from '../../hooks/useLiveQuery';
+import type { AnalyticsQueryRequest } from '../../types/analytics';
 import { useTheme } from '../../hooks/useTheme';
 import { getEChartsTheme } from '../../styles/theme';
 import { DrillDownModal, type DrillDownContext } from '../DrillDown';
@@ -17,17 +19,18 @@ export const TopProductsChart = ({ filters = {} }: TopProductsChartProps) => {
   const [drillDownContext, setDrillDownContext] = useState<DrillDownContext | null>(null);
   const [modalVisible, setModalVisible] = useState(false);
 
+  const request: AnalyticsQueryRequest = {
+    metrics: ['qtd_vendas', 'faturamento'],
+    dimensions: ['nome_produto'],
+    filters: filters,
+    order_by: [{ field: 'qtd_vendas', direction: 'desc' }],
+    limit: 10
+  };
   const { data, isLoading, error } = useQuery({
     queryKey: ['top-products', filters],
-    queryFn: () => analyticsAPI.query({
-      metrics: ['qtd_vendas', 'faturamento'],
-      dimensions: ['nome_produto'],
-      filters: filters,
-      order_by: [{ field: 'qtd_vendas', direction: 'desc' }],
-      limit: 10
-    }),
-    refetchInterval: 60000,
+    queryFn: () => analyticsAPI.query(request),
   });
+  useLiveQuery(['top-products', filters], { query: request });
 
   useEffect(() => {
     if (!chartRef.current) return;
@@ -1,4 +1,5 @@
-import { Card, Table, Tag, Space, Button, Tooltip } from 'antd';
+import { useState } from 'react';
+import { Card, Table, Tag, Space, Button, Tooltip, Select } from 'antd';
 import {
   UserOutlined,
   DollarOutlined,
@@ -7,7 +8,10 @@ import {
   MailOutlined,
   GiftOutlined
 } from '@ant-design/icons';
-import type { ColumnsType } from 'antd/es/table';
+import type { ColumnsType, SorterResult } from 'antd/es/table/interface';
+import { useQuery, keepPreviousData } from '@tanstack/react-query';
+
+const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
 interface AtRiskCustomer {
   customer_id: string;
@@ -21,12 +25,88 @@ interface AtRiskCustomer {
   risk_score: number;
 }
 
+interface AtRiskCustomersPage {
+  customers: AtRiskCustomer[];
+  total: number;
+  next_cursor: string | null;
+}
+
+type SortBy = 'days_since_last_purchase' | 'risk_score' | 'lifetime_value' | 'total_purchases';
+
+interface AtRiskQuery {
+  minPurchases: number;
+  daysInactive: number;
+  pageSize: number;
+  sortBy: SortBy;
+  order: 'asc' | 'desc';
+}
+
+// Coluna da tabela -> sort_by do backend (ordenação feita no servidor)
+const SORT_FIELDS: Record<string, SortBy> = {
+  risk_score: 'risk_score',
+  total_purchases: 'total_purchases',
+  lifetime_value: 'lifetime_value',
+  last_purchase_date: 'days_since_last_purchase'
+};
+
+async function fetchAtRiskPage(query: AtRiskQuery, cursor?: string): Promise<AtRiskCustomersPage> {
+  const params = new URLSearchParams({
+    min_purchases: String(query.minPurchases),
+    days_inactive: String(query.daysInactive),
+    limit: String(query.pageSize),
+    sort_by: query.sortBy,
+    order: query.order
+  });
+  if (cursor) params.set('cursor', cursor);
+  const response = await fetch(`${API_BASE_URL}/api/v1/analytics/churn/at-risk?${params}`);
+  if (!response.ok) throw new Error('Failed to fetch at-risk customers');
+  return response.json();
+}
+
 interface AtRiskCustomersTableProps {
-  data: AtRiskCustomer[];
-  loading?: boolean;
+  minPurchases: number;
+  daysInactive: number;
 }
 
-export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProps) => {
+export const AtRiskCustomersTable = ({ minPurchases, daysInactive }: AtRiskCustomersTableProps) => {
+  const [pageSize, setPageSize] = useState(25);
+  const [sortBy, setSortBy] = useState<SortBy>('days_since_last_purchase');
+  const [order, setOrder] = useState<'asc' | 'desc'>('desc');
+  const query: AtRiskQuery = { minPurchases, daysInactive, pageSize, sortBy, order };
+
+  // Paginação por cursor (keyset): custo constante por página, mesmo com centenas de
+  // milhares de clientes. Os cursores só valem para os mesmos filtros / ordenação.
+  const pageKey = JSON.stringify(query);
+  const [pages, setPages] = useState<{ key: string; cursors: string[] }>({ key: pageKey, cursors: [] });
+  const cursors = pages.key === pageKey ? pages.cursors : [];
+  const setCursors = (next: string[]) => setPages({ key: pageKey, cursors: next });
+  const cursor = cursors[cursors.length - 1];
+
+  const { data: page, isLoading, isPlaceholderData } = useQuery({
+    queryKey: ['at-risk-customers', query, cursor],
+    queryFn: () => fetchAtRiskPage(query, cursor),
+    placeholderData: keepPreviousData,
+    refetchInterval: 60000
+  });
+  const data = page?.customers || [];
+  const total = page?.total || 0;
+  const nextCursor = isPlaceholderData ? undefined : page?.next_cursor;
+
+  const sortOrderOf = (field: SortBy) =>
+    sortBy === field ? (order === 'desc' ? 'descend' as const : 'ascend' as const) : null;
+
+  const handleTableChange = (sorter: SorterResult<AtRiskCustomer> | SorterResult<AtRiskCustomer>[]) => {
+    const single = Array.isArray(sorter) ? sorter[0] : sorter;
+    const field = single?.columnKey ? SORT_FIELDS[String(single.columnKey)] : undefined;
+    if (!field || !single.order) {
+      setSortBy('days_since_last_purchase');
+      setOrder('desc');
+      return;
+    }
+    setSortBy(field);
+    setOrder(single.order === 'ascend' ? 'asc' : 'desc');
+  };
+
   const getRiskLevel = (score: number): { text: string; color: string } => {
     if (score >= 70) return { text: 'Alto', color: '#cf1322' };
     if (score >= 40) return { text: 'Médio', color: '#fa8c16' };
@@ -49,8 +129,7 @@ export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProp
             </div>
           </div>
         </Space>
-      ),
-      sorter: (a, b) => a.customer_name.localeCompare(b.customer_name)
+      )
     },
     {
       title: 'Nível de Risco',
@@ -65,8 +144,9 @@ export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProp
           </Tag>
         );
       },
-      sorter: (a, b) => b.risk_score - a.risk_score,
-      defaultSortOrder: 'ascend'
+      sorter: true,
+      sortOrder: sortOrderOf('risk_score'),
+      sortDirections: ['descend', 'ascend']
     },
     {
       title: 'Compras',
@@ -80,7 +160,9 @@ export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProp
           {value}
         </Space>
       ),
-      sorter: (a, b) => b.total_purchases - a.total_purchases
+      sorter: true,
+      sortOrder: sortOrderOf('total_purchases'),
+      sortDirections: ['descend', 'ascend']
     },
     {
       title: 'Valor Total',
@@ -93,7 +175,9 @@ export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProp
           R$ {value.toLocaleString('pt-BR', { minimumFractionDigits: 2, maximumFractionDigits: 2 })}
         </Space>
       ),
-      sorter: (a, b) => b.lifetime_value - a.lifetime_value
+      sorter: true,
+      sortOrder: sortOrderOf('lifetime_value'),
+      sortDirections: ['descend', 'ascend']
     },
     {
       title: 'Ticket Médio',
@@ -102,8 +186,7 @@ export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProp
       width: 120,
       render: (value: number) => (
         `R$ ${value.toLocaleString('pt-BR', { minimumFractionDigits: 2, maximumFractionDigits: 2 })}`
-      ),
-      sorter: (a, b) => b.avg_order_value - a.avg_order_value
+      )
     },
     {
       title: 'Última Compra',
@@ -118,7 +201,9 @@ export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProp
           </div>
         </div>
       ),
-      sorter: (a, b) => b.days_since_last_purchase - a.days_since_last_purchase
+      sorter: true,
+      sortOrder: sortOrderOf('days_since_last_purchase'),
+      sortDirections: ['descend', 'ascend']
     },
     {
       title: 'Lojas Favoritas',
@@ -181,12 +266,12 @@ export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProp
         <Space>
           <WarningOutlined style={{ color: '#fa8c16' }} />
           <span>Clientes em Risco de Churn</span>
-          <Tag color="orange">{data.length} clientes</Tag>
+          <Tag color="orange">{total} clientes</Tag>
         </Space>
       }
-      loading={loading}
+      loading={isLoading}
     >
-      {data.length === 0 ? (
+      {data.length === 0 && cursors.length === 0 ? (
         <div style={{ 
           textAlign: 'center', 
           padding: '40px 20px',
@@ -201,19 +286,44 @@ export const AtRiskCustomersTable = ({ data, loading }: AtRiskCustomersTableProp
           </p>
         </div>
       ) : (
-        <Table
-          columns={columns}
-          dataSource={data}
-          rowKey="customer_id"
-          pagination={{
-            pageSize: 10,
-            showSizeChanger: true,
-            showTotal: (total) => `Total de ${total} clientes em risco`,
-            pageSizeOptions: ['10', '25', '50', '100']
-          }}
-          scroll={{ x: 1200 }}
-          size="small"
-        />
+        <>
+          <Table
+            columns={columns}
+            dataSource={data}
+            rowKey="customer_id"
+            pagination={false}
+            onChange={(_pagination, _filters, sorter) => handleTableChange(sorter)}
+            loading={isPlaceholderData}
+            scroll={{ x: 1200 }}
+            size="small"
+          />
+          <Space style={{ marginTop: 16, width: '100%', justifyContent: 'flex-end' }}>
+            <Button size="small" onClick={() => setCursors([])} disabled={cursors.length === 0}>
+              {'<<'}
+            </Button>
+            <Button size="small" onClick={() => setCursors(cursors.slice(0, -1))} disabled={cursors.length === 0}>
+              {'<'}
+            </Button>
+            <Button
+              size="small"
+              onClick={() => nextCursor && setCursors([...cursors, nextCursor])}
+              disabled={!nextCursor}
+            >
+              {'>'}
+            </Button>
+            <span>
+              Página <strong>{cursors.length + 1}</strong> de {Math.max(1, Math.ceil(total / pageSize))}
+            </span>
+            <Select
+              size="small"
+              value={pageSize}
+              onChange={value => setPageSize(Number(value))}
+              style={{ width: 120 }}
+              options={[10, 25, 50, 100].map(size => ({ value: size, label: `${size} / página` }))}
+            />
+            <span>Total de {total} clientes em risco</span>
+          </Space>
+        </>
       )}
     </Card>
   );
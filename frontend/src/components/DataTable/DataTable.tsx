@@ -2,22 +2,21 @@ import { useMemo, useState } from 'react';
 import {
   useReactTable,
   getCoreRowModel,
-  getSortedRowModel,
   getFilteredRowModel,
-  getPaginationRowModel,
   flexRender,
 } from '@tanstack/react-table';
 import type { ColumnDef, SortingState, ColumnFiltersState, VisibilityState } from '@tanstack/react-table';
 import { Card, Button, Input, Select, Space, Checkbox, Dropdown, Spin, Alert } from 'antd';
 import { 
-  DownloadOutlined, 
   EyeOutlined, 
   SortAscendingOutlined,
   SortDescendingOutlined,
   TableOutlined 
 } from '@ant-design/icons';
-import { useQuery } from '@tanstack/react-query';
+import { useQuery, keepPreviousData } from '@tanstack/react-query';
 import { analyticsAPI } from '../../api/analytics';
+import type { AnalyticsQueryRequest } from '../../types/analytics';
+import { ExportButton } from '../Export';
 import './DataTable.css';
 
 const { Option } = Select;
@@ -37,30 +36,40 @@ interface TableRow {
 }
 
 export const DataTable = ({ filters = {} }: DataTableProps) => {
-  const [sorting, setSorting] = useState<SortingState>([]);
+  const [sorting, setSorting] = useState<SortingState>([{ id: 'data', desc: true }]);
   const [columnFilters, setColumnFilters] = useState<ColumnFiltersState>([]);
   const [columnVisibility, setColumnVisibility] = useState<VisibilityState>({});
-  const [pagination, setPagination] = useState({
-    pageIndex: 0,
-    pageSize: 25,
-  });
+  const [pageSize, setPageSize] = useState(25);
+
+  // Ordenação feita no servidor (o cursor codifica a chave de ordenação)
+  const orderBy = sorting.length > 0
+    ? sorting.map(sort => ({ field: sort.id, direction: sort.desc ? 'desc' as const : 'asc' as const }))
+    : [{ field: 'data', direction: 'desc' as const }];
 
-  // Fetch data
-  const { data, isLoading, error } = useQuery({
-    queryKey: ['table-data', filters, pagination.pageSize],
-    queryFn: () => analyticsAPI.query({
-      metrics: [
-        'COUNT(DISTINCT s.id) as qtd_vendas',
-        'SUM(total_amount) as faturamento',
-        'AVG(total_amount) as ticket_medio',
-        'COUNT(DISTINCT customer_id) as clientes_unicos'
-      ],
-      dimensions: ['data', 'nome_loja', 'canal_venda'],
-      filters: filters,
-      order_by: [{ field: 'data', direction: 'desc' }],
-      limit: 500
-    })
+  // Cursores das páginas já visitadas (paginação keyset no backend), válidos só para
+  // os mesmos filtros / ordenação / tamanho de página: mudou algo, volta para a primeira
+  const pageKey = JSON.stringify([filters, orderBy, pageSize]);
+  const [pages, setPages] = useState<{ key: string; cursors: string[] }>({ key: pageKey, cursors: [] });
+  const cursors = pages.key === pageKey ? pages.cursors : [];
+  const setCursors = (next: string[]) => setPages({ key: pageKey, cursors: next });
+  const cursor = cursors[cursors.length - 1];
+
+  // Query da tabela (também usada para exportar todos os registros)
+  const tableQuery: AnalyticsQueryRequest = {
+    metrics: ['qtd_vendas', 'faturamento', 'ticket_medio', 'clientes_unicos'],
+    dimensions: ['data', 'nome_loja', 'canal_venda'],
+    filters: filters,
+    order_by: orderBy
+  };
+
+  // Fetch data (uma página por requisição)
+  const { data, isLoading, error, isPlaceholderData } = useQuery({
+    queryKey: ['table-data', filters, orderBy, pageSize, cursor],
+    queryFn: () => analyticsAPI.query({ ...tableQuery, limit: pageSize, cursor }),
+    placeholderData: keepPreviousData
   });
+  // Enquanto a página nova carrega, o cursor exibido ainda é o da anterior
+  const nextCursor = isPlaceholderData ? undefined : data?.metadata?.next_cursor;
 
   // Log data for debugging
   if (data?.data) {
@@ -152,47 +161,16 @@ export const DataTable = ({ filters = {} }: DataTableProps) => {
       sorting,
       columnFilters,
       columnVisibility,
-      pagination,
     },
+    manualSorting: true,
+    manualPagination: true,
     onSortingChange: setSorting,
     onColumnFiltersChange: setColumnFilters,
     onColumnVisibilityChange: setColumnVisibility,
-    onPaginationChange: setPagination,
     getCoreRowModel: getCoreRowModel(),
-    getSortedRowModel: getSortedRowModel(),
     getFilteredRowModel: getFilteredRowModel(),
-    getPaginationRowModel: getPaginationRowModel(),
   });
 
-  // Export to CSV
-  const exportToCSV = () => {
-    const rows = table.getFilteredRowModel().rows;
-    if (rows.length === 0) return;
-
-    const headers = table.getVisibleFlatColumns().map(col => col.columnDef.header as string);
-    const csvContent = [
-      headers.join(','),
-      ...rows.map(row => 
-        table.getVisibleFlatColumns().map(col => {
-          const value = row.getValue(col.id);
-          if (value === null || value === undefined) return '';
-          // Escape values with commas or quotes
-          const stringValue = String(value);
-          if (stringValue.includes(',') || stringValue.includes('"')) {
-            return `"${stringValue.replace(/"/g, '""')}"`;
-          }
-          return stringValue;
-        }).join(',')
-      )
-    ].join('\n');
-
-    const blob = new Blob(['\ufeff' + csvContent], { type: 'text/csv;charset=utf-8;' });
-    const link = document.createElement('a');
-    link.href = URL.createObjectURL(blob);
-    link.download = `dados-analytics-${new Date().getTime()}.csv`;
-    link.click();
-  };
-
   // Column visibility menu
   const columnVisibilityMenu = {
     items: table.getAllColumns().map(column => ({
@@ -233,14 +211,11 @@ export const DataTable = ({ filters = {} }: DataTableProps) => {
               Colunas
             </Button>
           </Dropdown>
-          <Button
-            icon={<DownloadOutlined />}
-            onClick={exportToCSV}
-            size="small"
-            type="primary"
-          >
-            Exportar CSV
-          </Button>
+          <ExportButton
+            data={tableData}
+            filename="dados-analytics"
+            query={tableQuery}
+          />
         </Space>
       }
     >
@@ -322,7 +297,7 @@ export const DataTable = ({ filters = {} }: DataTableProps) => {
               </tbody>
               <tfoot>
                 <tr className="totals-row">
-                  <td colSpan={3}><strong>TOTAIS</strong></td>
+                  <td colSpan={3}><strong>TOTAIS (página)</strong></td>
                   <td><strong>{totals.qtd_vendas.toLocaleString('pt-BR')}</strong></td>
                   <td><strong>R$ {totals.faturamento.toLocaleString('pt-BR', { minimumFractionDigits: 2 })}</strong></td>
                   <td colSpan={2}></td>
@@ -335,52 +310,42 @@ export const DataTable = ({ filters = {} }: DataTableProps) => {
             <Space>
               <Button
                 size="small"
-                onClick={() => table.setPageIndex(0)}
-                disabled={!table.getCanPreviousPage()}
+                onClick={() => setCursors([])}
+                disabled={cursors.length === 0}
               >
                 {'<<'}
               </Button>
               <Button
                 size="small"
-                onClick={() => table.previousPage()}
-                disabled={!table.getCanPreviousPage()}
+                onClick={() => setCursors(cursors.slice(0, -1))}
+                disabled={cursors.length === 0}
               >
                 {'<'}
               </Button>
               <Button
                 size="small"
-                onClick={() => table.nextPage()}
-                disabled={!table.getCanNextPage()}
+                onClick={() => nextCursor && setCursors([...cursors, nextCursor])}
+                disabled={!nextCursor}
               >
                 {'>'}
               </Button>
-              <Button
-                size="small"
-                onClick={() => table.setPageIndex(table.getPageCount() - 1)}
-                disabled={!table.getCanNextPage()}
-              >
-                {'>>'}
-              </Button>
               <span style={{ marginLeft: 8 }}>
-                Página{' '}
-                <strong>
-                  {table.getState().pagination.pageIndex + 1} de {table.getPageCount()}
-                </strong>
+                Página <strong>{cursors.length + 1}</strong>
               </span>
               <Select
                 size="small"
-                value={table.getState().pagination.pageSize}
-                onChange={value => table.setPageSize(Number(value))}
+                value={pageSize}
+                onChange={value => setPageSize(Number(value))}
                 style={{ width: 120 }}
               >
-                {[10, 25, 50, 100].map(pageSize => (
-                  <Option key={pageSize} value={pageSize}>
-                    Mostrar {pageSize}
+                {[10, 25, 50, 100].map(size => (
+                  <Option key={size} value={size}>
+                    Mostrar {size}
                   </Option>
                 ))}
               </Select>
               <span style={{ marginLeft: 8 }}>
-                Total: <strong>{table.getFilteredRowModel().rows.length}</strong> registros
+                <strong>{table.getFilteredRowModel().rows.length}</strong> registros nesta página
               </span>
             </Space>
           </div>
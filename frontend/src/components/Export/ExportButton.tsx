@@ -5,15 +5,18 @@ import { saveAs } from 'file-saver';
 import * as XLSX from 'xlsx';
 import html2canvas from 'html2canvas';
 import { jsPDF } from 'jspdf';
+import { analyticsAPI } from '../../api/analytics';
+import type { AnalyticsQueryRequest, AnalyticsExportFormat } from '../../types/analytics';
 import './ExportButton.css';
 
 interface ExportButtonProps {
   data?: any[];
   filename?: string;
   elementId?: string; // ID do elemento para captura de screenshot
+  query?: AnalyticsQueryRequest; // Query de origem: exporta todos os registros pelo backend
 }
 
-export const ExportButton = ({ data = [], filename = 'export', elementId }: ExportButtonProps) => {
+export const ExportButton = ({ data = [], filename = 'export', elementId, query }: ExportButtonProps) => {
   
   // Export to CSV
   const exportToCSV = () => {
@@ -49,6 +52,23 @@ export const ExportButton = ({ data = [], filename = 'export', elementId }: Expo
     }
   };
 
+  // Export every row of the query (streamed by the backend, sem limite de linhas)
+  const exportFullQuery = async (format: AnalyticsExportFormat) => {
+    if (!query) return;
+
+    try {
+      message.loading('Exportando todos os registros...', 0);
+      const blob = await analyticsAPI.exportQuery(query, format);
+      saveAs(blob, `${filename}_${new Date().getTime()}.${format}`);
+      message.destroy();
+      message.success(`${format.toUpperCase()} exportado com sucesso!`);
+    } catch (error) {
+      message.destroy();
+      message.error(`Erro ao exportar ${format.toUpperCase()}`);
+      console.error(error);
+    }
+  };
+
   // Export to Excel
   const exportToExcel = () => {
     if (data.length === 0) {
@@ -196,6 +216,23 @@ export const ExportButton = ({ data = [], filename = 'export', elementId }: Expo
       onClick: exportToExcel,
       disabled: data.length === 0,
     },
+    ...(query
+      ? [
+          {
+            type: 'divider' as const,
+          },
+          {
+            key: 'csv-full',
+            label: 'Exportar todos os registros (CSV)',
+            onClick: () => exportFullQuery('csv'),
+          },
+          {
+            key: 'ndjson-full',
+            label: 'Exportar todos os registros (NDJSON)',
+            onClick: () => exportFullQuery('ndjson'),
+          },
+        ]
+      : []),
     {
       type: 'divider',
     },
@@ -0,0 +1,22 @@
+import { useEffect } from 'react';
+import { useQueryClient, type QueryKey } from '@tanstack/react-query';
+import { liveAPI } from '../api/live';
+import type { LiveSubscription } from '../types/analytics';
+
+/**
+ * Keep the react-query cache entry `queryKey` updated by the server:
+ * each pushed result replaces the cached data, so the component reading it
+ * with useQuery re-renders without polling.
+ */
+export const useLiveQuery = (queryKey: QueryKey, subscription: LiveSubscription) => {
+  const queryClient = useQueryClient();
+  // Reinscrever só quando a chave ou o request mudarem de fato
+  const signature = JSON.stringify([queryKey, subscription]);
+
+  useEffect(() => {
+    return liveAPI.subscribe(subscription, (result) => {
+      queryClient.setQueryData(queryKey, result);
+    });
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [queryClient, signature]);
+};
@@ -32,14 +32,6 @@ const churnAPI = {
     return response.json();
   },
 
-  async getAtRiskCustomers(minPurchases: number, daysInactive: number, limit: number) {
-    const response = await fetch(
-      `${API_BASE_URL}/api/v1/analytics/churn/at-risk?min_purchases=${minPurchases}&days_inactive=${daysInactive}&limit=${limit}`
-    );
-    if (!response.ok) throw new Error('Failed to fetch at-risk customers');
-    return response.json();
-  },
-
   async getRFMSegments() {
     const response = await fetch(
       `${API_BASE_URL}/api/v1/analytics/churn/rfm-segments`
@@ -76,13 +68,6 @@ export const ChurnDashboard = () => {
     refetchInterval: 60000
   });
 
-  // Fetch at-risk customers
-  const { data: atRiskData, isLoading: atRiskLoading } = useQuery({
-    queryKey: ['at-risk-customers', minPurchases, daysInactive],
-    queryFn: () => churnAPI.getAtRiskCustomers(minPurchases, daysInactive, 100),
-    refetchInterval: 60000
-  });
-
   // Fetch RFM segments
   // Note: RFM calculation doesn't use filters, but we include them in queryKey
   // to trigger re-render when filters change for visual consistency
@@ -253,12 +238,12 @@ export const ChurnDashboard = () => {
         </Col>
       </Row>
 
-      {/* At-Risk Customers Table */}
+      {/* At-Risk Customers Table (paginada no servidor, busca as próprias páginas) */}
       <Row style={{ marginTop: '16px' }}>
         <Col xs={24}>
           <AtRiskCustomersTable 
-            data={atRiskData?.customers || []} 
-            loading={atRiskLoading}
+            minPurchases={minPurchases}
+            daysInactive={daysInactive}
           />
         </Col>
       </Row>
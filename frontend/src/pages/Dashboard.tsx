@@ -1,7 +1,7 @@
 import React from 'react';
 import { useQuery } from '@tanstack/react-query';
 import { useTranslation } from 'react-i18next';
-import { analyticsAPI } from '../api/analytics';
+import { analyticsAPI, liveKPIRequest } from '../api/analytics';
 import KPICard from '../components/KPICard';
 import FilterPanel from '../components/Filters/FilterPanel';
 import { PeriodComparison } from '../components/PeriodComparison';
@@ -9,6 +9,7 @@ import { DataTable } from '../components/DataTable';
 import { ExportButton } from '../components/Export';
 import { DashboardManager } from '../components/DashboardManager';
 import { useFilters, getAPIFilters } from '../hooks/useFilters';
+import { useLiveQuery } from '../hooks/useLiveQuery';
 import { 
   SalesChannelChart, 
   TopProductsChart, 
@@ -25,8 +26,19 @@ const Dashboard: React.FC = () => {
   const { data: kpiData, isLoading, error } = useQuery({
     queryKey: ['kpis', apiFilters],
     queryFn: () => analyticsAPI.getKPIs(apiFilters),
-    refetchInterval: 30000, // Refresh every 30 seconds
   });
+  // Atualizações enviadas pelo servidor (substitui o polling)
+  useLiveQuery(['kpis', apiFilters], { kpis: liveKPIRequest(apiFilters) });
+
+  const { data: freshness } = useQuery({
+    queryKey: ['freshness'],
+    queryFn: analyticsAPI.getFreshness,
+    refetchInterval: 60000,
+  });
+  // A tabela de resumo mais atrasada define o atraso dos dados exibidos
+  const summaryLag = freshness?.tables.length
+    ? Math.max(...freshness.tables.map((table) => table.lag_seconds ?? 0))
+    : null;
 
   if (isLoading) {
     return (
@@ -120,6 +132,11 @@ const Dashboard: React.FC = () => {
         <footer className="dashboard-footer">
           <span>Tempo de consulta: {kpiData.metadata.query_time_ms.toFixed(2)}ms</span>
           <span>Total de registros: {kpiData.metadata.total_rows}</span>
+          {summaryLag !== null && (
+            <span>
+              Dados agregados: {summaryLag > 0 ? `atraso de ${Math.round(summaryLag / 60)} min` : 'atualizados'}
+            </span>
+          )}
         </footer>
       )}
     </div>
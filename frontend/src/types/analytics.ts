@@ -10,6 +10,8 @@ export interface QueryMetadata {
   total_rows: number;
   query_time_ms: number;
   cached: boolean;
+  source?: string;
+  next_cursor?: string | null; // token da próxima página (paginação por cursor)
   timestamp: string;
 }
 
@@ -33,6 +35,7 @@ export interface AnalyticsQueryRequest {
   }>;
   limit?: number;
   offset?: number;
+  cursor?: string; // metadata.next_cursor da página anterior
 }
 
 export interface AnalyticsQueryResponse {
@@ -40,6 +43,17 @@ export interface AnalyticsQueryResponse {
   metadata: QueryMetadata;
 }
 
+export interface AnalyticsBatchRequest {
+  queries: AnalyticsQueryRequest[];
+}
+
+export type AnalyticsExportFormat = 'csv' | 'ndjson';
+
+export interface AnalyticsBatchResponse {
+  results: AnalyticsQueryResponse[];
+  metadata: QueryMetadata;
+}
+
 export interface DimensionValue {
   id: string | number;
   label: string;
@@ -51,3 +65,34 @@ export interface DimensionValuesResponse {
   values: DimensionValue[];
   total: number;
 }
+
+export interface SummaryTableFreshness {
+  name: string;
+  last_sale_id: number;
+  refreshed_at: string | null;
+  age_seconds: number | null;
+  duration_ms: number | null;
+  days_refreshed: number | null;
+  rows_written: number | null;
+  pending_sales: number;
+  lag_seconds: number | null;
+}
+
+export interface DataFreshness {
+  interval_seconds: number;
+  runs: number;
+  failures: number;
+  tables: SummaryTableFreshness[];
+}
+
+export interface LiveKPIRequest {
+  start_date?: string;
+  end_date?: string;
+  filters?: Record<string, any>;
+  hours?: number;
+}
+
+// Um widget do dashboard ao vivo: uma query ou os cards de KPI
+export type LiveSubscription =
+  | { query: AnalyticsQueryRequest; kpis?: never }
+  | { kpis: LiveKPIRequest; query?: never };